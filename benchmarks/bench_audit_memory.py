@@ -0,0 +1,87 @@
+"""
+Peak memory of the audit hashing: whole file read against chunked hashing.
+
+Every strategy is run in a separate process, so its peak RSS is not
+affected by the other one.
+
+    $ python benchmarks/bench_audit_memory.py [size in MiB]
+"""
+import os
+import subprocess
+import sys
+import resource
+import tempfile
+from hashlib import sha256
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metacore import blobs
+
+
+__author__ = 'karatel'
+
+
+SEED = sha256(b'seed').hexdigest()
+
+
+def read_whole(path):
+    with open(path, 'rb') as f:
+        file_data = f.read()
+    return sha256(file_data + SEED.encode()).hexdigest()
+
+
+def read_chunked(path):
+    return blobs.hash_chunks(blobs.iter_file(path), SEED.encode())
+
+
+STRATEGIES = {
+    'whole': read_whole,
+    'chunked': read_chunked
+}
+
+
+def peak_rss():
+    """
+    Get peak RSS of the current process in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+    return peak / 1024.0 ** (2 if sys.platform == 'darwin' else 1)
+
+
+def run_child(strategy, path):
+    baseline = peak_rss()
+    digest = STRATEGIES[strategy](path)
+    print('{} {:.1f} {:.1f}'.format(digest, baseline, peak_rss()))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            chunk = os.urandom(1024 * 1024)
+            for i in range(size):
+                fp.write(chunk)
+
+        print('file size: {} MiB'.format(size))
+        digests = set()
+        for strategy in ('whole', 'chunked'):
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--child', strategy, path]
+            ).decode().split()
+            digests.add(output[0])
+            print('{:>8}: peak RSS {:>7} MiB (baseline {} MiB)'.format(
+                strategy, output[2], output[1]))
+
+        assert len(digests) == 1, 'strategies give different responses'
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        run_child(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,89 @@
+"""
+Latency and throughput of the blob commits for every durability level.
+
+Every level saves the same number of blobs from several threads, like
+concurrent uploads. Run it on the storage volume, tmpfs ignores syncs.
+
+    $ python benchmarks/bench_durability.py [folder] [blobs] [size in KiB] \
+[threads]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from hashlib import sha256
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metacore import blobs
+
+
+__author__ = 'karatel'
+
+
+def run_level(folder, durability, count, data, threads):
+    """
+    Save the blobs and measure every commit.
+    :return: commit latencies in seconds and the total time
+    """
+    latencies = []
+    lock = threading.Lock()
+    names = iter(range(count))
+
+    def work():
+        while True:
+            with lock:
+                number = next(names, None)
+            if number is None:
+                return
+            data_hash = sha256(
+                '{} {}'.format(durability, number).encode()
+            ).hexdigest()
+            started = time.time()
+            blobs.save_blob(folder, data_hash, [data],
+                            durability=durability)
+            with lock:
+                latencies.append(time.time() - started)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sorted(latencies), time.time() - started
+
+
+def main():
+    base = sys.argv[1] if len(sys.argv) > 1 else None
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+    threads = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+
+    data = os.urandom(size * 1024)
+    print('{} blobs of {} KiB, {} threads'.format(count, size, threads))
+    print('{:>18} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'durability', 'mean ms', 'p50 ms', 'p99 ms', 'blobs/s', 'MiB/s'))
+    for durability in blobs.DURABILITY_LEVELS:
+        folder = tempfile.mkdtemp(dir=base)
+        try:
+            latencies, total = run_level(folder, durability, count, data,
+                                         threads)
+        finally:
+            shutil.rmtree(folder)
+
+        print('{:>18} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>9.1f}'.format(
+            durability,
+            1000 * sum(latencies) / len(latencies),
+            1000 * latencies[len(latencies) // 2],
+            1000 * latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * 0.99))],
+            count / total,
+            count * size / 1024.0 / total
+        ))
+
+
+if __name__ == '__main__':
+    main()
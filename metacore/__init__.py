@@ -1 +1,5 @@
-__all__ = ['config', 'database', 'error_codes', 'node', 'processor', 'storj']
\ No newline at end of file
+__all__ = ['auditlog', 'blacklist', 'blobs', 'cache', 'capacity',
+           'chunkstore', 'config', 'database', 'error_codes', 'fileindex',
+           'merkle', 'node', 'processor', 'profiling', 'reconcile',
+           'recovery', 'scrubber', 'shaping', 'storj', 'tracing', 'traffic',
+           'uploads']
\ No newline at end of file
@@ -0,0 +1,164 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import and_
+from sqlalchemy.exc import OperationalError
+
+from metacore.database import audit, engine
+
+
+__author__ = 'karatel'
+
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog(object):
+    """
+    Write-behind log of the audits.
+    Audits are buffered in memory and inserted in one transaction when
+    there are `batch_size` of them or the oldest one waits for
+    `flush_interval` seconds, so audits don't wait for a commit each.
+    Counts include the buffered audits, so the rate limits of a worker
+    are exact. Audits buffered by other workers are counted after they
+    are flushed. Overdue audits are flushed by a timer thread, and by
+    flush_due() for the servers running no threads of the application.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=1.0, clock=time.time):
+        """
+        :param batch_size: number of the buffered audits flushed at once
+        :param flush_interval: maximal time in seconds an audit is buffered
+        :param clock: time source
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._clock = clock
+
+        self._lock = threading.RLock()
+        self._pending = []
+        self._first_at = None
+        self._timer = None
+        # number of the flushes, counts taken across one are retried
+        self._flushes = 0
+
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, data_hash, is_owner, mode):
+        """
+        Buffer the audit.
+        :param data_hash: SHA-256 hash of the file
+        :param is_owner: True if the audit is made by the file owner
+        :param mode: audit mode, 'full' or 'merkle'
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self._pending.append({
+                'file_hash': data_hash, 'is_owners': is_owner,
+                'mode': mode, 'made_at': datetime.now()
+            })
+            if self._first_at is None:
+                self._first_at = self._clock()
+
+            if len(self._pending) >= self.batch_size or \
+                    self._clock() - self._first_at >= self.flush_interval:
+                self.flush()
+            elif self._timer is None:
+                self._schedule(self.flush_interval)
+
+    def count(self, data_hash, is_owner, mode, since):
+        """
+        Count the audits of the file, both stored and buffered.
+        :param data_hash: SHA-256 hash of the file
+        :param is_owner: count the audits made by the owner or by others
+        :param mode: audit mode, 'full' or 'merkle'
+        :param since: datetime of the oldest counted audit
+        :return: number of the audits
+        :rtype: int
+        """
+        query = audit.select(and_(
+            audit.c.file_hash == data_hash,
+            audit.c.is_owners == is_owner,
+            audit.c.mode == mode,
+            audit.c.made_at >= since
+        )).count()
+        while True:
+            with self._lock:
+                flushes = self._flushes
+                pending = sum(
+                    1 for _ in self._pending
+                    if _['file_hash'] == data_hash and
+                    _['is_owners'] == is_owner and _['mode'] == mode and
+                    _['made_at'] >= since
+                )
+            # the lock isn't held by the query, so the audits flushed
+            # meanwhile would be counted twice
+            stored = query.scalar()
+            with self._lock:
+                if flushes == self._flushes:
+                    return stored + pending
+
+    def flush_due(self):
+        """
+        Flush the buffered audits if the oldest one waits too long.
+        :return: number of the inserted audits
+        :rtype: int
+        """
+        first_at = self._first_at
+        if first_at is None or \
+                self._clock() - first_at < self.flush_interval:
+            return 0
+        return self.flush()
+
+    def flush(self):
+        """
+        Insert the buffered audits.
+        Audits are kept buffered if the database is busy.
+        :return: number of the inserted audits
+        :rtype: int
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return 0
+
+            try:
+                with engine.begin() as connection:
+                    connection.execute(audit.insert(), self._pending)
+            except OperationalError:
+                logger.warning('Audits are not flushed: %d buffered',
+                               len(self._pending))
+                self._schedule(self.flush_interval)
+                return 0
+
+            flushed = len(self._pending)
+            self._pending = []
+            self._first_at = None
+            self._flushes += 1
+            return flushed
+
+    def _schedule(self, delay):
+        self._timer = threading.Timer(delay, self._flush_later)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_later(self):
+        with self._lock:
+            self._timer = None
+            if not self._pending:
+                return
+            wait = self._first_at + self.flush_interval - self._clock()
+            if wait > 0:
+                # the buffer was flushed and filled again meanwhile
+                self._schedule(wait)
+                return
+            self.flush()
@@ -0,0 +1,295 @@
+import binascii
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+
+
+__author__ = 'karatel'
+
+
+MAGIC = b'MBLK'
+VERSION = 1
+DIGEST_SIZE = 32
+FINGERPRINT_SIZE = 64
+# magic, version, compiled size of the text file, number of digests,
+# Bloom filter size in bits, number of its hash functions,
+# fingerprint length and the fingerprint, which is the end
+# of the compiled text
+HEADER = struct.Struct('>4sBQQQBB{}s'.format(FINGERPRINT_SIZE))
+
+BLOOM_BITS_PER_DIGEST = 10
+BLOOM_HASHES = 7
+# Bloom filter positions are taken from the digest, which is uniform already
+BLOOM_POSITIONS = struct.Struct('>{}I'.format(BLOOM_HASHES))
+
+hash_line = re.compile(br'^\s*([a-fA-F\d]{64})\s*$')
+
+
+class Blacklist(object):
+    """
+    Blacklist of the hashes compiled from the text file.
+    The compiled file keeps a Bloom filter and the sorted binary digests.
+    It's memory-mapped, so it's shared by all the workers, and searched
+    with the filter first and then by bisection.
+    Hashes appended to the text file after compiling are kept in memory
+    until there are more than `tail_limit` of them, then the file is
+    compiled again. Other changes of the text file are compiled at once.
+    """
+
+    def __init__(self, source_path, compiled_path, tail_limit=10000):
+        """
+        :param source_path: text file with a hash per line
+        :param compiled_path: compiled file path
+        :param tail_limit: maximal number of the appended hashes
+            kept in memory
+        """
+        self.source_path = source_path
+        self.compiled_path = compiled_path
+        self.tail_limit = tail_limit
+
+        self._lock = threading.Lock()
+        self._source_state = None
+        self._compiled_state = None
+        # mmap, header, offset of the digests
+        self._index = None
+        self._tail = frozenset()
+
+    def __contains__(self, data_hash):
+        """
+        Check if the hash is blocked.
+        :param data_hash: hex SHA-256 hash
+        :rtype: bool
+        """
+        try:
+            digest = binascii.unhexlify(data_hash)
+        except (TypeError, ValueError):
+            return False
+        if len(digest) != DIGEST_SIZE:
+            return False
+
+        self.refresh()
+        return digest in self._tail or _search(self._index, digest)
+
+    def __len__(self):
+        self.refresh()
+        return self._index[1][3] + len(self._tail)
+
+    def blocked(self, hashes):
+        """
+        Check many hashes at once, the text file is checked once.
+        :param hashes: iterable of hex SHA-256 hashes
+        :return: set of the blocked hashes
+        :rtype: set
+        """
+        self.refresh()
+        index, tail = self._index, self._tail
+        result = set()
+        if not tail and not index[1][3]:
+            return result
+        for data_hash in hashes:
+            try:
+                digest = binascii.unhexlify(data_hash)
+            except (TypeError, ValueError):
+                continue
+            if len(digest) == DIGEST_SIZE and (
+                    digest in tail or _search(index, digest)):
+                result.add(data_hash)
+        return result
+
+    def refresh(self):
+        """
+        Follow the changes of the text file.
+        :return: None
+        :rtype: NoneType
+        """
+        source_state = _file_state(self.source_path)
+        if self._index is not None and source_state == self._source_state:
+            return
+
+        with self._lock:
+            if self._index is not None and \
+                    source_state == self._source_state:
+                return
+            self._map()
+            tail = self._read_tail()
+            if tail is None or len(tail) > self.tail_limit:
+                self.compile()
+                self._map()
+                tail = self._read_tail() or ()
+            self._tail = frozenset(tail)
+            self._source_state = source_state
+
+    def compile(self):
+        """
+        Compile the whole text file.
+        The compiled file is replaced atomically, so workers may compile
+        it at the same time.
+        :return: number of the compiled hashes
+        :rtype: int
+        """
+        try:
+            with open(self.source_path, 'rb') as fp:
+                source = fp.read()
+        except (IOError, OSError):
+            source = b''
+
+        digests = sorted(set(_read_digests(source.splitlines())))
+        bloom_bits = max(8, len(digests) * BLOOM_BITS_PER_DIGEST)
+        bloom_bits += -bloom_bits % 8
+        bloom = bytearray(bloom_bits // 8)
+        for digest in digests:
+            for position in BLOOM_POSITIONS.unpack_from(digest):
+                position %= bloom_bits
+                bloom[position >> 3] |= 1 << (position & 7)
+
+        fingerprint = source[-FINGERPRINT_SIZE:]
+        folder = os.path.dirname(os.path.abspath(self.compiled_path))
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(HEADER.pack(MAGIC, VERSION, len(source),
+                                     len(digests), bloom_bits,
+                                     BLOOM_HASHES, len(fingerprint),
+                                     fingerprint))
+                fp.write(bytes(bloom))
+                fp.write(b''.join(digests))
+            os.rename(temp_path, self.compiled_path)
+        except (IOError, OSError):
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        return len(digests)
+
+    def _map(self):
+        """
+        Map the compiled file if it's changed, compile it if it's missing
+        or broken.
+        """
+        compiled_state = _file_state(self.compiled_path)
+        if compiled_state is not None and \
+                compiled_state == self._compiled_state:
+            return
+
+        index = _open_index(self.compiled_path)
+        if index is None:
+            self.compile()
+            compiled_state = _file_state(self.compiled_path)
+            index = _open_index(self.compiled_path)
+
+        # the old map is closed when it's not used by lookups anymore
+        self._index = index
+        self._compiled_state = compiled_state
+
+    def _read_tail(self):
+        """
+        Read the hashes appended after the compiled part of the text file.
+        :return: set of digests or None if the compiled part is changed
+        """
+        header = self._index[1]
+        compiled_size, fingerprint = header[2], header[7][:header[6]]
+        try:
+            with open(self.source_path, 'rb') as fp:
+                fp.seek(0, os.SEEK_END)
+                if fp.tell() < compiled_size:
+                    return None
+                fp.seek(compiled_size - len(fingerprint))
+                if fp.read(len(fingerprint)) != fingerprint:
+                    return None
+                return set(_read_digests(fp.read().splitlines()))
+        except (IOError, OSError):
+            return None if compiled_size else set()
+
+
+def _file_state(path):
+    """
+    Get the values changed with the file.
+    :return: tuple of the inode, size and modification time
+        or None if there is no file
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime
+
+
+def _read_digests(lines):
+    """
+    Parse the hex hashes of the text lines, other lines are skipped.
+    :return: generator of binary digests
+    """
+    for line in lines:
+        match = hash_line.match(line)
+        if match:
+            yield binascii.unhexlify(match.group(1))
+
+
+def _open_index(path):
+    """
+    Map the compiled file.
+    :return: tuple of the mmap, the header and the offset of the digests
+        or None if the file is missing or broken
+    """
+    try:
+        with open(path, 'rb') as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        header = HEADER.unpack_from(mapped)
+    except struct.error:
+        return None
+    magic, version, _, count, bloom_bits = header[:5]
+    offset = HEADER.size + bloom_bits // 8
+    if magic != MAGIC or version != VERSION or \
+            len(mapped) != offset + count * DIGEST_SIZE:
+        return None
+    return mapped, header, offset
+
+
+def _search(index, digest):
+    """
+    Look for the digest in the compiled file.
+    """
+    mapped, header, offset = index
+    count, bloom_bits = header[3], header[4]
+    if not count:
+        return False
+
+    for position in BLOOM_POSITIONS.unpack_from(digest):
+        position %= bloom_bits
+        if not ord(mapped[HEADER.size + (position >> 3):
+                          HEADER.size + (position >> 3) + 1]) & \
+                1 << (position & 7):
+            return False
+
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        start = offset + middle * DIGEST_SIZE
+        current = mapped[start:start + DIGEST_SIZE]
+        if current < digest:
+            low = middle + 1
+        elif current > digest:
+            high = middle
+        else:
+            return True
+    return False
+
+
+def main():
+    from metacore.processor import app
+
+    print(Blacklist(app.config['BLACKLIST_FILE'],
+                    app.config['BLACKLIST_COMPILED']).compile())
+
+
+if __name__ == '__main__':
+    main()
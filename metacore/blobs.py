@@ -0,0 +1,371 @@
+import os
+import tempfile
+import threading
+import zlib
+from hashlib import sha256
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+__author__ = 'karatel'
+
+
+CHUNK_SIZE = 64 * 1024
+
+# name of the codec -> compressor factory
+COMPRESSORS = {'zlib': zlib.compressobj}
+if lzma is not None:
+    COMPRESSORS['lzma'] = lzma.LZMACompressor
+
+TEMP_PREFIX = '.tmp-'
+
+# durability of the committed files: no syncs, sync of the file data,
+# sync of the file data and of the folder entry, and the same syncs
+# batched with the concurrent commits
+DURABILITY_NONE = 'none'
+DURABILITY_DATA = 'fdatasync'
+DURABILITY_FULL = 'fdatasync+dirsync'
+DURABILITY_GROUP = 'group'
+DURABILITY_LEVELS = (DURABILITY_NONE, DURABILITY_DATA, DURABILITY_FULL,
+                     DURABILITY_GROUP)
+
+# fdatasync() isn't available on OS X
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+
+class DecodingError(ValueError):
+    """
+    Stored data can't be decoded with its codec.
+    """
+
+
+def blob_path(folder, data_hash):
+    """
+    Build the path of the stored blob.
+    :param folder: storage folder
+    :param data_hash: SHA-256 hash of the blob
+    :return: blob path
+    :rtype: str
+    """
+    return os.path.join(folder, data_hash)
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE, offset=0, size=None):
+    """
+    Read the file chunk by chunk.
+    :param path: file path
+    :param chunk_size: size of the read chunks in bytes
+    :param offset: position to start reading from
+    :param size: maximal number of the read bytes, all the rest if None
+    :return: generator of binary chunks
+    """
+    with open(path, 'rb') as fp:
+        if offset:
+            fp.seek(offset)
+        if size is None:
+            for chunk in iter(lambda: fp.read(chunk_size), b''):
+                yield chunk
+            return
+        while size > 0:
+            chunk = fp.read(min(chunk_size, size))
+            if not chunk:
+                return
+            size -= len(chunk)
+            yield chunk
+
+
+def iter_blob(path, codec=None, chunk_size=CHUNK_SIZE):
+    """
+    Read the stored blob and decode it chunk by chunk.
+    :param path: blob path
+    :param codec: name of the codec the blob is stored with
+    :param chunk_size: size of the read chunks in bytes
+    :return: generator of original data chunks
+    """
+    return decompress(iter_file(path, chunk_size), codec, chunk_size)
+
+
+def decompress(chunks, codec, chunk_size=CHUNK_SIZE):
+    """
+    Decompress the data stream.
+    No more than chunk_size bytes are decompressed at once, so highly
+    compressed data doesn't blow up in memory.
+    :param chunks: iterable of compressed chunks
+    :param codec: name of the codec or None for raw data
+    :param chunk_size: maximal size of the decompressed chunks
+    :return: generator of decompressed chunks
+    """
+    if not codec:
+        for chunk in chunks:
+            yield chunk
+        return
+
+    if codec not in _DECOMPRESSORS:
+        raise DecodingError('Unknown codec: {}'.format(codec))
+
+    try:
+        for data in _DECOMPRESSORS[codec](chunks, chunk_size):
+            yield data
+    except _CODEC_ERRORS as error:
+        raise DecodingError(error)
+
+
+def _zlib_decompress(chunks, chunk_size):
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, chunk_size)
+            chunk = decompressor.unconsumed_tail
+            if data:
+                yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+    if not getattr(decompressor, 'eof', True):
+        raise EOFError('Compressed data ended before the end-of-stream')
+
+
+def _lzma_decompress(chunks, chunk_size):
+    decompressor = lzma.LZMADecompressor()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, chunk_size)
+        if data:
+            yield data
+        while not (decompressor.needs_input or decompressor.eof):
+            data = decompressor.decompress(b'', chunk_size)
+            if data:
+                yield data
+    if not decompressor.eof:
+        raise EOFError('Compressed data ended before the end-of-stream')
+
+
+_DECOMPRESSORS = {'zlib': _zlib_decompress}
+_CODEC_ERRORS = (zlib.error, EOFError)
+if lzma is not None:
+    _DECOMPRESSORS['lzma'] = _lzma_decompress
+    _CODEC_ERRORS += (lzma.LZMAError,)
+
+
+def hash_chunks(chunks, suffix=None):
+    """
+    Calculate SHA-256 of the chunked data without joining it in memory.
+    :param chunks: iterable of binary chunks
+    :param suffix: optional bytes appended to the hashed data
+    :return: hex digest
+    :rtype: str
+    """
+    digest = sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    if suffix:
+        digest.update(suffix)
+    return digest.hexdigest()
+
+
+def save_blob(folder, data_hash, chunks, codecs=(), min_saving=0.1,
+              chunk_size=CHUNK_SIZE, durability=DURABILITY_NONE):
+    """
+    Save the blob to the storage folder.
+    The data is written to a temporary file first. When codecs are given,
+    the beginning of the data is probed with each of them and the data is
+    compressed with the best one, but it's kept only if it saves at least
+    min_saving of the size.
+    :param folder: storage folder
+    :param data_hash: SHA-256 hash of the blob
+    :param chunks: iterable of binary chunks
+    :param codecs: names of the codecs to try
+    :param min_saving: minimal saved fraction of the size to keep
+        the compressed data
+    :param chunk_size: size of the chunks read from the temporary file
+    :param durability: durability level of the commit
+    :return: name of the used codec (None for raw data) and stored size
+    :rtype: tuple
+    """
+    raw_path = write_temp(folder, chunks)
+    codec, stored_path = None, raw_path
+    try:
+        codec = _probe_codec(raw_path, codecs, min_saving, chunk_size)
+        if codec:
+            raw_size = os.path.getsize(raw_path)
+            stored_path = write_temp(
+                folder, _compress(iter_file(raw_path, chunk_size), codec)
+            )
+            if os.path.getsize(stored_path) > raw_size * (1 - min_saving):
+                os.unlink(stored_path)
+                codec, stored_path = None, raw_path
+
+        stored_size = os.path.getsize(stored_path)
+        commit(stored_path, blob_path(folder, data_hash), durability)
+    finally:
+        for path in (raw_path, stored_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    return codec, stored_size
+
+
+def write_temp(folder, chunks):
+    """
+    Write the data to a new temporary file.
+    :param folder: folder to create the file in
+    :param chunks: iterable of binary chunks
+    :return: temporary file path
+    :rtype: str
+    """
+    fd, path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+    except:
+        os.unlink(path)
+        raise
+    return path
+
+
+def commit(temp_path, path, durability=DURABILITY_NONE):
+    """
+    Atomically move the written temporary file to its place.
+    With the durability levels other than 'none' the data is synced
+    before the move, so a crash never leaves a truncated file in place.
+    :param temp_path: temporary file path
+    :param path: destination path
+    :param durability: one of DURABILITY_LEVELS
+    :return: None
+    :rtype: NoneType
+    """
+    if durability == DURABILITY_NONE:
+        os.rename(temp_path, path)
+    elif durability == DURABILITY_GROUP:
+        group_commit.commit(temp_path, path)
+    elif durability in (DURABILITY_DATA, DURABILITY_FULL):
+        sync_file(temp_path)
+        os.rename(temp_path, path)
+        if durability == DURABILITY_FULL:
+            sync_file(os.path.dirname(os.path.abspath(path)))
+    else:
+        raise ValueError('Unknown durability level: {}'.format(durability))
+
+
+def sync_file(path):
+    """
+    Flush the file data or the folder entries to the disk.
+    :param path: file or folder path
+    :return: None
+    :rtype: NoneType
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        _fdatasync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupCommit(object):
+    """
+    Commits with the folder syncs shared by concurrent callers.
+    Every caller syncs the data of its own file before joining the batch,
+    so the file syncs run in parallel. The first caller becomes the leader
+    and commits the whole batch: it moves the files and syncs every folder
+    once. Callers which come meanwhile wait for the next batch, so under
+    load a sync of a folder covers many files.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._pending = []
+        self._leading = False
+
+    def commit(self, temp_path, path):
+        """
+        Commit the file with the current batch.
+        :param temp_path: temporary file path
+        :param path: destination path
+        :return: None
+        :rtype: NoneType
+        """
+        sync_file(temp_path)
+
+        # the outcome of the batch: [finished, error]
+        task = [False, None]
+        with self._lock:
+            self._pending.append((temp_path, path, task))
+            while self._leading and not task[0]:
+                self._done.wait()
+            if task[0]:
+                if task[1] is not None:
+                    raise task[1]
+                return
+            self._leading = True
+            batch, self._pending = self._pending, []
+
+        try:
+            self._commit_batch(batch)
+        except Exception as e:
+            for _, _, batch_task in batch:
+                batch_task[1] = batch_task[1] or e
+            raise
+        finally:
+            with self._lock:
+                for _, _, batch_task in batch:
+                    batch_task[0] = True
+                self._leading = False
+                self._done.notify_all()
+
+        if task[1] is not None:
+            raise task[1]
+
+    @staticmethod
+    def _commit_batch(batch):
+        folders = set()
+        for temp_path, path, task in batch:
+            try:
+                os.rename(temp_path, path)
+                folders.add(os.path.dirname(os.path.abspath(path)))
+            except (IOError, OSError) as e:
+                task[1] = e
+
+        for folder in folders:
+            try:
+                sync_file(folder)
+            except (IOError, OSError) as e:
+                for temp_path, path, task in batch:
+                    if task[1] is None and \
+                            os.path.dirname(os.path.abspath(path)) == folder:
+                        task[1] = e
+
+
+group_commit = GroupCommit()
+
+
+def _compress(chunks, codec):
+    compressor = COMPRESSORS[codec]()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _probe_codec(path, codecs, min_saving, probe_size):
+    """
+    Choose the codec which compresses the beginning of the file best.
+    :return: codec name or None if no codec saves enough
+    """
+    with open(path, 'rb') as fp:
+        probe = fp.read(probe_size)
+    if not probe:
+        return None
+
+    best_codec, best_size = None, len(probe) * (1 - min_saving)
+    for codec in codecs:
+        if codec not in COMPRESSORS:
+            continue
+        size = sum(len(_) for _ in _compress([probe], codec))
+        if size <= best_size:
+            best_codec, best_size = codec, size
+    return best_codec
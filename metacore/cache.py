@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+
+__author__ = 'karatel'
+
+
+class BlobCache(object):
+    """
+    Byte-bounded LRU cache of small blobs.
+    A blob is admitted only after it was requested `min_hits` times,
+    so one-off downloads don't evict the popular blobs.
+    """
+
+    def __init__(self, capacity, max_entry_size, min_hits=2,
+                 history_size=10000):
+        """
+        :param capacity: maximal total size of cached blobs in bytes,
+            zero disables the cache
+        :param max_entry_size: maximal size of one cached blob in bytes
+        :param min_hits: number of requests needed to admit a blob
+        :param history_size: number of tracked request counters, all the
+            counters are halved when it's exceeded
+        """
+        self.capacity = capacity
+        self.max_entry_size = max_entry_size
+        self.min_hits = min_hits
+        self.history_size = history_size
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._frequency = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Get the cached blob and count the request.
+        :param key: blob hash
+        :return: blob data or None if the blob is not cached
+        :rtype: bytes
+        """
+        with self._lock:
+            self._count(key)
+            data = self._entries.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries[key] = data
+            self.hits += 1
+            return data
+
+    def admits(self, key, size):
+        """
+        Check if the blob is worth caching.
+        :param key: blob hash
+        :param size: blob size in bytes
+        :rtype: bool
+        """
+        return (0 < size <= min(self.max_entry_size, self.capacity) and
+                self._frequency.get(key, 0) >= self.min_hits)
+
+    def put(self, key, data):
+        """
+        Cache the blob if it's admitted, evicting least recently used
+        blobs when the cache is full.
+        :param key: blob hash
+        :param data: blob data
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            if key in self._entries or not self.admits(key, len(data)):
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.capacity:
+                evicted_key, evicted_data = self._entries.popitem(last=False)
+                self.size -= len(evicted_data)
+
+    @property
+    def stats(self):
+        """
+        Aggregate cache usage metrics.
+        :return: size, number of entries, hits, misses and hit rate
+        :rtype: dict
+        """
+        requests = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'size': self.size,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / requests if requests else 0.0
+        }
+
+    def _count(self, key):
+        self._frequency[key] = self._frequency.get(key, 0) + 1
+        if len(self._frequency) > self.history_size:
+            self._frequency = dict(
+                (_key, count // 2)
+                for _key, count in self._frequency.items() if count > 1
+            )
@@ -0,0 +1,101 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, literal, select
+
+from metacore.database import USED_SPACE_COUNTER, counters, reservations
+
+
+__author__ = 'karatel'
+
+
+class CapacityLedger(object):
+    """
+    Reserve storage space for uploads before receiving their data.
+    Reservations are kept in the database, so they are shared by all
+    the workers.
+    """
+
+    def __init__(self, statvfs_ttl=5, reservation_ttl=60 * 60,
+                 clock=time.time):
+        """
+        :param statvfs_ttl: lifetime of the cached free space in seconds
+        :param reservation_ttl: lifetime of a reservation in seconds,
+            reservations of crashed workers are dropped after it
+        :param clock: time source
+        """
+        self.statvfs_ttl = statvfs_ttl
+        self.reservation_ttl = reservation_ttl
+        self._clock = clock
+        self._free_space = {}
+
+    def free_space(self, folder):
+        """
+        Get the free space available on the folder volume.
+        :param folder: checked folder
+        :return: free space in bytes
+        :rtype: int
+        """
+        now = self._clock()
+        cached = self._free_space.get(folder)
+        if cached is None or now - cached[0] > self.statvfs_ttl:
+            stat = os.statvfs(folder)
+            cached = (now, stat.f_bavail * stat.f_frsize)
+            self._free_space[folder] = cached
+        return cached[1]
+
+    def reserve(self, size, capacity, folder, ttl=None):
+        """
+        Atomically reserve the space if it fits both the Node capacity
+        (minus used physical and reserved bytes) and the free space
+        of the volume (minus reserved bytes).
+        :param size: reserved size in bytes
+        :param capacity: Node capacity in bytes
+        :param folder: folder the data will be saved to
+        :param ttl: lifetime of the reservation in seconds,
+            reservation_ttl by default
+        :return: reservation id or None if there is no enough space
+        :rtype: int
+        :raises ValueError: if the size isn't positive
+        """
+        if size <= 0:
+            raise ValueError('Reserved size must be positive: {}'.format(size))
+
+        now = datetime.now()
+        reservations.delete().where(
+            reservations.c.expires_at <= now
+        ).execute()
+
+        # kept by triggers, see database._count_used_space()
+        used = select([counters.c.value]).where(
+            counters.c.name == USED_SPACE_COUNTER
+        ).as_scalar()
+        reserved = select(
+            [func.coalesce(func.sum(reservations.c.size), 0)]
+        ).as_scalar()
+
+        result = reservations.insert().from_select(
+            ['size', 'expires_at'],
+            select([
+                literal(size),
+                literal(now + timedelta(seconds=ttl or self.reservation_ttl))
+            ]).where(and_(
+                used + reserved + size <= capacity,
+                reserved + size <= self.free_space(folder)
+            ))
+        ).execute()
+
+        if result.rowcount == 1:
+            return result.lastrowid
+
+    def release(self, reservation_id):
+        """
+        Give the reserved space back.
+        :param reservation_id: id of the reservation
+        :return: None
+        :rtype: NoneType
+        """
+        reservations.delete().where(
+            reservations.c.id == reservation_id
+        ).execute()
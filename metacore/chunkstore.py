@@ -0,0 +1,207 @@
+import os
+import struct
+from hashlib import sha256
+
+from sqlalchemy import func, select
+
+from metacore import blobs
+from metacore.database import blob_chunks, chunks, engine
+
+
+__author__ = 'karatel'
+
+
+# codec name of the blobs stored as chunk lists
+CODEC = 'cdc'
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_GEAR = [struct.unpack('<Q', sha256(struct.pack('B', _)).digest()[:8])[0]
+         for _ in range(256)]
+
+
+class Chunker(object):
+    """
+    Content-defined chunking with the Gear rolling hash.
+    Boundaries depend only on the last 64 bytes, so an insertion into the
+    data shifts only the chunks around it and the rest are deduplicated.
+    """
+
+    def __init__(self, average_size=64 * 1024):
+        """
+        :param average_size: expected chunk size, a power of two;
+            chunks are between a quarter and four times of it
+        """
+        self.min_size = average_size // 4
+        self.max_size = average_size * 4
+        # the high bits of the hash depend on the whole 64 bytes window
+        bits = average_size.bit_length() - 1
+        self._mask = ((1 << bits) - 1) << (64 - bits)
+
+    def split(self, data_chunks):
+        """
+        Split the data stream into content-defined chunks.
+        :param data_chunks: iterable of binary chunks
+        :return: generator of content-defined chunks
+        """
+        buffer = bytearray()
+        # scanning state of the current chunk, so the bytes already
+        # scanned aren't hashed again when more data comes
+        state = [self.min_size, 0]
+        for data in data_chunks:
+            buffer.extend(data)
+            cut = self._cut_point(buffer, state)
+            while cut:
+                yield bytes(buffer[:cut])
+                del buffer[:cut]
+                state = [self.min_size, 0]
+                cut = self._cut_point(buffer, state)
+
+        while buffer:
+            cut = self._cut_point(buffer, state) or len(buffer)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+            state = [self.min_size, 0]
+
+    def _cut_point(self, buffer, state):
+        """
+        Find the end of the first chunk in the buffer.
+        The first min_size bytes are never a boundary, so they're skipped.
+        :param buffer: buffered data
+        :param state: scanned position and rolling hash, updated in place
+        :return: chunk length or None if more data is needed
+        """
+        size = len(buffer)
+        mask, gear = self._mask, _GEAR
+        position, hash_value = state
+        end = min(size, self.max_size)
+        while position < end:
+            hash_value = ((hash_value << 1) + gear[buffer[position]]) & _MASK64
+            position += 1
+            if not hash_value & mask:
+                return position
+        state[:] = [position, hash_value]
+
+        if size >= self.max_size:
+            return self.max_size
+
+
+class ChunkStore(object):
+    """
+    Store blobs as lists of unique content-defined chunks.
+    Every chunk is saved once and has a references counter.
+    """
+
+    def __init__(self, folder, average_size=64 * 1024,
+                 durability=blobs.DURABILITY_NONE):
+        """
+        :param folder: chunks storage folder
+        :param average_size: expected chunk size
+        :param durability: durability level of the saved chunks
+        """
+        self.folder = folder
+        self.chunker = Chunker(average_size)
+        self.durability = durability
+
+    def chunk_path(self, chunk_hash):
+        """
+        Build the path of the stored chunk.
+        Chunks are spread over subfolders by the first two hash digits.
+        :param chunk_hash: SHA-256 hash of the chunk
+        :return: chunk path
+        :rtype: str
+        """
+        return os.path.join(self.folder, chunk_hash[:2], chunk_hash)
+
+    def save(self, data_hash, data_chunks):
+        """
+        Save the blob as a list of chunks.
+        :param data_hash: SHA-256 hash of the blob
+        :param data_chunks: iterable of binary chunks
+        :return: number of new physical bytes
+        :rtype: int
+        """
+        added_size = 0
+        manifest = []
+        for chunk in self._split(data_chunks):
+            chunk_hash = sha256(chunk).hexdigest()
+            path = self.chunk_path(chunk_hash)
+            if not os.path.exists(path):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass
+                blobs.commit(blobs.write_temp(self.folder, [chunk]), path,
+                             self.durability)
+                added_size += len(chunk)
+            manifest.append((chunk_hash, len(chunk)))
+
+        with engine.begin() as connection:
+            for position, (chunk_hash, size) in enumerate(manifest):
+                connection.execute(
+                    chunks.insert().prefix_with('OR IGNORE').values(
+                        hash=chunk_hash, size=size, refs=0
+                    )
+                )
+                connection.execute(
+                    chunks.update().where(
+                        chunks.c.hash == chunk_hash
+                    ).values(refs=chunks.c.refs + 1)
+                )
+                connection.execute(blob_chunks.insert().values(
+                    file_hash=data_hash, position=position,
+                    chunk_hash=chunk_hash
+                ))
+
+        return added_size
+
+    def _split(self, data_chunks):
+        """
+        Split the blob, an empty blob is kept as one empty chunk,
+        so every stored blob has chunks.
+        """
+        empty = True
+        for chunk in self.chunker.split(data_chunks):
+            empty = False
+            yield chunk
+        if empty:
+            yield b''
+
+    def exists(self, data_hash):
+        """
+        Check if the blob has stored chunks.
+        :param data_hash: SHA-256 hash of the blob
+        :rtype: bool
+        """
+        return select([blob_chunks.c.position]).where(
+            blob_chunks.c.file_hash == data_hash
+        ).limit(1).execute().first() is not None
+
+    def iter_blob(self, data_hash):
+        """
+        Rebuild the blob from its chunks.
+        :param data_hash: SHA-256 hash of the blob
+        :return: generator of binary chunks
+        """
+        chunk_hashes = [_.chunk_hash for _ in select(
+            [blob_chunks.c.chunk_hash]
+        ).where(
+            blob_chunks.c.file_hash == data_hash
+        ).order_by(blob_chunks.c.position).execute()]
+
+        if not chunk_hashes:
+            raise IOError('No chunks are stored for {}'.format(data_hash))
+
+        for chunk_hash in chunk_hashes:
+            with open(self.chunk_path(chunk_hash), 'rb') as fp:
+                yield fp.read()
+
+
+def chunks_size():
+    """
+    Get the physical size of all the stored chunks.
+    :return: size in bytes
+    :rtype: int
+    """
+    return select(
+        [func.coalesce(func.sum(chunks.c.size), 0)]
+    ).execute().scalar()
@@ -13,12 +13,109 @@ SECRET_KEY = b'\xfa\xe4I\xc7dt\xe5\x1bV\xf1\xfc\xc2\xc4\xe0\t\xe2\xedu\xe1' \
              b'\xe7\xf4\x8c\\\xe6'
 
 MAX_FILE_SIZE = 128 * 1024 * 1024
+# default and maximal number of hashes in a page of the owner's files
+FILES_PAGE_SIZE = 1000
+FILES_MAX_PAGE_SIZE = 10000
+# maximal number of hashes checked by one files existence request
+FILES_EXISTS_MAX_HASHES = 100000
 UPLOAD_FOLDER = os.path.join(BASEDIR, 'storage')
+QUARANTINE_FOLDER = os.path.join(BASEDIR, 'quarantine')
+CHUNKS_FOLDER = os.path.join(BASEDIR, 'chunks')
+MERKLE_FOLDER = os.path.join(BASEDIR, 'merkle')
+UPLOAD_SESSIONS_FOLDER = os.path.join(BASEDIR, 'sessions')
+
+# size in bytes of the parts of resumable uploads and lifetime in seconds
+# of unfinished upload sessions
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# 'files' stores every blob as a file, 'chunks' stores plaintext blobs
+# as deduplicated content-defined chunks
+STORAGE_ENGINE = 'files'
+CHUNK_AVERAGE_SIZE = 64 * 1024
+
+# syncs of the stored blobs, chunks and upload parts: 'none',
+# 'fdatasync' (data only), 'fdatasync+dirsync' (data and folder entry)
+# or 'group' (the folder syncs shared by concurrent uploads)
+BLOB_DURABILITY = 'fdatasync+dirsync'
+
+# maximal scrubbing read rate in MB/s per volume, None means no limit
+SCRUB_RATE = 10
+# minimal age in seconds of a blob without a record to be removed
+ORPHAN_GRACE_PERIOD = 60 * 60
+
+# codecs tried to compress plaintext blobs, empty list disables compression
+COMPRESSION_CODECS = []
+# minimal saved fraction of the size to keep the compressed blob
+COMPRESSION_MIN_SAVING = 0.2
+
+# in-memory cache of small popular blobs, zero size disables it
+BLOB_CACHE_SIZE = 0
+BLOB_CACHE_MAX_ENTRY_SIZE = 1024 * 1024
+BLOB_CACHE_MIN_HITS = 2
+
+# memory-mapped token buckets of the transfer rates shared by the workers
+BANDWIDTH_BUCKETS_FILE = os.path.join(BASEDIR, 'buckets.bin')
+
+# lifetime in seconds of the cached free space of the upload volume
+STATVFS_TTL = 5
+
+# in-memory index of the files metadata: maximal age in seconds of
+# the changes made by other workers, number of the logged changes kept
+# for lagging workers, and the snapshot loaded by new workers with
+# the minimal time in seconds between its updates
+FILE_INDEX_REFRESH_INTERVAL = 1.0
+FILE_INDEX_CHANGES_KEPT = 10000
+FILE_INDEX_SNAPSHOT = os.path.join(BASEDIR, 'files.index')
+FILE_INDEX_SNAPSHOT_INTERVAL = 60
+
+# requests slower than this number of seconds are logged with their stages
+# breakdown, None disables the log
+SLOW_REQUEST_THRESHOLD = 1.0
+
+# addresses allowed to use the admin API besides the Node key,
+# and lifetime in seconds of the admin requests signatures
+ADMIN_ADDRESSES = []
+ADMIN_SIGNATURE_TTL = 5 * 60
+
+# cProfile dumps and tracemalloc snapshots made by the admin API
+PROFILES_FOLDER = os.path.join(BASEDIR, 'profiles')
+TRACEMALLOC_FRAMES = 25
+
+# audits are inserted when this number of them is buffered
+# or the oldest one is buffered for this number of seconds
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 1.0
+
+# age in seconds of the hourly owner audits removed by the owners report,
+# daily ones are kept
+OWNER_AUDIT_HOURS_AGE = 7 * 24 * 60 * 60
+
+# size in bytes of the Merkle tree leaves and number of leaves
+# challenged by one chunk audit
+MERKLE_CHUNK_SIZE = 4 * 1024
+MERKLE_CHALLENGE_CHUNKS = 8
+
+# fetch lost blobs from the peers instead of answering with the peers list
+PEER_RECOVERY = False
+# base URLs of the peers to recover from, URLs from PEERS_FILE are used too
+RECOVERY_PEERS = []
+RECOVERY_TIMEOUT = 10
+# size in bytes of one range request to a peer
+RECOVERY_PART_SIZE = 4 * 1024 * 1024
 
 NODE = Node(os.path.join(BASEDIR, 'test_node.json'))
 AUDIT_RATE_LIMITS = {
     'owner': 100,
     'other': 50
 }
+MERKLE_AUDIT_RATE_LIMITS = {
+    'owner': 1000,
+    'other': 500
+}
 BLACKLIST_FILE = os.path.join(BASEDIR, 'Blacklist.txt')
+# Blacklist compiled for the lookups, and number of hashes appended to
+# the Blacklist kept in memory before it's compiled again
+BLACKLIST_COMPILED = os.path.join(BASEDIR, 'Blacklist.bin')
+BLACKLIST_TAIL_LIMIT = 10000
 PEERS_FILE = os.path.join(BASEDIR, 'peers.txt')
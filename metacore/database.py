@@ -1,7 +1,10 @@
 import datetime
 import os.path
 
-from sqlalchemy import create_engine, Column, ForeignKey, MetaData, Table
+from sqlalchemy import create_engine, Column, ForeignKey, Index, MetaData
+from sqlalchemy import Table
+from sqlalchemy import inspect, select
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy import Boolean, DateTime, Integer, String
 
 
@@ -21,6 +24,12 @@ files = Table(
     Column('role', String(3), nullable=False),
     Column('size', Integer, nullable=False),
     Column('owner', String(35), nullable=False),
+    # codec of the stored data, NULL for raw data
+    Column('codec', String(8), nullable=True),
+    # size of the stored data, NULL if it's equal to the data size
+    Column('stored_size', Integer, nullable=True),
+    # owner's files are listed in the hash order
+    Index('files_owner_hash', 'owner', 'hash')
 )
 
 
@@ -28,7 +37,348 @@ audit = Table(
     'audit', metadata,
     Column('file_hash', Integer, ForeignKey('files.hash'), nullable=False),
     Column('is_owners', Boolean, default=False, nullable=False),
-    Column('made_at', DateTime, default=datetime.datetime.now, nullable=False)
+    Column('made_at', DateTime, default=datetime.datetime.now, nullable=False),
+    # 'full' for whole data audits, 'merkle' for chunk audits
+    Column('mode', String(6), default='full', server_default='full',
+           nullable=False)
+)
+
+integrity = Table(
+    'integrity', metadata,
+    Column('file_hash', String(64), ForeignKey('files.hash'),
+           nullable=False, primary_key=True),
+    Column('status', String(10), nullable=False),
+    Column('checked_at', DateTime, default=datetime.datetime.now,
+           nullable=False)
+)
+
+reservations = Table(
+    'reservations', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('size', Integer, nullable=False),
+    Column('expires_at', DateTime, nullable=False)
+)
+
+chunks = Table(
+    'chunks', metadata,
+    Column('hash', String(64), nullable=False, primary_key=True),
+    Column('size', Integer, nullable=False),
+    Column('refs', Integer, default=0, nullable=False)
+)
+
+
+blob_chunks = Table(
+    'blob_chunks', metadata,
+    Column('file_hash', String(64), ForeignKey('files.hash'),
+           nullable=False, primary_key=True),
+    Column('position', Integer, nullable=False, primary_key=True),
+    Column('chunk_hash', String(64), ForeignKey('chunks.hash'),
+           nullable=False)
+)
+
+
+upload_sessions = Table(
+    'upload_sessions', metadata,
+    Column('id', String(32), nullable=False, primary_key=True),
+    Column('data_hash', String(64), nullable=False),
+    Column('role', String(3), nullable=False),
+    Column('owner', String(35), nullable=False),
+    Column('size', Integer, nullable=False),
+    Column('part_size', Integer, nullable=False),
+    Column('reservation_id', Integer, nullable=False),
+    Column('expires_at', DateTime, nullable=False)
+)
+
+
+traffic = Table(
+    'traffic', metadata,
+    Column('direction', String(8), nullable=False, primary_key=True),
+    # UNIX time of the bucket beginning
+    Column('start', Integer, nullable=False, primary_key=True),
+    # bucket length in seconds
+    Column('period', Integer, nullable=False, primary_key=True),
+    Column('volume', Integer, default=0, nullable=False)
+)
+
+
+# files of every owner, kept by triggers
+owner_usage = Table(
+    'owner_usage', metadata,
+    Column('owner', String(35), nullable=False, primary_key=True),
+    Column('files', Integer, default=0, nullable=False),
+    Column('bytes', Integer, default=0, nullable=False)
+)
+
+
+# audits of every owner's files by time buckets, kept by triggers
+owner_audits = Table(
+    'owner_audits', metadata,
+    Column('owner', String(35), nullable=False, primary_key=True),
+    # UNIX time of the bucket beginning
+    Column('start', Integer, nullable=False, primary_key=True),
+    # bucket length in seconds
+    Column('period', Integer, nullable=False, primary_key=True),
+    Column('count', Integer, default=0, nullable=False)
+)
+
+
+# log of the changed `files` records, filled by triggers
+file_changes = Table(
+    'file_changes', metadata,
+    Column('seq', Integer, primary_key=True),
+    Column('hash', String(64), nullable=False),
+    sqlite_autoincrement=True
+)
+
+
+counters = Table(
+    'counters', metadata,
+    Column('name', String(32), nullable=False, primary_key=True),
+    Column('value', Integer, default=0, nullable=False)
 )
 
 metadata.create_all()
+
+
+def _add_missing_columns(table):
+    """
+    Add columns introduced after the table was created.
+    """
+    existing = set(_['name'] for _ in inspect(engine).get_columns(table.name))
+    for column in table.columns:
+        if column.name not in existing:
+            engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(
+                table.name, CreateColumn(column).compile(engine)
+            ))
+
+
+_add_missing_columns(files)
+_add_missing_columns(audit)
+
+
+def _add_missing_indexes(table):
+    """
+    Create indexes introduced after the table was created.
+    """
+    existing = set(_['name'] for _ in inspect(engine).get_indexes(table.name))
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(engine)
+
+
+_add_missing_indexes(files)
+
+
+def _count_changes(table):
+    """
+    Keep the table changes counter by triggers, so it follows any change
+    of the table, including ones made outside of the application.
+    """
+    engine.execute("INSERT OR IGNORE INTO counters (name, value) "
+                   "VALUES ('{}', 0)".format(table.name))
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        engine.execute(
+            "CREATE TRIGGER IF NOT EXISTS {0}_{1}_counter "
+            "AFTER {2} ON {0} BEGIN "
+            "UPDATE counters SET value = value + 1 WHERE name = '{0}'; "
+            "END".format(table.name, event.lower(), event)
+        )
+
+
+_count_changes(files)
+_count_changes(traffic)
+
+
+def _log_file_changes():
+    """
+    Log the hashes of the changed `files` records by triggers.
+    Sequence numbers of the log are never reused, so a reader
+    can follow it from the last seen one.
+    """
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'),
+                       ('DELETE', 'OLD')):
+        engine.execute(
+            "CREATE TRIGGER IF NOT EXISTS files_{0}_log "
+            "AFTER {1} ON files BEGIN "
+            "INSERT INTO file_changes (hash) VALUES ({2}.hash); "
+            "END".format(event.lower(), event, row)
+        )
+
+
+_log_file_changes()
+
+
+# lengths in seconds of the owner audits buckets
+OWNER_AUDIT_PERIODS = (60 * 60, 24 * 60 * 60)
+
+
+def _roll_up_owners():
+    """
+    Keep the owners usage and audits by triggers.
+    Existing records are rolled up in the same transaction the triggers
+    are created in, so every record is counted once.
+    """
+    add_usage = (
+        "INSERT OR IGNORE INTO owner_usage (owner, files, bytes) "
+        "VALUES ({0}.owner, 0, 0); "
+        "UPDATE owner_usage SET files = files + 1, bytes = bytes + {0}.size "
+        "WHERE owner = {0}.owner; "
+    )
+    remove_usage = (
+        "UPDATE owner_usage SET files = files - 1, bytes = bytes - {0}.size "
+        "WHERE owner = {0}.owner; "
+        "DELETE FROM owner_usage WHERE owner = {0}.owner AND files = 0; "
+    )
+    add_audit = (
+        "INSERT OR IGNORE INTO owner_audits (owner, start, period, count) "
+        "SELECT owner, {1}, {0}, 0 FROM files WHERE hash = NEW.file_hash; "
+        "UPDATE owner_audits SET count = count + 1 "
+        "WHERE owner = (SELECT owner FROM files WHERE hash = NEW.file_hash) "
+        "AND start = {1} AND period = {0}; "
+    )
+    # audits are inserted in batches, so the bucket is taken from
+    # the audit time, which is the local time
+    bucket_start = ("CAST(strftime('%s', NEW.made_at, 'utc') AS INTEGER) "
+                    "/ {0} * {0}")
+    audit_trigger = (
+        "CREATE TRIGGER audit_insert_owner AFTER INSERT ON audit "
+        "BEGIN " + ''.join(
+            add_audit.format(period, bucket_start.format(period))
+            for period in OWNER_AUDIT_PERIODS
+        ) + "END"
+    )
+
+    with engine.begin() as connection:
+        if connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+            "AND name = 'audit_insert_owner'"
+        ).first():
+            return
+
+        connection.execute(
+            "CREATE TRIGGER files_insert_owner AFTER INSERT ON files "
+            "BEGIN " + add_usage.format('NEW') + "END"
+        )
+        connection.execute(
+            "CREATE TRIGGER files_delete_owner AFTER DELETE ON files "
+            "BEGIN " + remove_usage.format('OLD') + "END"
+        )
+        connection.execute(
+            "CREATE TRIGGER files_update_owner "
+            "AFTER UPDATE OF owner, size ON files BEGIN " +
+            remove_usage.format('OLD') + add_usage.format('NEW') + "END"
+        )
+        connection.execute(audit_trigger)
+
+        connection.execute("DELETE FROM owner_usage")
+        connection.execute("DELETE FROM owner_audits")
+        connection.execute(
+            "INSERT INTO owner_usage (owner, files, bytes) "
+            "SELECT owner, COUNT(*), SUM(size) FROM files GROUP BY owner"
+        )
+        for period in OWNER_AUDIT_PERIODS:
+            # audit time is the local time
+            start = ("CAST(strftime('%s', audit.made_at, 'utc') AS INTEGER) "
+                     "/ {0} * {0}".format(period))
+            connection.execute(
+                "INSERT INTO owner_audits (owner, start, period, count) "
+                "SELECT files.owner, {0}, {1}, COUNT(*) "
+                "FROM audit JOIN files ON files.hash = audit.file_hash "
+                "GROUP BY files.owner, {0}".format(start, period)
+            )
+
+
+_roll_up_owners()
+
+
+# name of the counter keeping the physical size of the stored blobs
+# and chunks
+USED_SPACE_COUNTER = 'used_space'
+
+
+def _count_used_space():
+    """
+    Keep the used space counter by triggers, so reservations don't sum
+    the whole tables. Existing records are counted in the same
+    transaction the triggers are created in.
+    """
+    change = ("UPDATE counters SET value = value {1} {0} "
+              "WHERE name = '" + USED_SPACE_COUNTER + "'; ")
+    # table, physical size of a record and the columns it depends on
+    tables = (
+        ('files', 'COALESCE({0}.stored_size, {0}.size)', 'size, stored_size'),
+        ('chunks', '{0}.size', 'size')
+    )
+
+    with engine.begin() as connection:
+        if connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' "
+            "AND name = 'chunks_update_used'"
+        ).first():
+            return
+
+        for table, size, columns in tables:
+            connection.execute(
+                "CREATE TRIGGER {0}_insert_used AFTER INSERT ON {0} "
+                "BEGIN {1}END".format(
+                    table, change.format(size.format('NEW'), '+')
+                )
+            )
+            connection.execute(
+                "CREATE TRIGGER {0}_delete_used AFTER DELETE ON {0} "
+                "BEGIN {1}END".format(
+                    table, change.format(size.format('OLD'), '-')
+                )
+            )
+            connection.execute(
+                "CREATE TRIGGER {0}_update_used "
+                "AFTER UPDATE OF {1} ON {0} BEGIN {2}{3}END".format(
+                    table, columns, change.format(size.format('OLD'), '-'),
+                    change.format(size.format('NEW'), '+')
+                )
+            )
+
+        connection.execute(
+            "INSERT OR REPLACE INTO counters (name, value) SELECT '" +
+            USED_SPACE_COUNTER + "', "
+            "(SELECT COALESCE(SUM(COALESCE(stored_size, size)), 0) "
+            "FROM files) + "
+            "(SELECT COALESCE(SUM(size), 0) FROM chunks)"
+        )
+
+
+_count_used_space()
+
+
+def iter_files(batch_size=1000):
+    """
+    Iterate over all `files` records ordered by hash.
+    Records are fetched by pages, so no read cursor is kept open
+    between pages and memory usage doesn't depend on the table size.
+    :param batch_size: number of records fetched at once
+    :return: generator of records
+    """
+    last_hash = ''
+    while True:
+        batch = files.select(files.c.hash > last_hash).order_by(
+            files.c.hash
+        ).limit(batch_size).execute().fetchall()
+
+        for row in batch:
+            yield row
+
+        if len(batch) < batch_size:
+            return
+        last_hash = batch[-1].hash
+
+
+def get_counter(name):
+    """
+    Get the current value of the changes counter.
+    :param name: counter name
+    :return: counter value
+    :rtype: int
+    """
+    return select([counters.c.value]).where(
+        counters.c.name == name
+    ).execute().scalar()
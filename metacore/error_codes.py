@@ -5,6 +5,9 @@ ERR_TRANSFER = {
     'INVALID_HASH': 101,
     'MISMATCHED_HASH': 102,
     'HUGE_FILE': 103,
+    'INVALID_PART': 104,
+    'INCOMPLETE_UPLOAD': 105,
+    'INVALID_SIZE': 106,
     'FULL_DISK': 201,
     'LIMIT_REACHED': 202,
     'NOT_FOUND': 301,
@@ -22,4 +25,12 @@ ERR_AUDIT = {
     'INVALID_SIGNATURE': 401
 }
 
+ERR_ADMIN = {
+    'INVALID_PARAMS': 101,
+    'NOT_SUPPORTED': 102,
+    'NOT_FOUND': 301,
+    'INVALID_SIGNATURE': 401,
+    'EXPIRED_SIGNATURE': 402
+}
+
 ERR_BLACKLIST = 999
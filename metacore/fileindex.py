@@ -0,0 +1,335 @@
+import binascii
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from sqlalchemy import and_, func, select
+
+from metacore.database import counters, engine, file_changes, files
+from metacore.database import iter_files
+
+
+__author__ = 'karatel'
+
+
+SNAPSHOT_MAGIC = b'MFIX'
+SNAPSHOT_VERSION = 1
+# magic, version, last change sequence number, number of records
+SNAPSHOT_HEADER = struct.Struct('>4sBqI')
+# digest, size, stored size (-1 for NULL) and lengths of the role,
+# the codec and the owner, which follow the record
+SNAPSHOT_RECORD = struct.Struct('>32sqqBBB')
+
+# name of the counter keeping the last pruned change sequence number
+PRUNED_COUNTER = 'file_changes_pruned'
+
+# number of hashes selected by one statement
+SELECT_BATCH_SIZE = 500
+
+
+class FileRecord(object):
+    """
+    Compact metadata of a stored file.
+    It has the attributes of a `files` record. Equal roles, codecs and
+    owners of the records are shared by the index.
+    """
+
+    __slots__ = ('hash', 'role', 'size', 'owner', 'codec', 'stored_size')
+
+    def __init__(self, hash, role, size, owner, codec=None, stored_size=None):
+        self.hash = hash
+        self.role = role
+        self.size = size
+        self.owner = owner
+        self.codec = codec
+        self.stored_size = stored_size
+
+    def __repr__(self):
+        return 'FileRecord({!r}, {!r}, {!r}, {!r}, {!r}, {!r})'.format(
+            self.hash, self.role, self.size, self.owner, self.codec,
+            self.stored_size
+        )
+
+
+class FileIndex(object):
+    """
+    Process-level index of the `files` metadata by hash.
+    Lookups are served from memory, a miss is decided by the changes
+    followed last. Changes made by any worker are followed through
+    the `file_changes` log once per refresh interval, so files added by
+    other workers are found within it. A worker changing the table
+    refreshes the index itself to find its changes at once.
+    The index is dumped to a binary snapshot, which a new worker loads
+    instead of scanning the table.
+    """
+
+    def __init__(self, snapshot_path=None, refresh_interval=1.0,
+                 changes_kept=10000, snapshot_interval=60, clock=time.time):
+        """
+        :param snapshot_path: path of the snapshot, None disables it
+        :param refresh_interval: maximal age in seconds of the followed
+            changes
+        :param changes_kept: number of the log records kept for lagging
+            workers, older ones are pruned
+        :param snapshot_interval: minimal time in seconds between
+            the snapshots
+        :param clock: time source
+        """
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.changes_kept = changes_kept
+        self.snapshot_interval = snapshot_interval
+        self._clock = clock
+
+        self._lock = threading.RLock()
+        self._records = None
+        self._shared = {}
+        self._seq = 0
+        self._checked_at = None
+        self._saved_at = None
+        self._saved_seq = None
+
+    def get(self, data_hash):
+        """
+        Get the file metadata.
+        :param data_hash: SHA-256 hash of the file
+        :return: FileRecord or None if there is no such file
+        """
+        self._refresh_due()
+        return self._records.get(data_hash)
+
+    def get_many(self, hashes):
+        """
+        Get the metadata of many files at once.
+        :param hashes: iterable of SHA-256 hashes
+        :return: list of FileRecord or None for the missing files
+        :rtype: list
+        """
+        self._refresh_due()
+        records = self._records
+        return [records.get(_) for _ in hashes]
+
+    def __len__(self):
+        if self._records is None:
+            self.refresh()
+        return len(self._records)
+
+    def _refresh_due(self):
+        if self._records is None or \
+                self._clock() - self._checked_at >= self.refresh_interval:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Load the index or apply the logged changes.
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            if self._records is None:
+                if not self.load_snapshot():
+                    self._scan()
+            self._follow()
+            self._checked_at = self._clock()
+
+            if self.snapshot_path is not None and \
+                    self._saved_seq != self._seq and (
+                        self._saved_at is None or
+                        self._checked_at - self._saved_at >=
+                        self.snapshot_interval
+                    ):
+                try:
+                    self.save_snapshot()
+                except (IOError, OSError):
+                    # the snapshot only speeds up the start, so lookups
+                    # go on without it
+                    self._saved_at = self._checked_at
+
+    def load_snapshot(self):
+        """
+        Load the index from the snapshot.
+        The snapshot is refused if the log was pruned after it.
+        :return: True if the snapshot is loaded
+        :rtype: bool
+        """
+        if self.snapshot_path is None:
+            return False
+
+        try:
+            with open(self.snapshot_path, 'rb') as fp:
+                data = fp.read()
+            magic, version, seq, count = SNAPSHOT_HEADER.unpack_from(data)
+        except (IOError, OSError, struct.error):
+            return False
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return False
+
+        last_seq, pruned = self._log_bounds()
+        if not pruned <= seq <= last_seq:
+            return False
+
+        records = {}
+        offset = SNAPSHOT_HEADER.size
+        try:
+            for _ in range(count):
+                digest, size, stored_size, role_length, codec_length, \
+                    owner_length = SNAPSHOT_RECORD.unpack_from(data, offset)
+                offset += SNAPSHOT_RECORD.size
+                role, codec, owner = (
+                    data[offset:offset + role_length].decode(),
+                    data[offset + role_length:
+                         offset + role_length + codec_length].decode(),
+                    data[offset + role_length + codec_length:
+                         offset + role_length + codec_length +
+                         owner_length].decode()
+                )
+                offset += role_length + codec_length + owner_length
+
+                data_hash = binascii.hexlify(digest).decode()
+                records[data_hash] = self._record(
+                    data_hash, role, size, owner, codec or None,
+                    None if stored_size < 0 else stored_size
+                )
+        except (struct.error, UnicodeDecodeError):
+            return False
+
+        self._records, self._seq = records, seq
+        self._saved_seq = seq
+        return True
+
+    def save_snapshot(self):
+        """
+        Dump the index to the snapshot.
+        The snapshot is replaced atomically, so workers may save it
+        at the same time.
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            records = list(self._records.values())
+            seq = self._seq
+
+        chunks = []
+        for record in records:
+            try:
+                digest = binascii.unhexlify(record.hash)
+            except (TypeError, ValueError):
+                # only valid hashes are looked up
+                continue
+            if len(digest) != 32:
+                continue
+            role, codec, owner = [(_ or '').encode() for _ in (
+                record.role, record.codec, record.owner
+            )]
+            chunks.append(SNAPSHOT_RECORD.pack(
+                digest, record.size,
+                -1 if record.stored_size is None else record.stored_size,
+                len(role), len(codec), len(owner)
+            ) + role + codec + owner)
+
+        folder = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC,
+                                              SNAPSHOT_VERSION, seq,
+                                              len(chunks)))
+                fp.write(b''.join(chunks))
+            os.rename(temp_path, self.snapshot_path)
+        except (IOError, OSError):
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self._saved_at = self._clock()
+        self._saved_seq = seq
+
+    def _scan(self):
+        """
+        Load the index from the `files` table.
+        """
+        # changes made during the scan are applied again by _follow()
+        seq = self._log_bounds()[0]
+        records = {}
+        for row in iter_files():
+            records[row.hash] = self._record_of(row)
+        self._records, self._seq = records, seq
+
+    def _follow(self):
+        """
+        Apply the changes logged after the last seen one.
+        The index is scanned again if they are pruned already.
+        """
+        last_seq, pruned = self._log_bounds()
+        if self._seq < pruned or self._seq > last_seq:
+            self._scan()
+            return
+        if self._seq < last_seq:
+            self._apply(list(set(
+                _.hash for _ in select([file_changes.c.hash]).where(
+                    file_changes.c.seq.between(self._seq + 1, last_seq)
+                ).execute()
+            )))
+            self._seq = last_seq
+
+        if last_seq - pruned >= 2 * self.changes_kept:
+            self._prune(last_seq - self.changes_kept)
+
+    def _apply(self, hashes):
+        """
+        Read the changed records again.
+        """
+        for start in range(0, len(hashes), SELECT_BATCH_SIZE):
+            batch = hashes[start:start + SELECT_BATCH_SIZE]
+            rows = dict((_.hash, _) for _ in files.select(
+                files.c.hash.in_(batch)
+            ).execute())
+            for data_hash in batch:
+                if data_hash in rows:
+                    self._records[data_hash] = self._record_of(
+                        rows[data_hash]
+                    )
+                else:
+                    self._records.pop(data_hash, None)
+
+    def _log_bounds(self):
+        """
+        Get the last logged and the last pruned change sequence numbers.
+        """
+        last_seq, pruned = select([
+            func.max(file_changes.c.seq),
+            select([counters.c.value]).where(
+                counters.c.name == PRUNED_COUNTER
+            ).as_scalar()
+        ]).execute().first()
+        return last_seq or 0, pruned or 0
+
+    def _prune(self, seq):
+        """
+        Remove the log records up to the sequence number.
+        """
+        with engine.begin() as connection:
+            connection.execute(counters.insert().prefix_with(
+                'OR IGNORE'
+            ).values(name=PRUNED_COUNTER, value=0))
+            connection.execute(counters.update().where(and_(
+                counters.c.name == PRUNED_COUNTER, counters.c.value < seq
+            )).values(value=seq))
+            connection.execute(file_changes.delete().where(
+                file_changes.c.seq <= seq
+            ))
+
+    def _record_of(self, row):
+        return self._record(row.hash, row.role, row.size, row.owner,
+                            row.codec, row.stored_size)
+
+    def _record(self, data_hash, role, size, owner, codec, stored_size):
+        shared = self._shared.setdefault
+        return FileRecord(data_hash, shared(role, role), size,
+                          shared(owner, owner),
+                          None if codec is None else shared(codec, codec),
+                          stored_size)
@@ -0,0 +1,208 @@
+import binascii
+import struct
+from hashlib import sha256
+
+from metacore import blobs
+
+
+__author__ = 'karatel'
+
+
+# chunk size, leaves count
+_HEADER = struct.Struct('>II')
+_DIGEST_SIZE = 32
+
+
+class MismatchedData(ValueError):
+    """
+    Data the tree is built from doesn't match its hash.
+    """
+
+
+def split(data_chunks, chunk_size):
+    """
+    Split the data stream into chunks of the fixed size.
+    The empty data is one empty chunk, so every tree has a leaf.
+    :param data_chunks: iterable of binary chunks
+    :param chunk_size: size of the chunks in bytes
+    :return: generator of binary chunks
+    """
+    buffer = b''
+    is_empty = True
+    for data in data_chunks:
+        if buffer:
+            data = buffer + data
+        position = 0
+        while len(data) - position >= chunk_size:
+            is_empty = False
+            yield data[position:position + chunk_size]
+            position += chunk_size
+        buffer = data[position:]
+    if buffer or is_empty:
+        yield buffer
+
+
+def leaf_hash(chunk):
+    return sha256(b'\x00' + chunk).digest()
+
+
+def node_hash(left, right):
+    return sha256(b'\x01' + left + right).digest()
+
+
+def build(data_chunks, chunk_size):
+    """
+    Build the Merkle tree of the data chunks.
+    The last node of a level with odd length is paired with itself.
+    :param data_chunks: iterable of binary chunks
+    :param chunk_size: size of the tree leaves chunks in bytes
+    :return: levels of binary digests from the leaves up to the root
+    :rtype: list
+    """
+    levels = [[leaf_hash(_) for _ in split(data_chunks, chunk_size)]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([
+            node_hash(level[_], level[min(_ + 1, len(level) - 1)])
+            for _ in range(0, len(level), 2)
+        ])
+    return levels
+
+
+def root(data_chunks, chunk_size):
+    """
+    Compute the root of the data tree, e.g. before the data is uploaded.
+    :param data_chunks: iterable of binary chunks
+    :param chunk_size: size of the tree leaves chunks in bytes
+    :return: hex digest of the root
+    :rtype: str
+    """
+    return _hex(build(data_chunks, chunk_size)[-1][0])
+
+
+def save_tree(folder, data_hash, data_chunks, chunk_size, check=False):
+    """
+    Build the Merkle tree of the blob and save all its levels,
+    so proofs are read without rebuilding the tree.
+    :param folder: trees storage folder
+    :param data_hash: SHA-256 hash of the blob
+    :param data_chunks: iterable of binary chunks
+    :param chunk_size: size of the tree leaves chunks in bytes
+    :param check: check the data against the hash before the tree is
+        saved, for the data that isn't verified yet
+    :return: hex digest of the root
+    :rtype: str
+    :raises MismatchedData: if the checked data doesn't match the hash
+    """
+    if check:
+        digest = sha256()
+        data_chunks = _hashed(data_chunks, digest)
+    levels = build(data_chunks, chunk_size)
+    if check and digest.hexdigest() != data_hash:
+        raise MismatchedData('Blob {} is corrupted'.format(data_hash))
+    header = _HEADER.pack(chunk_size, len(levels[0]))
+    blobs.commit(
+        blobs.write_temp(folder, [header] + [b''.join(_) for _ in levels]),
+        blobs.blob_path(folder, data_hash)
+    )
+    return _hex(levels[-1][0])
+
+
+class MerkleTree(object):
+    """
+    Saved Merkle tree of the blob.
+    Only the header is read at once, proofs are read with a few seeks.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: saved tree path
+        """
+        self.path = path
+        with open(path, 'rb') as fp:
+            self.chunk_size, self.leaf_count = _HEADER.unpack(
+                fp.read(_HEADER.size)
+            )
+
+        # offset and length of every level
+        self._levels = []
+        offset, length = _HEADER.size, self.leaf_count
+        while True:
+            self._levels.append((offset, length))
+            if length == 1:
+                break
+            offset += length * _DIGEST_SIZE
+            length = (length + 1) // 2
+
+    @property
+    def root(self):
+        """
+        Hex digest of the tree root.
+        """
+        with open(self.path, 'rb') as fp:
+            return self._read_digest(fp, len(self._levels) - 1, 0)
+
+    def proof(self, index):
+        """
+        Get the hashes needed to compute the root from the leaf.
+        :param index: leaf index
+        :return: hex digests of the siblings from the leaves level up
+        :rtype: list
+        """
+        if not 0 <= index < self.leaf_count:
+            raise IndexError('No leaf {} in the tree'.format(index))
+
+        proof = []
+        with open(self.path, 'rb') as fp:
+            for level, (_, length) in enumerate(self._levels[:-1]):
+                proof.append(self._read_digest(fp, level,
+                                               min(index ^ 1, length - 1)))
+                index //= 2
+        return proof
+
+    def _read_digest(self, fp, level, index):
+        fp.seek(self._levels[level][0] + index * _DIGEST_SIZE)
+        return _hex(fp.read(_DIGEST_SIZE))
+
+
+def _hex(digest):
+    return binascii.hexlify(digest).decode()
+
+
+def _hashed(data_chunks, digest):
+    for chunk in data_chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+def challenge_indices(seed, leaf_count, count):
+    """
+    Derive the challenged leaves from the seed.
+    :param seed: challenge seed
+    :param leaf_count: number of the tree leaves
+    :param count: number of the challenged leaves
+    :return: sorted distinct leaf indices
+    :rtype: list
+    """
+    return sorted(set(
+        int(sha256('{}:{}'.format(seed, _).encode()).hexdigest(), 16) %
+        leaf_count for _ in range(count)
+    ))
+
+
+def verify(chunk, index, proof, root):
+    """
+    Check that the chunk is the leaf of the tree with the root.
+    :param chunk: leaf chunk data
+    :param index: leaf index
+    :param proof: hex digests of the siblings from the leaves level up
+    :param root: hex digest of the root
+    :rtype: bool
+    """
+    digest = leaf_hash(chunk)
+    for sibling in proof:
+        sibling = binascii.unhexlify(sibling)
+        digest = (node_hash(digest, sibling) if index % 2 == 0
+                  else node_hash(sibling, digest))
+        index //= 2
+    return _hex(digest) == root
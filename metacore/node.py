@@ -1,7 +1,11 @@
 import sys
 import json
 
-from metacore.database import files
+from sqlalchemy import case, func, select
+
+from metacore import chunkstore
+from metacore.database import USED_SPACE_COUNTER, files, get_counter
+from metacore.traffic import TrafficLedger
 
 
 __author__ = 'karatel'
@@ -18,11 +22,20 @@ class Node(object):
 
         self.__public_key = config_data['public_key']
         self.__limits = config_data['bandwidth']['limits']
-        self.__current_bandwidth = config_data['bandwidth']['current']
+        self.__rates = config_data['bandwidth'].get('rates', {
+            'incoming': None,
+            'outgoing': None,
+            'per_sender': {'incoming': None, 'outgoing': None}
+        })
+        # length in seconds of the period the limits are applied to
+        self.__window = config_data['bandwidth'].get('window',
+                                                     30 * 24 * 60 * 60)
         self.__total_bandwidth = config_data['bandwidth']['total']
         self.__capacity = config_data['storage']['capacity']
 
         self.__file_path = file_path
+        self._revision = 0
+        self._ledger = TrafficLedger()
 
     def add_incoming(self, volume):
         """
@@ -48,25 +61,47 @@ class Node(object):
     def info(self):
         """
         Aggregate common status info for Node (public key, bandwidth, storage).
+        Used storage is counted in stored (possibly compressed) bytes
+        by triggers. Deduplication ratio is the size of the files stored
+        as chunks divided by the size of the stored chunks.
         :return: Node status info
         :rtype: dict
         """
-        files_size = [_['size'] for _ in files.select().execute()]
+        max_file_size, chunked_size = select([
+            func.coalesce(func.max(files.c.size), 0),
+            func.coalesce(func.sum(case(
+                [(files.c.codec == chunkstore.CODEC, files.c.size)], else_=0
+            )), 0)
+        ]).execute().first()
+        chunks_size = chunkstore.chunks_size()
         info = {
             'public_key': self.public_key,
             'bandwidth': {
-                'current': self.__current_bandwidth,
+                'current': self.current,
                 'limits': self.__limits,
-                'total': self.__total_bandwidth
+                'rates': self.__rates,
+                'total': self.total,
+                'window': self.__window
             },
             'storage': {
                 'capacity': self.__capacity,
-                'max_file_size': max(files_size) if files_size else 0,
-                'used': sum(files_size)
+                'max_file_size': max_file_size,
+                'used': get_counter(USED_SPACE_COUNTER) or 0,
+                'dedup_ratio': (round(float(chunked_size) / chunks_size, 3)
+                                if chunks_size else 1.0)
             }
         }
         return info
 
+    @property
+    def revision(self):
+        """
+        Get the number of changes made to the Node data in this process.
+        :return: revision number
+        :rtype: int
+        """
+        return self._revision
+
     @property
     def capacity(self):
         """
@@ -80,10 +115,21 @@ class Node(object):
     def current(self):
         """
         Get current bandwidth.
+        It's the traffic over the window, so the limits are applied
+        per period without resets.
         :return: current incoming and outgoing bandwidth
         :rtype: dict
         """
-        return self.__current_bandwidth
+        return self._ledger.window(self.__window)
+
+    @property
+    def window(self):
+        """
+        Get the period of the current bandwidth.
+        :return: window length in seconds
+        :rtype: int
+        """
+        return self.__window
 
     @property
     def limits(self):
@@ -94,14 +140,27 @@ class Node(object):
         """
         return self.__limits
 
+    @property
+    def rates(self):
+        """
+        Get transfer rate limits.
+        :return: incoming and outgoing rates of the Node and of every sender
+            in bytes per second, None means no limit
+        :rtype: dict
+        """
+        return self.__rates
+
     @property
     def total(self):
         """
         Get total bandwidth.
+        It's the stored total plus all the traffic in the ledger.
         :return: total incoming and outgoing bandwidth
         :rtype: dict
         """
-        return self.__total_bandwidth
+        traffic = self._ledger.window()
+        return dict((_, self.__total_bandwidth[_] + traffic[_])
+                    for _ in traffic)
 
     @property
     def public_key(self):
@@ -123,6 +182,7 @@ class Node(object):
         :rtype: NoneType
         """
         self.__limits.update({'incoming': incoming, 'outgoing': outgoing})
+        self._revision += 1
 
     def _store(self):
         """
@@ -131,15 +191,17 @@ class Node(object):
         :rtype: NoneType
         """
 
+        info = self.info
+        # the traffic is kept by the ledger, so only the initial total
+        # is stored
+        info['bandwidth']['total'] = self.__total_bandwidth
         with open(self.__file_path, 'w') as file_config:
             if sys.version_info.major == 3:
-                json.dump(self.info, file_config, indent='\t')
+                json.dump(info, file_config, indent='\t')
             else:
-                json.dump(self.info, file_config)
+                json.dump(info, file_config)
 
     def __increase_traffic(self, volume, incoming=True):
         direction = 'incoming' if incoming else 'outgoing'
-        self.__current_bandwidth[direction] += abs(volume)
-        self.__total_bandwidth[direction] += abs(volume)
-
-        self._store()
+        self._ledger.add(direction, abs(volume))
+        self._revision += 1
@@ -1,16 +1,31 @@
 import os
 import re
 import binascii
+import time
 from datetime import datetime
 from datetime import timedelta
 from hashlib import sha256
 
 from btctxstore import BtcTxStore
 from file_encryptor import convergence
-from flask import Flask
-from sqlalchemy import and_
+from flask import Flask, g, has_request_context
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
 
-from metacore.database import audit, files
+from metacore import blobs, chunkstore, merkle, profiling, recovery
+from metacore.auditlog import AuditLog
+from metacore.blacklist import Blacklist
+from metacore.cache import BlobCache
+from metacore.capacity import CapacityLedger
+from metacore.chunkstore import ChunkStore
+from metacore.fileindex import FileIndex
+from metacore.profiling import MemoryTracker, RequestProfiler
+from metacore.shaping import BandwidthShaper, ShapedStream
+from metacore.tracing import Trace
+from metacore.traffic import CountingFile, CountingIterator, CountingStream
+from metacore.uploads import UploadSessions
+from metacore.database import files, get_counter
+from metacore.database import OWNER_AUDIT_PERIODS, owner_audits, owner_usage
 from metacore.error_codes import *
 from metacore import config
 
@@ -21,16 +36,46 @@ BTCTX_API = BtcTxStore(testnet=True, dryrun=True)
 
 hash_pattern = re.compile(r'^[a-f\d]{64}$')
 
+# roles of the files available without authentication
+PUBLIC_ROLES = ('001', '101')
+
+capacity_ledger = CapacityLedger(app.config['STATVFS_TTL'])
+chunk_store = ChunkStore(app.config['CHUNKS_FOLDER'],
+                         app.config['CHUNK_AVERAGE_SIZE'],
+                         app.config['BLOB_DURABILITY'])
+blob_cache = BlobCache(app.config['BLOB_CACHE_SIZE'],
+                       app.config['BLOB_CACHE_MAX_ENTRY_SIZE'],
+                       app.config['BLOB_CACHE_MIN_HITS'])
+upload_sessions = UploadSessions(app.config['UPLOAD_SESSIONS_FOLDER'],
+                                 app.config['UPLOAD_SESSION_TTL'],
+                                 durability=app.config['BLOB_DURABILITY'])
+bandwidth_shaper = BandwidthShaper(app.config['BANDWIDTH_BUCKETS_FILE'])
+blacklist = Blacklist(app.config['BLACKLIST_FILE'],
+                      app.config['BLACKLIST_COMPILED'],
+                      app.config['BLACKLIST_TAIL_LIMIT'])
+file_index = FileIndex(app.config['FILE_INDEX_SNAPSHOT'],
+                       app.config['FILE_INDEX_REFRESH_INTERVAL'],
+                       app.config['FILE_INDEX_CHANGES_KEPT'],
+                       app.config['FILE_INDEX_SNAPSHOT_INTERVAL'])
+audit_log = AuditLog(app.config['AUDIT_BATCH_SIZE'],
+                     app.config['AUDIT_FLUSH_INTERVAL'])
+peer_recovery = recovery.PeerRecovery(app.config['RECOVERY_TIMEOUT'],
+                                      app.config['RECOVERY_PART_SIZE'])
+request_profiler = RequestProfiler(app.config['PROFILES_FOLDER'])
+memory_tracker = MemoryTracker(app.config['PROFILES_FOLDER'],
+                               app.config['TRACEMALLOC_FRAMES'])
+
 
 class Checker:
     """
     Aggregator for common data and params checks.
     """
 
-    def __init__(self, data_hash, sender_address, signature):
+    def __init__(self, data_hash, sender_address, signature, trace=None):
         self.data_hash = data_hash
         self.sender_address = sender_address
         self.signature = signature
+        self.trace = Trace() if trace is None else trace
 
         self._checks = {
             'blacklist': self._check_blacklist,
@@ -43,25 +88,29 @@ class Checker:
     def check_all(self, *check_list):
         """
         Do all selected checks in selected order.
+        Every check is traced as the 'check.<name>' stage.
         :param check_list: names of needed checks
         :return: error code of the first failed check result or None
             if all ones are successful
         """
         try:
-            return next(iter(filter(None, [self._checks[check_item]()
+            return next(iter(filter(None, [self._traced_check(check_item)
                                       for check_item in check_list
                                       ])))
         except StopIteration:
             return None
 
+    def _traced_check(self, check_item):
+        with self.trace.span('check.' + check_item):
+            return self._checks[check_item]()
+
     def _check_blacklist(self):
         """
         Check if data_hash is in Blacklist.
         :return: 'Blacklist' error code or None if hash is not in list.
         """
-        with open(app.config['BLACKLIST_FILE']) as fp:
-            if self.data_hash in (_.strip() for _ in fp.readlines()):
-                return ERR_BLACKLIST
+        if self.data_hash in blacklist:
+            return ERR_BLACKLIST
 
     def _check_hash(self):
         """
@@ -88,12 +137,11 @@ class Checker:
         """
         Check if file record with data_hash exists in the `files` table
             and allowed for getting and then store it as self.file.
+        The record is taken from the files index.
         :return: 'Not Found' error code or None if the record exists.
-        :rtype: Response or RowProxy
+        :rtype: Response or FileRecord
         """
-        self.file = files.select(
-            files.c.hash == self.data_hash
-        ).execute().first()
+        self.file = file_index.get(self.data_hash)
 
         if not self.file or (
                         self.file.role[1] != '0' and
@@ -109,9 +157,7 @@ class Checker:
         :return:
 
         """
-        self.file = files.select(
-            files.c.hash == self.data_hash
-        ).execute().first()
+        self.file = file_index.get(self.data_hash)
 
         if self.file:
             return ERR_TRANSFER['REPEATED_UPLOAD']
@@ -126,7 +172,91 @@ def audit_data(data_hash, seed, sender, signature):
     :param signature: data signature
     :return: challenge response generated from the file data and seed
     """
-    checker = Checker(data_hash, sender, signature)
+    file = _check_audit(data_hash, seed, sender, signature, 'full')
+    if isinstance(file, int):
+        return file
+
+    trace = current_trace()
+    try:
+        with trace.span('hash'):
+            return blobs.hash_chunks(
+                trace.iter_span('read', _iter_stored(file)), seed.encode()
+            )
+    except (IOError, OSError, blobs.DecodingError):
+        return ERR_TRANSFER['LOST_FILE']
+
+
+def merkle_audit(data_hash, seed, sender, signature):
+    """
+    Answer the chunk audit challenge.
+    Leaves derived from the seed are returned with their Merkle proofs,
+    so only they are read instead of the whole file. The proofs are
+    checked by the auditor against the root returned by the upload,
+    the reported root only tells which tree they are made for.
+    :param data_hash: SHA-256 hash of the file
+    :param seed: challenge seed
+    :param sender: sender's BitCoin address
+    :param signature: data signature
+    :return: dict with the tree root, and the challenged chunks with
+        their proofs
+    """
+    file = _check_audit(data_hash, seed, sender, signature, 'merkle')
+    if isinstance(file, int):
+        return file
+
+    trace = current_trace()
+    try:
+        with trace.span('merkle.tree'):
+            tree = _merkle_tree(file)
+        indices = merkle.challenge_indices(
+            seed, tree.leaf_count, app.config['MERKLE_CHALLENGE_CHUNKS']
+        )
+        with trace.span('read'):
+            leaves = _read_leaves(file, indices, tree.chunk_size)
+        chunks = []
+        for index in indices:
+            # missing data gives an empty chunk, which fails the proof
+            data = leaves.get(index, b'')
+            with trace.span('merkle.proof'):
+                proof = tree.proof(index)
+            chunks.append({
+                'index': index,
+                'data': binascii.b2a_base64(data).decode().strip(),
+                'proof': proof
+            })
+        return {
+            'root': tree.root,
+            'chunk_size': tree.chunk_size,
+            'leaf_count': tree.leaf_count,
+            'chunks': chunks
+        }
+    except (IOError, OSError, blobs.DecodingError, merkle.MismatchedData):
+        return ERR_TRANSFER['LOST_FILE']
+
+
+def flush_audits():
+    """
+    Flush the buffered audits waiting too long.
+    Called by every request, so the audits are flushed by the workers
+    running no timer threads too.
+    :return: number of the inserted audits
+    """
+    return audit_log.flush_due()
+
+
+def _check_audit(data_hash, seed, sender, signature, mode):
+    """
+    Check the audit request and count it against the rate limits
+    of its mode.
+    :param data_hash: SHA-256 hash of the file
+    :param seed: challenge seed
+    :param sender: sender's BitCoin address
+    :param signature: data signature
+    :param mode: audit mode, 'full' or 'merkle'
+    :return: error code or the file record
+    """
+    trace = current_trace()
+    checker = Checker(data_hash, sender, signature, trace)
     checks_result = checker.check_all('signature', 'hash', 'blacklist')
     if checks_result:
         return checks_result
@@ -141,47 +271,42 @@ def audit_data(data_hash, seed, sender, signature):
     file = checker.file
     is_owner = sender == file.owner
 
-    current_attempts = audit.select(
-        and_(
-            audit.c.file_hash == data_hash,
-            audit.c.is_owners == is_owner,
-            audit.c.made_at >= datetime.now() - timedelta(hours=1)
+    with trace.span('db.audit_count'):
+        current_attempts = audit_log.count(
+            data_hash, is_owner, mode, datetime.now() - timedelta(hours=1)
         )
-    ).count().scalar()
 
+    limits = app.config['MERKLE_AUDIT_RATE_LIMITS' if mode == 'merkle'
+                        else 'AUDIT_RATE_LIMITS']
     limits_section = 'owner' if is_owner else 'other'
-    if current_attempts >= app.config['AUDIT_RATE_LIMITS'][limits_section]:
+    if current_attempts >= limits[limits_section]:
         return ERR_AUDIT['LIMIT_REACHED']
 
-    audit.insert().values(file_hash=data_hash, is_owners=is_owner).execute()
+    with trace.span('db.audit_insert'):
+        audit_log.add(data_hash, is_owner, mode)
 
-    try:
-        with open(os.path.join(app.config['UPLOAD_FOLDER'], data_hash),
-                  'rb') as f:
-            file_data = f.read()
-        return sha256(file_data + seed.encode()).hexdigest()
-    except:
-        return ERR_TRANSFER['LOST_FILE']
+    if not _is_stored(file):
+        file = _recover(file, sender, signature) or file
 
+    return file
 
-def download(data_hash, sender, signature, decryption_key):
+
+def check_download(data_hash, sender, signature):
     """
-    Check if data_hash is valid SHA-256 hash matched with existing file.
-    Download stored file from the Node.
+    Check if data_hash is valid SHA-256 hash matched with existing file
+    and the sender is allowed to get it.
     :param data_hash: SHA-256 hash for needed file
     :param sender: file sender's BitCoin address
     :param signature: data signature
-    :param decryption_key: key for decrypt stored file
-    :return: file data generator
+    :return: error code or the file record
     """
-    node = app.config['NODE']
-    checker = Checker(data_hash, sender, signature)
+    checker = Checker(data_hash, sender, signature, current_trace())
     if not (signature and sender):
         checks_result_unauthenticated = checker.check_all('hash', 'blacklist',
                                                           'file')
         if checks_result_unauthenticated:
             return checks_result_unauthenticated
-        if checker.file.role not in ('001', '101'):
+        if checker.file.role not in PUBLIC_ROLES:
             return ERR_TRANSFER['INVALID_SIGNATURE']
     else:
         checks_result_authenticated = checker.check_all('hash', 'blacklist',
@@ -189,36 +314,117 @@ def download(data_hash, sender, signature, decryption_key):
         if checks_result_authenticated:
             return checks_result_authenticated
 
-    file = checker.file
+    return checker.file
+
+
+def download(data_hash, sender, signature, decryption_key):
+    """
+    Check if data_hash is valid SHA-256 hash matched with existing file.
+    Download stored file from the Node.
+    :param data_hash: SHA-256 hash for needed file
+    :param sender: file sender's BitCoin address
+    :param signature: data signature
+    :param decryption_key: key for decrypt stored file
+    :return: file data generator or the open file, see read_file()
+    """
+    file = check_download(data_hash, sender, signature)
+    if isinstance(file, int):
+        return file
+
+    return read_file(file, decryption_key, sender, signature)
+
+
+def read_file(file, decryption_key, sender=None, signature=None,
+              byte_range=None):
+    """
+    Read the stored file already checked by check_download().
+    :param file: file record
+    :param decryption_key: key for decrypt stored file
+    :param sender: file sender's BitCoin address, forwarded to the peers
+        when the lost file is recovered and used for the rate limits
+    :param signature: data signature, forwarded with the sender
+    :param byte_range: (start, stop) tuple of the read part of a raw blob
+        without decryption, the whole file is read if None
+    :return: file data generator, or the open file of the raw blob
+        which is sent as it is
+    """
+    node = app.config['NODE']
+    trace = current_trace()
+    data_hash = file.hash
+    start, stop = byte_range or (0, file.size)
     if node.limits['outgoing'] is not None and (
-                file.size > node.limits['outgoing'] - node.current['outgoing']
+                stop - start >
+                node.limits['outgoing'] - node.current['outgoing']
     ):
         return ERR_TRANSFER['LIMIT_REACHED']
 
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], data_hash)
-    if not os.path.exists(file_path):
-        return ERR_TRANSFER['LOST_FILE']
+    if blob_cache.capacity and not decryption_key:
+        with trace.span('cache'):
+            cached_data = blob_cache.get(data_hash)
+        if cached_data is not None:
+            if byte_range:
+                cached_data = cached_data[start:stop]
+            return _shape_output(cached_data, sender, signature)
+
+    file_path = blobs.blob_path(app.config['UPLOAD_FOLDER'], data_hash)
+    if not _is_stored(file):
+        file = _recover(file, sender, signature)
+        if file is None:
+            return ERR_TRANSFER['LOST_FILE']
 
     if decryption_key:
         if file.role[2] == '1':
             try:
                 decryption_key = binascii.unhexlify(decryption_key)
                 # test on decryption_key validness
-                test_decrypt_data_generator = convergence.decrypt_generator(
-                        file_path, decryption_key)
-                next(test_decrypt_data_generator)
-                decrypt_data_generator = convergence.decrypt_generator(
-                        file_path, decryption_key)
-                return decrypt_data_generator
+                with trace.span('decrypt'):
+                    test_decrypt_data_generator = \
+                        convergence.decrypt_generator(file_path,
+                                                      decryption_key)
+                    next(test_decrypt_data_generator)
+                decrypt_data_generator = trace.iter_span(
+                    'decrypt',
+                    convergence.decrypt_generator(file_path, decryption_key)
+                )
+                return _shape_output(decrypt_data_generator, sender,
+                                     signature)
             except (binascii.Error, ValueError):
                 return ERR_TRANSFER['INVALID_DECRYPTION_KEY']
         else:
             return ERR_TRANSFER['NOT_FOUND']
 
-    with open(os.path.join(app.config['UPLOAD_FOLDER'], data_hash), 'rb') as f:
-        returned_data = f.read()
+    if file.codec:
+        returned_data = trace.iter_span('read', _iter_stored(file))
+        if not (blob_cache.capacity and
+                blob_cache.admits(data_hash, file.size)):
+            return _shape_output(returned_data, sender, signature)
+        returned_data = b''.join(returned_data)
+    elif byte_range:
+        return _shape_output(
+            blobs.iter_file(file_path, offset=start, size=stop - start),
+            sender, signature
+        )
+    elif not (blob_cache.capacity and
+              blob_cache.admits(data_hash, file.size)):
+        if _bandwidth_rates('outgoing', sender if signature else None):
+            return _shape_output(blobs.iter_file(file_path), sender,
+                                 signature)
+        # the server may send the file without copying it through Python
+        return open(file_path, 'rb')
+    else:
+        with trace.span('read'):
+            with open(file_path, 'rb') as f:
+                returned_data = f.read()
+
+    if blob_cache.capacity and blob_cache.admits(data_hash,
+                                                 len(returned_data)):
+        # only verified data is cached, so it never outlives corruption
+        with trace.span('hash'):
+            verified = sha256(returned_data).hexdigest() == data_hash
+        if verified:
+            blob_cache.put(data_hash, returned_data)
 
-    return returned_data
+    return _shape_output(returned_data, sender, signature)
 
 
 def files_list():
@@ -226,13 +432,112 @@ def files_list():
     Get list of files hashes stored on the Node.
     :return: list of hashes
     """
-    with open(app.config['BLACKLIST_FILE']) as fp:
-        blocked_hashes = [_.strip() for _ in fp.readlines()]
-    hash_list = [_['hash'] for _ in files.select().execute()
-                 if _['hash'] not in blocked_hashes]
+    hash_list = [_.hash for _ in select([files.c.hash]).execute()]
+    blocked = blacklist.blocked(hash_list)
+    if blocked:
+        hash_list = [_ for _ in hash_list if _ not in blocked]
     return hash_list
 
 
+def files_exist(hashes):
+    """
+    Check which of the files are stored on the Node.
+    Blacklisted files are reported missing, as they aren't listed.
+    :param hashes: list of SHA-256 hashes
+    :return: error code or list of flags in the order of the hashes
+    """
+    if len(hashes) > app.config['FILES_EXISTS_MAX_HASHES'] or \
+            not _valid_hashes(hashes):
+        return ERR_TRANSFER['INVALID_HASH']
+
+    present = [_ is not None for _ in file_index.get_many(hashes)]
+    blocked = blacklist.blocked(
+        [data_hash for data_hash, flag in zip(hashes, present) if flag]
+    )
+    if blocked:
+        present = [flag and data_hash not in blocked
+                   for data_hash, flag in zip(hashes, present)]
+    return present
+
+
+def _valid_hashes(hashes):
+    """
+    Check that all the hashes are lowercase hex SHA-256 hashes.
+    The hashes are checked joined, which is much faster than matching
+    them one by one.
+    :param hashes: list of hashes
+    :rtype: bool
+    """
+    try:
+        joined = u''.join(hashes)
+        binascii.unhexlify(joined)
+    except (TypeError, ValueError):
+        return False
+    return set(map(len, hashes)) <= {64} and joined == joined.lower()
+
+
+def owner_files_list(owner, sender, signature, after=None, limit=None):
+    """
+    Get the page of the owner's files hashes in the hash order.
+    The owner signs its address, so only the owner can list its files.
+    :param owner: owner's BitCoin address
+    :param sender: sender's BitCoin address
+    :param signature: owner address signature
+    :param after: hash the page starts after, None for the first page
+    :param limit: number of hashes in the page, FILES_PAGE_SIZE if None,
+        limited by FILES_MAX_PAGE_SIZE
+    :return: error code or dict with the owner, the hashes and the hash
+        the next page starts after (None for the last page)
+    """
+    if sender != owner:
+        return ERR_TRANSFER['INVALID_SIGNATURE']
+
+    trace = current_trace()
+    checks_result = Checker(owner, sender, signature,
+                            trace).check_all('signature')
+    if checks_result:
+        return checks_result
+
+    if limit is None:
+        limit = app.config['FILES_PAGE_SIZE']
+    limit = max(1, min(limit, app.config['FILES_MAX_PAGE_SIZE']))
+
+    with trace.span('db.owner_files'):
+        hashes = [_.hash for _ in select([files.c.hash]).where(and_(
+            files.c.owner == owner,
+            files.c.hash > (after or '')
+        )).order_by(files.c.hash).limit(limit).execute()]
+    blocked = blacklist.blocked(hashes)
+
+    return {
+        'owner': owner,
+        'hashes': [_ for _ in hashes if _ not in blocked],
+        'next': hashes[-1] if len(hashes) == limit else None
+    }
+
+
+def files_list_tag():
+    """
+    Get the validator of the files list.
+    It changes with any change of the `files` table or the Blacklist.
+    A missing Blacklist blocks nothing, so it has a fixed version.
+    :return: entity tag
+    """
+    try:
+        blacklist_version = os.path.getmtime(app.config['BLACKLIST_FILE'])
+    except OSError:
+        blacklist_version = 0
+    return 'files-{}-{}'.format(get_counter('files'), blacklist_version)
+
+
+def cache_info():
+    """
+    Get the blob cache usage metrics.
+    :return: cache metrics dict
+    """
+    return blob_cache.stats
+
+
 def node_info():
     """
     Get the Node info.
@@ -241,6 +546,205 @@ def node_info():
     return app.config['NODE'].info
 
 
+def node_info_tag():
+    """
+    Get the validator of the Node info.
+    It changes with any change of the `files` table, the traffic or
+    the Node data, and every minute as the traffic window moves.
+    :return: entity tag
+    """
+    return 'node-{}-{}-{}-{}'.format(get_counter('files'),
+                                     get_counter('traffic'),
+                                     int(time.time()) // 60,
+                                     app.config['NODE'].revision)
+
+
+def check_admin(action, timestamp, sender, signature):
+    """
+    Check if the request is signed by an admin.
+    Admins are the Node key and ADMIN_ADDRESSES. The signed message is
+    the action with the request time, so the signature expires.
+    :param action: request method and path, like 'POST /api/admin/profile/'
+    :param timestamp: UNIX time of the request
+    :param sender: sender's BitCoin address
+    :param signature: signature of '<action> <timestamp>'
+    :return: error code or None if the request is allowed
+    """
+    admins = list(app.config['ADMIN_ADDRESSES'])
+    admins.append(app.config['NODE'].public_key)
+    if not (sender in admins and signature):
+        return ERR_ADMIN['INVALID_SIGNATURE']
+
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        return ERR_ADMIN['INVALID_SIGNATURE']
+    if abs(time.time() - timestamp) > app.config['ADMIN_SIGNATURE_TTL']:
+        return ERR_ADMIN['EXPIRED_SIGNATURE']
+
+    if not BTCTX_API.verify_signature_unicode(
+            sender, signature, '{} {}'.format(action, timestamp)
+    ):
+        return ERR_ADMIN['INVALID_SIGNATURE']
+
+
+def plan_profiling(route, requests, fraction):
+    """
+    Profile the next requests to the route, or a fraction of them.
+    :param route: URL rule of the profiled route, None for all routes
+    :param requests: number of the profiled requests
+    :param fraction: profiled fraction of the requests
+    :return: error code or the profiling status
+    """
+    if fraction is not None:
+        if not 0 < fraction <= 1:
+            return ERR_ADMIN['INVALID_PARAMS']
+    elif requests is None or requests < 1:
+        return ERR_ADMIN['INVALID_PARAMS']
+
+    request_profiler.plan(route, requests, fraction)
+    return request_profiler.status
+
+
+def stop_profiling():
+    """
+    Cancel the planned profiling.
+    :return: profiling status
+    """
+    request_profiler.stop()
+    return request_profiler.status
+
+
+def profiling_status():
+    """
+    Get the profiling plan and the dumps.
+    :return: profiling status
+    """
+    return request_profiler.status
+
+
+def profiling_dump_path(name):
+    """
+    Get the path of the profiling dump.
+    :param name: dump name
+    :return: error code or the dump path
+    """
+    if name not in profiling.dumps(app.config['PROFILES_FOLDER']):
+        return ERR_ADMIN['NOT_FOUND']
+    return os.path.join(app.config['PROFILES_FOLDER'], name)
+
+
+def start_request_profile(route):
+    """
+    Start profiling the request if it's planned.
+    :param route: URL rule of the request
+    :return: profile or None
+    """
+    return request_profiler.start(route)
+
+
+def finish_request_profile(profile, route):
+    """
+    Stop profiling the request and dump the stats.
+    :param profile: profile returned by start_request_profile()
+    :param route: URL rule of the request
+    :return: dump name
+    """
+    return request_profiler.finish(profile, route)
+
+
+def owners_report(period, since=None):
+    """
+    Get the stored files and the audits of every owner.
+    Both are rolled up by triggers, so the report doesn't depend
+    on the number of files and audits. Old hourly audits are removed.
+    :param period: audits bucket length in seconds, 3600 or 86400
+    :param since: UNIX time of the first audits bucket, 24 buckets ago
+        if None
+    :return: error code or dict with the period and the list of owners
+        with their files number, bytes and (start, count) audits buckets
+    """
+    if period not in OWNER_AUDIT_PERIODS:
+        return ERR_ADMIN['INVALID_PARAMS']
+    if since is None:
+        since = int(time.time()) - 24 * period
+
+    # buffered audits are rolled up when they are inserted
+    audit_log.flush()
+
+    hours_period = OWNER_AUDIT_PERIODS[0]
+    owner_audits.delete().where(and_(
+        owner_audits.c.period == hours_period,
+        owner_audits.c.start <
+        time.time() - app.config['OWNER_AUDIT_HOURS_AGE'] - hours_period
+    )).execute()
+
+    owners = {}
+    for row in owner_usage.select().execute():
+        owners[row.owner] = {'owner': row.owner, 'files': row.files,
+                             'bytes': row.bytes, 'audits': []}
+    for row in owner_audits.select().where(and_(
+        owner_audits.c.period == period,
+        owner_audits.c.start >= since - since % period
+    )).order_by(owner_audits.c.owner, owner_audits.c.start).execute():
+        owners.setdefault(row.owner, {
+            'owner': row.owner, 'files': 0, 'bytes': 0, 'audits': []
+        })['audits'].append([row.start, row.count])
+
+    return {
+        'period': period,
+        'owners': [owners[_] for _ in sorted(owners)]
+    }
+
+
+def memory_snapshot(limit):
+    """
+    Take the allocations snapshot and compare it with the previous one.
+    :param limit: number of the biggest growths
+    :return: error code or the snapshot report
+    """
+    if not memory_tracker.supported:
+        return ERR_ADMIN['NOT_SUPPORTED']
+    if limit < 1:
+        return ERR_ADMIN['INVALID_PARAMS']
+    return memory_tracker.snapshot(limit)
+
+
+def stop_memory_tracing():
+    """
+    Stop tracing the allocations.
+    :return: tracing status
+    """
+    memory_tracker.stop()
+    return {'tracing': memory_tracker.tracing}
+
+
+def reserve_space(size):
+    """
+    Reserve the space for uploading data before receiving it.
+    :param size: expected data size, MAX_FILE_SIZE is reserved if unknown
+    :return: reservation id or None if there is no enough space
+    """
+    if not size or size > app.config['MAX_FILE_SIZE']:
+        size = app.config['MAX_FILE_SIZE']
+
+    try:
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+    except OSError:
+        pass
+
+    return capacity_ledger.reserve(size, app.config['NODE'].capacity,
+                                   app.config['UPLOAD_FOLDER'])
+
+
+def release_space(reservation_id):
+    """
+    Give the reserved space back.
+    :param reservation_id: id of the reservation
+    """
+    capacity_ledger.release(reservation_id)
+
+
 def upload(file, data_hash, role, sender, signature):
     """
     Check if data_hash is valid SHA-256 hash matched with uploading file.
@@ -255,17 +759,19 @@ def upload(file, data_hash, role, sender, signature):
     :param signature: data signature
     """
     node = app.config['NODE']
-    checker = Checker(data_hash, sender, signature)
+    trace = current_trace()
+    checker = Checker(data_hash, sender, signature, trace)
 
     checks_result = checker.check_all('double_uploading')
     if checks_result:
-        return {'file_role': checker.file.role}
+        return _stored_file_info(checker.file)
 
     checks_result = checker.check_all('signature', 'hash', 'blacklist')
     if checks_result:
         return checks_result
 
-    file_data = file.read()
+    with trace.span('read'):
+        file_data = file.read()
     file_size = len(file_data)
 
     try:
@@ -284,16 +790,506 @@ def upload(file, data_hash, role, sender, signature):
     ):
         return ERR_TRANSFER['LIMIT_REACHED']
 
-    if data_hash != sha256(file_data).hexdigest():
+    with trace.span('hash'):
+        file_hash = sha256(file_data).hexdigest()
+    if data_hash != file_hash:
         return ERR_TRANSFER['MISMATCHED_HASH']
 
-    with open(os.path.join(app.config['UPLOAD_FOLDER'], data_hash),
-              'wb') as file_to_save:
-        file_to_save.write(file_data)
+    merkle_root = _save_file(data_hash, lambda: [file_data], file_size, role,
+                             sender)
+    return {'file_role': role, 'merkle_root': merkle_root}
+
 
-    files.insert().values(
-        hash=data_hash,
-        role=role,
-        size=len(file_data),
-        owner=sender
-    ).execute()
+def open_upload(data_hash, size, role, sender, signature):
+    """
+    Start the resumable upload of the data sent by parts.
+    The space for the whole data is reserved for the session lifetime.
+    :param data_hash: SHA-256 hash for data
+    :param size: data size in bytes
+    :param role: file role
+    :param sender: file sender's BitCoin address
+    :param signature: data signature
+    :return: error code, dict with the role of the already stored file
+        or the session info
+    """
+    node = app.config['NODE']
+    checker = Checker(data_hash, sender, signature, current_trace())
+
+    checks_result = checker.check_all('double_uploading')
+    if checks_result:
+        return _stored_file_info(checker.file)
+
+    checks_result = checker.check_all('signature', 'hash', 'blacklist')
+    if checks_result:
+        return checks_result
+
+    if size < 0:
+        return ERR_TRANSFER['INVALID_SIZE']
+
+    if size > app.config['MAX_FILE_SIZE']:
+        return ERR_TRANSFER['HUGE_FILE']
+
+    if node.limits['incoming'] is not None and (
+                size > node.limits['incoming'] - node.current['incoming']
+    ):
+        return ERR_TRANSFER['LIMIT_REACHED']
+
+    for reservation_id in upload_sessions.expire():
+        capacity_ledger.release(reservation_id)
+
+    try:
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+    except OSError:
+        pass
+
+    # the ledger refuses empty reservations, an empty file still has a part
+    reservation_id = capacity_ledger.reserve(
+        max(size, 1), node.capacity, app.config['UPLOAD_FOLDER'],
+        app.config['UPLOAD_SESSION_TTL']
+    )
+    if reservation_id is None:
+        return ERR_TRANSFER['FULL_DISK']
+
+    return _session_info(upload_sessions.open(
+        data_hash, role, sender, size, app.config['UPLOAD_PART_SIZE'],
+        reservation_id
+    ))
+
+
+def upload_status(session_id, sender, signature):
+    """
+    Get the state of the resumable upload.
+    :param session_id: session id
+    :param sender: file sender's BitCoin address
+    :param signature: data signature
+    :return: error code or the session info
+    """
+    session = _get_session(session_id, sender, signature)
+    if isinstance(session, int):
+        return session
+
+    return _session_info(session)
+
+
+def upload_part(session_id, number, stream, sender, signature):
+    """
+    Save the numbered part of the resumable upload.
+    Parts may be sent in any order and again.
+    :param session_id: session id
+    :param number: part number starting from 0
+    :param stream: file-like object with the part data
+    :param sender: file sender's BitCoin address
+    :param signature: data signature
+    :return: error code or the session info
+    """
+    session = _get_session(session_id, sender, signature)
+    if isinstance(session, int):
+        return session
+
+    if not 0 <= number < upload_sessions.parts_count(session):
+        return ERR_TRANSFER['INVALID_PART']
+
+    stream = shape_input(stream, sender)
+    with current_trace().span('write'):
+        saved = upload_sessions.save_part(session, number, stream)
+    if not saved:
+        return ERR_TRANSFER['INVALID_PART']
+
+    return _session_info(session)
+
+
+def commit_upload(session_id, sender, signature):
+    """
+    Finish the resumable upload.
+    The joined parts are checked against the data hash as a stream
+    and saved like a whole uploaded file. The session is closed
+    and its space reservation is released in any case but missing parts.
+    :param session_id: session id
+    :param sender: file sender's BitCoin address
+    :param signature: data signature
+    :return: error code or dict with the data hash and the file role
+    """
+    session = _get_session(session_id, sender, signature)
+    if isinstance(session, int):
+        return session
+
+    if len(upload_sessions.received(session)) < \
+            upload_sessions.parts_count(session):
+        return ERR_TRANSFER['INCOMPLETE_UPLOAD']
+
+    if not upload_sessions.claim(session_id):
+        return ERR_TRANSFER['NOT_FOUND']
+
+    trace = current_trace()
+    try:
+        checker = Checker(session.data_hash, sender, signature, trace)
+        if checker.check_all('double_uploading'):
+            result = _stored_file_info(checker.file)
+            result['data_hash'] = session.data_hash
+            return result
+
+        with trace.span('hash'):
+            data_hash = blobs.hash_chunks(trace.iter_span(
+                'read', upload_sessions.iter_data(session)
+            ))
+        if data_hash != session.data_hash:
+            return ERR_TRANSFER['MISMATCHED_HASH']
+
+        merkle_root = _save_file(
+            data_hash, lambda: upload_sessions.iter_data(session),
+            session.size, session.role, session.owner
+        )
+        return {'data_hash': data_hash, 'file_role': session.role,
+                'merkle_root': merkle_root}
+    finally:
+        upload_sessions.remove(session_id)
+        capacity_ledger.release(session.reservation_id)
+
+
+def current_trace():
+    """
+    Get the trace of the current request.
+    Outside of requests a new trace is returned, which is never logged.
+    :return: Trace
+    """
+    if has_request_context():
+        trace = getattr(g, 'trace', None)
+        if trace is not None:
+            return trace
+    return Trace()
+
+
+def shape_input(stream, sender):
+    """
+    Limit the rate of reading the uploaded data.
+    :param stream: file-like object with the uploaded data
+    :param sender: file sender's BitCoin address
+    :return: file-like object
+    """
+    rates = _bandwidth_rates('incoming', sender)
+    if not rates:
+        return stream
+    return ShapedStream(stream, bandwidth_shaper, rates)
+
+
+def _shape_output(data, sender, signature):
+    """
+    Limit the rate of sending the downloaded data.
+    Unsigned downloads share the anonymous sender rate.
+    :param data: binary data or iterable of binary chunks
+    :param sender: file sender's BitCoin address
+    :param signature: data signature
+    :return: data or generator of binary chunks
+    """
+    rates = _bandwidth_rates('outgoing', sender if signature else None)
+    if not rates:
+        return data
+
+    return bandwidth_shaper.iter_shaped(_iter_chunks(data), rates)
+
+
+def count_input(stream):
+    """
+    Count the uploaded bytes actually received.
+    :param stream: file-like object with the uploaded data
+    :return: file-like object adding the read bytes to the Node incoming
+        traffic when it's closed
+    """
+    return CountingStream(stream, _traffic_reporter(True))
+
+
+def count_output(data):
+    """
+    Count the downloaded bytes actually sent.
+    :param data: binary data or iterable of binary chunks
+    :return: iterable adding the sent bytes to the Node outgoing
+        traffic when it's closed
+    """
+    return CountingIterator(_iter_chunks(data), _traffic_reporter(False))
+
+
+def count_output_file(fp, on_close=None, server_wrapper=False):
+    """
+    Count the downloaded file sent by the server.
+    :param fp: open binary file
+    :param on_close: callable called after the file is closed
+    :param server_wrapper: the file is passed to the server's file wrapper,
+        which may send it without reading
+    :return: file-like object adding the sent bytes to the Node outgoing
+        traffic when it's closed
+    """
+    return CountingFile(fp, os.fstat(fp.fileno()).st_size,
+                        _traffic_reporter(False), on_close, server_wrapper)
+
+
+def _traffic_reporter(incoming):
+    """
+    Make the callable adding the transferred bytes to the Node traffic.
+    """
+    node = app.config['NODE']
+    add_traffic = node.add_incoming if incoming else node.add_outgoing
+
+    def report(volume):
+        if volume:
+            add_traffic(volume)
+    return report
+
+
+def _iter_chunks(data):
+    """
+    Split the binary data into chunks, iterables are kept as they are.
+    :param data: binary data or iterable of binary chunks
+    :return: iterable of binary chunks
+    """
+    if isinstance(data, bytes):
+        return (data[_:_ + blobs.CHUNK_SIZE]
+                for _ in range(0, len(data), blobs.CHUNK_SIZE))
+    return data
+
+
+def _bandwidth_rates(direction, sender):
+    """
+    Get the token buckets limiting the transfer.
+    :param direction: 'incoming' or 'outgoing'
+    :param sender: sender's BitCoin address, None for anonymous transfers
+    :return: list of (bucket name, rate in bytes per second)
+    """
+    rates = app.config['NODE'].rates
+    buckets = []
+    if rates.get(direction):
+        buckets.append(('node:' + direction, rates[direction]))
+
+    sender_rate = rates.get('per_sender', {}).get(direction)
+    if sender_rate:
+        buckets.append(('sender:{}:{}'.format(sender or 'anonymous',
+                                               direction), sender_rate))
+    return buckets
+
+
+def _get_session(session_id, sender, signature):
+    """
+    Get the upload session of the sender.
+    :return: error code or the session record
+    """
+    session = upload_sessions.get(session_id)
+    if session is None or session.owner != sender:
+        return ERR_TRANSFER['NOT_FOUND']
+
+    checks_result = Checker(session.data_hash, sender, signature,
+                            current_trace()).check_all('signature')
+    if checks_result:
+        return checks_result
+
+    return session
+
+
+def _session_info(session):
+    """
+    Describe the upload session.
+    :param session: session record
+    :return: session info dict
+    """
+    return {
+        'session_id': session.id,
+        'data_hash': session.data_hash,
+        'file_size': session.size,
+        'part_size': session.part_size,
+        'parts_count': upload_sessions.parts_count(session),
+        'received_parts': upload_sessions.received(session),
+        'expires_at': session.expires_at.isoformat()
+    }
+
+
+def _save_file(data_hash, read_data, size, role, owner):
+    """
+    Save the verified data and insert a record in the 'files' table.
+    :param data_hash: SHA-256 hash for data
+    :param read_data: callable returning a new iterable of binary chunks
+    :param size: data size in bytes
+    :param role: file role
+    :param owner: file owner's BitCoin address
+    :return: hex digest of the Merkle tree root
+    """
+    trace = current_trace()
+    with trace.span('write'):
+        codec, stored_size = _store_blob(data_hash, read_data(), role)
+    with trace.span('merkle.tree'):
+        merkle_root = _save_merkle_tree(data_hash, read_data())
+
+    with trace.span('db.files_insert'):
+        try:
+            files.insert().values(
+                hash=data_hash,
+                role=role,
+                size=size,
+                owner=owner,
+                codec=codec,
+                stored_size=stored_size if codec else None
+            ).execute()
+        except IntegrityError:
+            # saved by another worker meanwhile, whose record isn't
+            # followed by the index yet; the data is the same
+            pass
+        # the uploaded file is found by the next lookup of the worker
+        file_index.refresh()
+    return merkle_root
+
+
+def _store_blob(data_hash, data_chunks, role):
+    """
+    Save the blob with the configured storage engine.
+    Only plaintext data is compressed or split into chunks.
+    :param data_hash: SHA-256 hash of the blob
+    :param data_chunks: iterable of binary chunks
+    :param role: file role
+    :return: codec name (None for raw data) and stored size
+    """
+    codecs = ()
+    if role[2:3] == '0':
+        if app.config['STORAGE_ENGINE'] == 'chunks':
+            chunk_store.save(data_hash, data_chunks)
+            # chunks are shared, so their size is counted by the store
+            return chunkstore.CODEC, 0
+        codecs = app.config['COMPRESSION_CODECS']
+
+    return blobs.save_blob(app.config['UPLOAD_FOLDER'], data_hash,
+                           data_chunks, codecs,
+                           app.config['COMPRESSION_MIN_SAVING'],
+                           durability=app.config['BLOB_DURABILITY'])
+
+
+def _is_stored(file):
+    """
+    Check if the blob of the file record is present in the storage.
+    :param file: file record
+    :rtype: bool
+    """
+    if file.codec == chunkstore.CODEC:
+        return chunk_store.exists(file.hash)
+    return os.path.exists(blobs.blob_path(app.config['UPLOAD_FOLDER'],
+                                          file.hash))
+
+
+def _save_merkle_tree(data_hash, data_chunks, check=False):
+    """
+    Build and save the Merkle tree of the blob for chunk audits.
+    :param data_hash: SHA-256 hash of the blob
+    :param data_chunks: iterable of binary chunks
+    :param check: check the data against the hash first
+    :return: hex digest of the root
+    """
+    try:
+        os.makedirs(app.config['MERKLE_FOLDER'])
+    except OSError:
+        pass
+
+    return merkle.save_tree(app.config['MERKLE_FOLDER'], data_hash,
+                            data_chunks, app.config['MERKLE_CHUNK_SIZE'],
+                            check)
+
+
+def _merkle_tree(file):
+    """
+    Get the Merkle tree of the stored blob.
+    Trees of the blobs stored before chunk audits are built on demand
+    from the stored data checked against the hash, so a corrupted blob
+    never gets a tree proving it.
+    :param file: file record
+    :return: MerkleTree
+    """
+    path = blobs.blob_path(app.config['MERKLE_FOLDER'], file.hash)
+    if not os.path.exists(path):
+        _save_merkle_tree(file.hash, _iter_stored(file), check=True)
+    return merkle.MerkleTree(path)
+
+
+def _stored_file_info(file):
+    """
+    Describe the already stored file for its repeated upload.
+    :param file: file record
+    :return: dict with the file role and the Merkle tree root,
+        which is None if the tree can't be read
+    """
+    try:
+        merkle_root = _merkle_tree(file).root
+    except (IOError, OSError, blobs.DecodingError, merkle.MismatchedData):
+        merkle_root = None
+    return {'file_role': file.role, 'merkle_root': merkle_root}
+
+
+def _read_leaves(file, indices, chunk_size):
+    """
+    Read the chunks of the stored blob at the leaf indices.
+    Raw blobs are read with seeks, encoded ones are decoded
+    up to the last needed chunk.
+    :param file: file record
+    :param indices: sorted leaf indices
+    :param chunk_size: size of the tree leaves chunks in bytes
+    :return: dict of leaf index -> chunk data
+    """
+    leaves = {}
+    if not file.codec:
+        path = blobs.blob_path(app.config['UPLOAD_FOLDER'], file.hash)
+        with open(path, 'rb') as fp:
+            for index in indices:
+                fp.seek(index * chunk_size)
+                leaves[index] = fp.read(chunk_size)
+        return leaves
+
+    wanted = set(indices)
+    for index, chunk in enumerate(merkle.split(_iter_stored(file),
+                                               chunk_size)):
+        if index in wanted:
+            leaves[index] = chunk
+            if len(leaves) == len(wanted):
+                break
+    return leaves
+
+
+def _recover(file, sender=None, signature=None):
+    """
+    Fetch the lost blob from the peers and restore it to the storage.
+    :param file: file record
+    :param sender: file sender's BitCoin address
+    :param signature: data signature
+    :return: updated file record or None if the blob isn't recovered
+    """
+    if not app.config['PEER_RECOVERY']:
+        return None
+
+    headers = {}
+    if sender and signature:
+        headers = {'sender_address': sender, 'signature': signature}
+
+    def restore(path):
+        codec, stored_size = _store_blob(file.hash, blobs.iter_file(path),
+                                         file.role)
+        files.update().where(files.c.hash == file.hash).values(
+            codec=codec,
+            stored_size=stored_size if codec else None
+        ).execute()
+
+    peers = recovery.read_peers(app.config['PEERS_FILE'],
+                                app.config['RECOVERY_PEERS'])
+    with current_trace().span('recovery'):
+        recovered = peer_recovery.recover(file.hash, file.size, peers,
+                                          app.config['UPLOAD_FOLDER'],
+                                          restore, headers)
+    if not recovered:
+        return None
+
+    file_index.refresh()
+    return file_index.get(file.hash)
+
+
+def _iter_stored(file):
+    """
+    Read the original data of the stored blob chunk by chunk.
+    :param file: file record
+    :return: generator of binary chunks
+    """
+    if file.codec == chunkstore.CODEC:
+        return chunk_store.iter_blob(file.hash)
+    return blobs.iter_blob(
+        blobs.blob_path(app.config['UPLOAD_FOLDER'], file.hash), file.codec
+    )
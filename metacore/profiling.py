@@ -0,0 +1,358 @@
+import cProfile
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+__author__ = 'karatel'
+
+
+PROFILE_SUFFIX = '.pstats'
+SNAPSHOT_SUFFIX = '.snapshot'
+PLAN_NAME = 'plan.json'
+
+
+class RequestProfiler(object):
+    """
+    cProfile of the selected requests.
+    Profiling is planned for the next number of requests to a route or for
+    a fraction of them picked at random, and every profiled request is
+    dumped to its own .pstats file. The plan and the number of
+    the profiled requests are kept in a file of the dumps folder, so all
+    the workers follow the same plan whichever of them got it. The file
+    is read again only when it changes, so while nothing is planned
+    a request costs one stat() of it. Updates are serialized by a lock
+    of the file between the processes and by a lock of the profiler
+    between the threads.
+    """
+
+    def __init__(self, folder, clock=time.time, sample=random.random):
+        """
+        :param folder: folder of the dumps
+        :param clock: time source
+        :param sample: source of random numbers in [0, 1)
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, PLAN_NAME)
+        self._clock = clock
+        self._sample = sample
+        self._lock = threading.Lock()
+        self._numbers = itertools.count()
+        # version of the read file and its state
+        self._read = (None, _empty_state())
+
+    def plan(self, route=None, requests=None, fraction=None):
+        """
+        Profile the next requests.
+        :param route: URL rule of the profiled route, None for all routes
+        :param requests: number of the profiled requests
+        :param fraction: profiled fraction of the requests, used instead of
+            the number of requests
+        :return: None
+        :rtype: NoneType
+        """
+        plan = {
+            'route': route,
+            'remaining': None if fraction is not None else requests,
+            'fraction': fraction
+        }
+        self._update(lambda state: state.update(plan=plan))
+
+    def stop(self):
+        """
+        Cancel the planned profiling.
+        :return: None
+        :rtype: NoneType
+        """
+        self._update(lambda state: state.update(plan=None))
+
+    @property
+    def profiled(self):
+        """
+        Number of the requests profiled by all the workers.
+        :rtype: int
+        """
+        return self._state()['profiled']
+
+    @property
+    def status(self):
+        """
+        Describe the plan and the dumps.
+        :return: dict with the plan (None if nothing is planned),
+            the number of the profiled requests and the dumps names
+        :rtype: dict
+        """
+        state = self._state()
+        return {
+            'plan': dict(state['plan']) if state['plan'] is not None else None,
+            'profiled': state['profiled'],
+            'dumps': dumps(self.folder)
+        }
+
+    def start(self, route):
+        """
+        Start profiling the request if it's planned.
+        :param route: URL rule of the request
+        :return: enabled cProfile.Profile or None
+        """
+        plan = self._state()['plan']
+        if plan is None:
+            return None
+
+        if plan['route'] is not None and plan['route'] != route:
+            return None
+
+        if plan['fraction'] is not None:
+            if self._sample() >= plan['fraction']:
+                return None
+        elif not self._update(lambda state: _take_request(state, route)):
+            return None
+
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, route):
+        """
+        Stop profiling the request and dump the stats.
+        :param profile: profile returned by start()
+        :param route: URL rule of the request
+        :return: dump name
+        :rtype: str
+        """
+        profile.disable()
+
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            pass
+
+        name = '{}-{}-{}-{}{}'.format(
+            int(self._clock() * 1000), os.getpid(), next(self._numbers),
+            re.sub(r'[^\w]+', '_', route).strip('_') or 'index',
+            PROFILE_SUFFIX
+        )
+        profile.dump_stats(os.path.join(self.folder, name))
+        self._update(lambda state: state.update(
+            profiled=state['profiled'] + 1
+        ))
+        return name
+
+    def _state(self):
+        """
+        Read the shared state unless the file is unchanged since
+        the last read.
+        :return: dict with the plan and the number of the profiled requests
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return _empty_state()
+        version = (stat.st_ino, stat.st_size,
+                   getattr(stat, 'st_mtime_ns', stat.st_mtime))
+        read_version, state = self._read
+        if version != read_version:
+            with self._lock:
+                state = self._locked(os.O_RDONLY, _lock_shared, None)
+                self._read = version, state
+        return state
+
+    def _update(self, change):
+        """
+        Change the shared state and write it back.
+        :param change: function changing the state dict in place
+        :return: result of the change
+        """
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            pass
+        with self._lock:
+            return self._locked(os.O_RDWR | os.O_CREAT, _lock_exclusive,
+                                change)
+
+    def _locked(self, flags, lock, change):
+        fd = os.open(self.path, flags, 0o644)
+        try:
+            lock(fd)
+            data = b''
+            for chunk in iter(lambda: os.read(fd, 4096), b''):
+                data += chunk
+            try:
+                state = json.loads(data.decode())
+            except ValueError:
+                # a new file, or the one torn by a crash
+                state = _empty_state()
+            if change is None:
+                return state
+            result = change(state)
+            data = json.dumps(state).encode()
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, data)
+            return result
+        finally:
+            os.close(fd)
+
+
+def _empty_state():
+    return {'plan': None, 'profiled': 0}
+
+
+def _take_request(state, route):
+    """
+    Take a request to the route from the planned number.
+    The plan may be changed by another worker since it was read.
+    :return: True if the request is profiled
+    """
+    plan = state['plan']
+    if plan is None or plan['fraction'] is not None or \
+            plan['remaining'] <= 0 or \
+            plan['route'] is not None and plan['route'] != route:
+        return False
+    plan['remaining'] -= 1
+    if not plan['remaining']:
+        state['plan'] = None
+    return True
+
+
+def _lock_shared(fd):
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_SH)
+
+
+def _lock_exclusive(fd):
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+
+
+class MemoryTracker(object):
+    """
+    tracemalloc snapshots compared with the previous ones.
+    Allocations are traced since the first snapshot till stop(),
+    so there is no overhead before. Snapshots are dumped to be loaded
+    with tracemalloc.Snapshot.load().
+    Allocations are traced in the process only, so with several workers
+    a snapshot is taken and compared by the worker which got the request,
+    and stop() stops tracing of that worker alone. Use it with a single
+    worker, or compare the snapshots of the same process ID.
+    """
+
+    def __init__(self, folder, frames=25, clock=time.time):
+        """
+        :param folder: folder of the dumps
+        :param frames: number of frames stored in the traceback of a trace
+        :param clock: time source
+        """
+        self.folder = folder
+        self.frames = frames
+        self._clock = clock
+        self._previous = None
+
+    @property
+    def supported(self):
+        """
+        Check if allocations tracing is available in this Python.
+        :rtype: bool
+        """
+        return tracemalloc is not None
+
+    @property
+    def tracing(self):
+        """
+        Check if allocations are traced.
+        :rtype: bool
+        """
+        return self.supported and tracemalloc.is_tracing()
+
+    def snapshot(self, limit=10):
+        """
+        Take the snapshot and compare it with the previous one.
+        The first snapshot starts tracing, so it has no growth.
+        :param limit: number of the biggest growths
+        :return: dict with the dump name, the process ID, the traced memory
+            size and the biggest growths by the traceback, most recent
+            call last
+        :rtype: dict
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._previous = None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>')
+        ))
+
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            pass
+        name = '{}-{}{}'.format(int(self._clock() * 1000), os.getpid(),
+                                SNAPSHOT_SUFFIX)
+        snapshot.dump(os.path.join(self.folder, name))
+
+        growth = []
+        if self._previous is not None:
+            for stat in snapshot.compare_to(self._previous,
+                                            'traceback')[:limit]:
+                frames = ['{}:{}'.format(_.filename, _.lineno)
+                          for _ in stat.traceback]
+                # older Pythons put the most recent frame first
+                if sys.version_info < (3, 7):
+                    frames.reverse()
+                growth.append({
+                    'size': stat.size,
+                    'size_diff': stat.size_diff,
+                    'count_diff': stat.count_diff,
+                    'traceback': frames
+                })
+        self._previous = snapshot
+
+        return {
+            'snapshot': name,
+            'pid': os.getpid(),
+            'traced': tracemalloc.get_traced_memory()[0],
+            'growth': growth
+        }
+
+    def stop(self):
+        """
+        Stop tracing and forget the snapshots.
+        :return: None
+        :rtype: NoneType
+        """
+        if self.tracing:
+            tracemalloc.stop()
+        self._previous = None
+
+
+def dumps(folder):
+    """
+    List the profiling dumps.
+    :param folder: folder of the dumps
+    :return: sorted dumps names
+    :rtype: list
+    """
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    return sorted(_ for _ in names
+                  if _.endswith((PROFILE_SUFFIX, SNAPSHOT_SUFFIX)))
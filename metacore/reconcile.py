@@ -0,0 +1,146 @@
+import os
+import re
+import tempfile
+import time
+
+from metacore import blobs, chunkstore
+from metacore.database import integrity, iter_files
+from metacore.scrubber import STATUS_MISSING
+
+
+__author__ = 'karatel'
+
+
+hash_pattern = re.compile(r'^[a-f\d]{64}$')
+
+BUCKETS = '0123456789abcdef'
+
+
+def _scan(folder):
+    """
+    Iterate over the names in the folder without listing it at once
+    where it's possible.
+    """
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(folder):
+            yield entry.name
+    else:
+        for name in os.listdir(folder):
+            yield name
+
+
+class Reconciler(object):
+    """
+    Match stored blobs with the `files` records.
+    Remove blobs without records (orphans) older than the grace period
+    and mark records without blobs (dangling) as missing. Temporary files
+    left by crashed writes are removed after the grace period too.
+    """
+
+    def __init__(self, upload_folder, grace_period, clock=time.time):
+        """
+        :param upload_folder: folder with stored blobs
+        :param grace_period: minimal orphan age in seconds to be removed
+        :param clock: time source
+        """
+        self.upload_folder = upload_folder
+        self.grace_period = grace_period
+        self._clock = clock
+
+    def run(self):
+        """
+        Do the reconciliation in one merge pass over sorted blob names
+        and sorted records.
+        The folder is scanned once and the names are spilled to temporary
+        files by the first hash digit, so only one sixteenth of the names
+        is sorted in memory at a time.
+        :return: reconciliation report
+        :rtype: dict
+        """
+        report = {
+            'orphans': 0,
+            'reclaimed': 0,
+            'young_orphans': 0,
+            'temporary': 0,
+            'young_temporary': 0,
+            'dangling': 0,
+            'used': 0
+        }
+
+        spills = dict((bucket, tempfile.TemporaryFile('w+'))
+                      for bucket in BUCKETS)
+        try:
+            for name in _scan(self.upload_folder):
+                if hash_pattern.match(name):
+                    spills[name[0]].write(name + '\n')
+                elif name.startswith(blobs.TEMP_PREFIX):
+                    self._orphan(name, report, 'temporary',
+                                 'young_temporary')
+
+            records = iter_files()
+            record = next(records, None)
+            for name in self._stored_names(spills):
+                while record is not None and record.hash < name:
+                    self._dangling(record, report)
+                    record = next(records, None)
+
+                if record is not None and record.hash == name:
+                    report['used'] += (
+                        record.size if record.stored_size is None
+                        else record.stored_size
+                    )
+                    record = next(records, None)
+                else:
+                    self._orphan(name, report)
+
+            while record is not None:
+                self._dangling(record, report)
+                record = next(records, None)
+        finally:
+            for spill in spills.values():
+                spill.close()
+
+        return report
+
+    def _stored_names(self, spills):
+        for bucket in BUCKETS:
+            spill = spills[bucket]
+            spill.seek(0)
+            for name in sorted(_.strip() for _ in spill):
+                yield name
+
+    def _orphan(self, name, report, kind='orphans', young='young_orphans'):
+        path = os.path.join(self.upload_folder, name)
+        try:
+            stat = os.stat(path)
+            if self._clock() - stat.st_mtime < self.grace_period:
+                report[young] += 1
+                return
+            os.unlink(path)
+        except OSError:
+            return
+
+        report[kind] += 1
+        report['reclaimed'] += stat.st_size
+
+    def _dangling(self, record, report):
+        if record.codec == chunkstore.CODEC:
+            # chunked blobs have no files in the folder
+            return
+        integrity.insert().prefix_with('OR REPLACE').values(
+            file_hash=record.hash,
+            status=STATUS_MISSING
+        ).execute()
+        report['dangling'] += 1
+
+
+def main():
+    from metacore.processor import app
+
+    reconciler = Reconciler(app.config['UPLOAD_FOLDER'],
+                            app.config['ORPHAN_GRACE_PERIOD'])
+    print(reconciler.run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+from metacore import blobs
+
+
+__author__ = 'karatel'
+
+
+content_range_pattern = re.compile(r'^bytes (\d+)-(\d+)/')
+
+
+class _Fetch(object):
+    """
+    Fetch of one blob shared by all the requests waiting for it.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = False
+
+
+class PeerRecovery(object):
+    """
+    Recover lost blobs from the peers.
+    The blob is split into parts fetched in parallel with range requests
+    from different peers, then it's verified against its hash as a stream.
+    """
+
+    def __init__(self, timeout=10, part_size=4 * 1024 * 1024,
+                 max_workers=8):
+        """
+        :param timeout: timeout of one request to a peer in seconds
+        :param part_size: size of one range request in bytes
+        :param max_workers: maximal number of parallel requests
+        """
+        self.timeout = timeout
+        self.part_size = part_size
+        self.max_workers = max_workers
+
+        self._lock = threading.Lock()
+        self._fetches = {}
+
+    def recover(self, data_hash, size, peers, folder, restore, headers=None):
+        """
+        Fetch the blob and restore it.
+        Concurrent calls for the same blob share one fetch.
+        :param data_hash: SHA-256 hash of the blob
+        :param size: blob size in bytes
+        :param peers: base URLs of the peers
+        :param folder: folder for the temporary file
+        :param restore: callable saving the verified temporary file
+        :param headers: headers sent to the peers
+        :return: True if the blob was restored
+        :rtype: bool
+        """
+        with self._lock:
+            fetch = self._fetches.get(data_hash)
+            is_leader = fetch is None
+            if is_leader:
+                fetch = self._fetches[data_hash] = _Fetch()
+
+        if not is_leader:
+            fetch.done.wait()
+            return fetch.result
+
+        path = None
+        try:
+            path = self.fetch(data_hash, size, peers, folder, headers)
+            if path is not None:
+                restore(path)
+                fetch.result = True
+        finally:
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
+            with self._lock:
+                del self._fetches[data_hash]
+            fetch.done.set()
+
+        return fetch.result
+
+    def fetch(self, data_hash, size, peers, folder, headers=None):
+        """
+        Download the blob to a temporary file and verify it.
+        Every part is requested from the peers in turn, starting from
+        different ones, until one of them returns it. A peer ignoring
+        the range returns the whole blob, which is taken at once and
+        the rest of the parts are cancelled.
+        :param data_hash: SHA-256 hash of the blob
+        :param size: blob size in bytes
+        :param peers: base URLs of the peers
+        :param folder: folder for the temporary file
+        :param headers: headers sent to the peers
+        :return: path of the verified temporary file or None
+        :rtype: str
+        """
+        if not peers:
+            return None
+
+        path = blobs.write_temp(folder, [])
+        parts = [(start, min(start + self.part_size, size))
+                 for start in range(0, size, self.part_size)]
+        pending = list(enumerate(parts))
+        failed = []
+
+        def work():
+            while True:
+                with self._lock:
+                    if not pending or failed:
+                        return
+                    index, part = pending.pop()
+                for shift in range(len(peers)):
+                    peer = peers[(index + shift) % len(peers)]
+                    try:
+                        whole = self._fetch_part(peer, data_hash, part, size,
+                                                 path, headers or {})
+                    except (IOError, OSError, ValueError):
+                        continue
+                    if whole:
+                        with self._lock:
+                            del pending[:]
+                    break
+                else:
+                    failed.append(part)
+
+        workers = [threading.Thread(target=work)
+                   for _ in range(min(self.max_workers, len(parts)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if failed or blobs.hash_chunks(blobs.iter_file(path)) != data_hash:
+            os.unlink(path)
+            return None
+
+        return path
+
+    def _fetch_part(self, peer, data_hash, part, size, path, headers):
+        """
+        Fetch one part of the blob and write it to its place in the file.
+        Peers ignoring the range return the whole blob, then all of it
+        is written.
+        :return: True if the whole blob is written
+        """
+        start, end = part
+        request_headers = dict(headers)
+        request_headers['Range'] = 'bytes={}-{}'.format(start, end - 1)
+        response = urlopen(
+            Request('{}/api/files/{}'.format(peer.rstrip('/'), data_hash),
+                    headers=request_headers),
+            timeout=self.timeout
+        )
+        try:
+            whole = response.getcode() != 206
+            if whole:
+                start, end = 0, size
+            else:
+                content_range = content_range_pattern.match(
+                    response.headers.get('Content-Range', '')
+                )
+                if not content_range or int(content_range.group(1)) != start:
+                    raise ValueError('Unexpected range from ' + peer)
+
+            with open(path, 'r+b') as fp:
+                fp.seek(start)
+                left = end - start
+                while left:
+                    chunk = response.read(min(blobs.CHUNK_SIZE, left))
+                    if not chunk:
+                        raise IOError('Incomplete part from ' + peer)
+                    fp.write(chunk)
+                    left -= len(chunk)
+        finally:
+            response.close()
+
+        return whole
+
+
+def read_peers(peers_file, extra_peers=()):
+    """
+    Get base URLs of the peers to recover from.
+    :param peers_file: file with peers, one per line; only URLs are used
+    :param extra_peers: configured base URLs
+    :return: list of base URLs
+    :rtype: list
+    """
+    peers = list(extra_peers)
+    try:
+        with open(peers_file) as fp:
+            peers.extend(_.strip() for _ in fp
+                         if _.strip().startswith(('http://', 'https://')))
+    except IOError:
+        pass
+    return peers
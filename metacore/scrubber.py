@@ -0,0 +1,243 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from metacore import blobs, chunkstore
+from metacore.database import integrity, iter_files
+
+
+__author__ = 'karatel'
+
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = 'ok'
+STATUS_CORRUPTED = 'corrupted'
+STATUS_MISSING = 'missing'
+# reported for the blobs whose check failed, they are checked next time
+FAILED = 'failed'
+
+_STOP = object()
+# seconds between the checks of a volume worker blocking the queue
+_PUT_TIMEOUT = 1.0
+
+
+class Throttle(object):
+    """
+    Pace reading so that the average rate stays below the limit.
+    """
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        """
+        :param rate: maximal rate in bytes per second, None means no limit
+        :param clock: time source
+        :param sleep: sleeping function
+        """
+        self.rate = rate
+        self._clock = clock
+        self._sleep = sleep
+        self._started = None
+        self._consumed = 0
+
+    def consume(self, volume):
+        """
+        Account read bytes and sleep if the rate is exceeded.
+        :param volume: amount of read bytes
+        :type volume: int
+        :return: None
+        :rtype: NoneType
+        """
+        if not self.rate:
+            return
+
+        now = self._clock()
+        if self._started is None:
+            self._started = now
+
+        self._consumed += volume
+        delay = self._consumed / float(self.rate) - (now - self._started)
+        if delay > 0:
+            self._sleep(delay)
+
+
+class Scrubber(object):
+    """
+    Re-hash stored blobs and quarantine the ones which don't match
+    their hashes.
+    """
+
+    def __init__(self, upload_folder, quarantine_folder, rate=None,
+                 chunk_size=blobs.CHUNK_SIZE, chunk_store=None):
+        """
+        :param upload_folder: folder with stored blobs
+        :param quarantine_folder: folder for broken blobs
+        :param rate: maximal read rate per volume in MB/s
+        :param chunk_size: size of the read chunks in bytes
+        :param chunk_store: ChunkStore of the blobs stored as chunks
+        """
+        self.upload_folder = upload_folder
+        self.quarantine_folder = quarantine_folder
+        self.rate = rate * 1024 * 1024 if rate else None
+        self.chunk_size = chunk_size
+        self.chunk_store = chunk_store
+
+        self._lock = threading.Lock()
+        self.report = {STATUS_OK: 0, STATUS_CORRUPTED: 0, STATUS_MISSING: 0,
+                       FAILED: 0}
+
+    def run(self):
+        """
+        Scrub all blobs registered in the `files` table.
+        Blobs are streamed from the cursor into one worker per volume,
+        so different disks are checked in parallel. Errors of a blob
+        check are counted as failed, and a dead worker is replaced.
+        :return: number of blobs for each status
+        :rtype: dict
+        """
+        volumes = {}
+        for row in iter_files():
+            if row.codec == chunkstore.CODEC:
+                path = self.chunk_store.folder
+            else:
+                path = blobs.blob_path(self.upload_folder, row.hash)
+            try:
+                device = os.stat(path).st_dev
+            except OSError:
+                self._record(row.hash, STATUS_MISSING)
+                continue
+
+            if device not in volumes:
+                volumes[device] = [queue.Queue(maxsize=64), None]
+            self._put(volumes[device], (row.hash, row.codec))
+
+        for volume in volumes.values():
+            self._put(volume, _STOP)
+        for tasks, worker in volumes.values():
+            worker.join()
+
+        return dict(self.report)
+
+    def _put(self, volume, task):
+        """
+        Queue the task of the volume, (re)starting its worker if it's dead.
+        :param volume: list of the tasks queue and the worker thread
+        :param task: task or _STOP
+        """
+        tasks = volume[0]
+        while True:
+            if volume[1] is None or not volume[1].is_alive():
+                if volume[1] is not None:
+                    logger.error('Scrubbing worker died, restarting it')
+                volume[1] = threading.Thread(target=self._work,
+                                             args=(tasks,))
+                volume[1].daemon = True
+                volume[1].start()
+            try:
+                tasks.put(task, timeout=_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+    def check(self, data_hash, codec=None, throttle=None):
+        """
+        Re-hash one blob and quarantine it on mismatch.
+        Chunked blobs are only marked, as their chunks may be shared.
+        :param data_hash: SHA-256 hash of the blob
+        :param codec: codec the blob is stored with
+        :param throttle: Throttle instance shared by the volume
+        :return: check status
+        :rtype: str
+        """
+        path = blobs.blob_path(self.upload_folder, data_hash)
+        throttle = throttle or Throttle(self.rate)
+        if codec == chunkstore.CODEC:
+            data = self._throttled(self.chunk_store.iter_blob(data_hash),
+                                   throttle)
+        else:
+            data = blobs.decompress(self._read(path, throttle), codec)
+
+        try:
+            actual_hash = blobs.hash_chunks(data)
+        except (IOError, OSError):
+            return self._record(data_hash, STATUS_MISSING)
+        except blobs.DecodingError:
+            actual_hash = None
+
+        if actual_hash != data_hash:
+            if codec != chunkstore.CODEC:
+                self._quarantine(path)
+            return self._record(data_hash, STATUS_CORRUPTED)
+
+        return self._record(data_hash, STATUS_OK)
+
+    def _work(self, tasks):
+        throttle = Throttle(self.rate)
+        for data_hash, codec in iter(tasks.get, _STOP):
+            try:
+                self.check(data_hash, codec, throttle)
+            except Exception:
+                # e.g. locked database or failed quarantine move
+                logger.exception('Blob %s is not checked', data_hash)
+                with self._lock:
+                    self.report[FAILED] += 1
+
+    def _read(self, path, throttle):
+        """
+        Stream the blob, keeping the read rate and dropping read pages
+        from the page cache, so the live traffic keeps its cached data.
+        """
+        with open(path, 'rb') as fp:
+            offset = 0
+            for chunk in iter(lambda: fp.read(self.chunk_size), b''):
+                throttle.consume(len(chunk))
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(fp.fileno(), offset, len(chunk),
+                                     os.POSIX_FADV_DONTNEED)
+                offset += len(chunk)
+                yield chunk
+
+    def _throttled(self, chunks, throttle):
+        for chunk in chunks:
+            throttle.consume(len(chunk))
+            yield chunk
+
+    def _quarantine(self, path):
+        try:
+            os.makedirs(self.quarantine_folder)
+        except OSError:
+            pass
+        shutil.move(path, os.path.join(self.quarantine_folder,
+                                       os.path.basename(path)))
+
+    def _record(self, data_hash, status):
+        integrity.insert().prefix_with('OR REPLACE').values(
+            file_hash=data_hash,
+            status=status
+        ).execute()
+        with self._lock:
+            self.report[status] += 1
+        return status
+
+
+def main():
+    from metacore.processor import app, chunk_store
+
+    if hasattr(os, 'nice'):
+        os.nice(10)
+
+    scrubber = Scrubber(app.config['UPLOAD_FOLDER'],
+                        app.config['QUARANTINE_FOLDER'],
+                        app.config['SCRUB_RATE'],
+                        chunk_store=chunk_store)
+    print(scrubber.run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from hashlib import sha256
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+__author__ = 'karatel'
+
+
+# key of the bucket name (0 for a free slot), time its tokens are paid off at
+_SLOT = struct.Struct('>Qd')
+
+
+class BucketTable(object):
+    """
+    Fixed-size hash table of the token buckets in a memory-mapped file.
+    Workers map the same file, so the buckets are shared without
+    a database write per accounted quantum. Updates are serialized by
+    a lock of the file between the processes and by a lock of the table
+    between the threads. A bucket paid off is full, so its slot may be
+    taken by another bucket.
+    """
+
+    def __init__(self, path=None, slots=4096, probes=32):
+        """
+        :param path: file of the table, None for a table of the process
+        :param slots: number of the buckets kept
+        :param probes: number of the slots a bucket may be put in
+        """
+        self.slots = slots
+        self.probes = min(probes, slots)
+        size = slots * _SLOT.size
+        self._fd = None
+        if path is None:
+            self._map = mmap.mmap(-1, size)
+        else:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def add(self, name, volume, rate, now):
+        """
+        Take the tokens from the bucket.
+        :param name: bucket name
+        :param volume: amount of bytes
+        :param rate: rate of the bucket in bytes per second
+        :param now: current UNIX time
+        :return: time the bucket is paid off at
+        :rtype: float
+        """
+        key = struct.unpack('>Q', sha256(name.encode()).digest()[:8])[0] | 1
+        with self._lock:
+            if fcntl is not None and self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                slot = self._find(key, now)
+                _, paid_until = _SLOT.unpack_from(self._map,
+                                                  slot * _SLOT.size)
+                paid_until = max(paid_until, now) + float(volume) / rate
+                _SLOT.pack_into(self._map, slot * _SLOT.size, key,
+                                paid_until)
+                return paid_until
+            finally:
+                if fcntl is not None and self._fd is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, key, now):
+        """
+        Find the slot of the bucket, or the slot to put it in:
+        a free one, a paid off one or the least indebted one.
+        """
+        start = key % self.slots
+        spare, spare_paid_until = None, None
+        for probe in range(self.probes):
+            slot = (start + probe) % self.slots
+            slot_key, paid_until = _SLOT.unpack_from(self._map,
+                                                     slot * _SLOT.size)
+            if slot_key == key:
+                return slot
+            if not slot_key:
+                if spare is None or spare_paid_until > now:
+                    spare = slot
+                break
+            if spare is None or paid_until < spare_paid_until:
+                spare, spare_paid_until = slot, paid_until
+        # the debt of an evicted bucket is forgotten
+        _SLOT.pack_into(self._map, spare * _SLOT.size, 0, 0)
+        return spare
+
+
+class BandwidthShaper(object):
+    """
+    Token buckets limiting the transfer rate.
+    Buckets are kept in the BucketTable file, so they are shared by all
+    the workers. Every bucket stores the time its consumed tokens are
+    paid off at; a transfer waits while it's later than the burst allows.
+    """
+
+    def __init__(self, path=None, burst=1.0, quantum=256 * 1024,
+                 clock=time.time, sleep=time.sleep):
+        """
+        :param path: file of the buckets, None for the buckets of
+            the process
+        :param burst: bucket size in seconds of the rate
+        :param quantum: amount of bytes accounted at once by the streams
+        :param clock: time source
+        :param sleep: sleeping function
+        """
+        self.burst = burst
+        self.quantum = quantum
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = BucketTable(path)
+
+    def consume(self, volume, rates):
+        """
+        Take the tokens from the buckets and wait until all of them
+        allow the transfer.
+        :param volume: amount of transferred bytes
+        :param rates: list of (bucket name, rate in bytes per second)
+        :return: waiting time in seconds
+        :rtype: float
+        """
+        if not (volume and rates):
+            return 0
+
+        now = self._clock()
+        delay = 0
+        for name, rate in rates:
+            paid_until = self._buckets.add(name, volume, rate, now)
+            delay = max(delay, paid_until - now - self.burst)
+
+        if delay > 0:
+            self._sleep(delay)
+            return delay
+        return 0
+
+    def iter_shaped(self, chunks, rates):
+        """
+        Pass the data chunks at the limited rate.
+        :param chunks: iterable of binary chunks
+        :param rates: list of (bucket name, rate in bytes per second)
+        :return: generator of binary chunks
+        """
+        pending = 0
+        for chunk in chunks:
+            yield chunk
+            pending += len(chunk)
+            if pending >= self.quantum:
+                self.consume(pending, rates)
+                pending = 0
+        self.consume(pending, rates)
+
+
+class ShapedStream(object):
+    """
+    Input stream read at the limited rate.
+    """
+
+    def __init__(self, stream, shaper, rates):
+        """
+        :param stream: wrapped file-like object
+        :param shaper: BandwidthShaper
+        :param rates: list of (bucket name, rate in bytes per second)
+        """
+        self._stream = stream
+        self._shaper = shaper
+        self._rates = rates
+        self._pending = 0
+
+    def read(self, *args):
+        return self._account(self._stream.read(*args))
+
+    def readline(self, *args):
+        return self._account(self._stream.readline(*args))
+
+    def _account(self, data):
+        self._pending += len(data)
+        if self._pending >= self._shaper.quantum or not data:
+            self._shaper.consume(self._pending, self._rates)
+            self._pending = 0
+        return data
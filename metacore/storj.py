@@ -1,17 +1,149 @@
+import binascii
 import json
 import re
 
 from flask import Response
-from flask import abort, jsonify, request, render_template
+from flask import abort, g, jsonify, request, render_template, send_file
+from werkzeug.wsgi import wrap_file
 
+from metacore.blobs import CHUNK_SIZE
 from metacore.error_codes import *
 from metacore.processor import app
-from metacore.processor import (audit_data, download, files_list,
-                                node_info, upload)
+from metacore.processor import (audit_data, cache_info, check_admin,
+                                check_download, commit_upload, count_input,
+                                count_output, count_output_file, files_exist,
+                                files_list, files_list_tag,
+                                finish_request_profile, flush_audits,
+                                memory_snapshot, merkle_audit, node_info,
+                                node_info_tag, open_upload, owner_files_list,
+                                owners_report,
+                                plan_profiling,
+                                profiling_dump_path, profiling_status,
+                                read_file, release_space, reserve_space,
+                                shape_input, start_request_profile,
+                                stop_memory_tracing, stop_profiling, upload,
+                                upload_part, upload_status)
+from metacore.processor import PUBLIC_ROLES
+from metacore.tracing import Trace, log_slow
 
 
 hash_pattern = re.compile(r'^[a-f\d]{64}$')
 
+# size of the packed binary SHA-256 digests
+DIGEST_SIZE = 32
+
+PUBLIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PRIVATE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+def _error_response(error_code):
+    """
+    Make a response for the failed transfer or audit.
+    :param error_code: error code
+    :return: Response
+    """
+    if error_code == ERR_BLACKLIST:
+        abort(404)
+
+    if error_code == ERR_TRANSFER['LOST_FILE']:
+        with open(app.config['PEERS_FILE']) as peers_file:
+            response = jsonify(peers=[_.strip() for _ in peers_file])
+            response.status_code = 404
+    else:
+        response = jsonify(error_code=error_code)
+        response.status_code = (404 if error_code == ERR_TRANSFER['NOT_FOUND']
+                                else 400)
+
+    return response
+
+
+@app.before_request
+def start_trace():
+    """
+    Start timing the request stages.
+    """
+    g.trace = Trace('{} {}'.format(request.method, request.path))
+
+
+@app.before_request
+def flush_due_audits():
+    """
+    Flush the overdue audits buffered by the worker.
+    """
+    flush_audits()
+
+
+@app.after_request
+def finish_trace(response):
+    """
+    Log the slow request when its response is closed,
+    so the time of sending the streamed data is counted too.
+    """
+    trace = getattr(g, 'trace', None)
+    if trace is not None:
+        status = response.status_code
+        response.call_on_close(lambda: log_slow(
+            trace, app.config['SLOW_REQUEST_THRESHOLD'], status=status
+        ))
+    return response
+
+
+def _request_route():
+    """
+    Get the URL rule of the request, its path if no rule is matched.
+    """
+    return request.url_rule.rule if request.url_rule else request.path
+
+
+def _admin_error_response():
+    """
+    Check the admin signature of the request.
+    The signed message is '<method> <path> <timestamp>'.
+    :return: error Response or None if the request is allowed
+    """
+    error_code = check_admin(
+        '{} {}'.format(request.method, request.path),
+        request.headers.get('timestamp'),
+        request.headers.get('sender_address'),
+        request.headers.get('signature')
+    )
+    if error_code:
+        return _error_response(error_code)
+
+
+@app.before_request
+def start_profile():
+    """
+    Profile the request if it's planned.
+    """
+    g.profile = start_request_profile(_request_route())
+
+
+@app.after_request
+def finish_profile(response):
+    """
+    Dump the request profile when its response is closed.
+    """
+    profile = getattr(g, 'profile', None)
+    if profile is not None:
+        g.profile = None
+        route = _request_route()
+        response.call_on_close(
+            lambda: finish_request_profile(profile, route)
+        )
+    return response
+
+
+@app.teardown_request
+def drop_profile(exception):
+    """
+    Dump the profile of the request failed without a response.
+    """
+    profile = getattr(g, 'profile', None)
+    if profile is not None:
+        g.profile = None
+        finish_request_profile(profile, _request_route())
+
 
 @app.route('/')
 def index():
@@ -38,24 +170,40 @@ def audit_file():
     )
 
     if isinstance(result, int):
-        if result == ERR_BLACKLIST:
-            abort(404)
+        return _error_response(result)
+
+    response = jsonify(
+        data_hash=data_hash,
+        challenge_seed=challenge_seed,
+        challenge_response=result
+    )
+    response.status_code = 201
+    return response
 
-        if result == ERR_TRANSFER['LOST_FILE']:
-            with open(app.config['PEERS_FILE']) as peers_file:
-                response = jsonify(peers=[_.strip() for _ in peers_file])
-                response.status_code = 404
-        else:
-            response = jsonify(error_code=result)
-            response.status_code = (404 if result == ERR_TRANSFER['NOT_FOUND']
-                                    else 400)
 
-        return response
+@app.route('/api/audit/merkle/', methods=['POST'])
+def audit_file_chunks():
+    """
+    Audit file chunks.
+    Return the chunks challenged by the seed with their Merkle proofs.
+    """
+    data_hash = request.form['data_hash']
+    challenge_seed = request.form['challenge_seed']
+
+    result = merkle_audit(
+        data_hash,
+        challenge_seed,
+        request.headers.get('sender_address'),
+        request.headers.get('signature')
+    )
+
+    if isinstance(result, int):
+        return _error_response(result)
 
     response = jsonify(
         data_hash=data_hash,
         challenge_seed=challenge_seed,
-        challenge_response=result
+        **result
     )
     response.status_code = 201
     return response
@@ -66,32 +214,62 @@ def download_file(data_hash):
     """
     Download stored file from the Node.
     Check if data_hash is valid SHA-256 hash matched with existing file.
+    Stored files never change, so the file hash is used as the entity tag
+    and matched tags are answered without reading the file.
+    A single byte range of a raw blob is answered with the part of it.
+    HEAD requests are answered from the file record alone,
+    with the same status and headers as the matching GET request.
     :param data_hash: SHA-256 hash for needed file.
     """
-    result = download(
+    decryption_key = request.values.get('decryption_key')
+    file = check_download(
         data_hash,
         request.headers.get('sender_address'),
-        request.headers.get('signature'),
-        request.values.get('decryption_key')
+        request.headers.get('signature')
     )
+    if isinstance(file, int):
+        return _error_response(file)
 
-    if isinstance(result, int):
-        if result == ERR_BLACKLIST:
-            abort(404)
+    validators = {}
+    if not decryption_key:
+        validators = {
+            'ETag': '"{}"'.format(data_hash),
+            'Cache-Control': (PUBLIC_CACHE_CONTROL
+                              if file.role in PUBLIC_ROLES
+                              else PRIVATE_CACHE_CONTROL)
+        }
+        if request.if_none_match.contains_weak(data_hash):
+            return Response(status=304, headers=validators)
+        if not file.codec:
+            validators['Accept-Ranges'] = 'bytes'
 
-        if result == ERR_TRANSFER['LOST_FILE']:
-            with open(app.config['PEERS_FILE']) as peers_file:
-                response = jsonify(peers=[_.strip() for _ in peers_file])
-                response.status_code = 404
-        else:
-            response = jsonify(error_code=result)
-            response.status_code = (404 if result == ERR_TRANSFER['NOT_FOUND']
-                                    else 400)
+    byte_range = None
+    if 'Accept-Ranges' in validators and request.range and \
+            len(request.range.ranges) == 1:
+        byte_range = request.range.range_for_length(file.size)
+        if byte_range is None:
+            return Response(status=416, headers={
+                'Content-Range': 'bytes */{}'.format(file.size)
+            })
 
+    if request.method == 'HEAD':
+        response = Response(status=200, headers=validators)
+        response.headers['X-File-Role'] = file.role
+        response.content_type = 'application/octet-stream'
+        response.content_length = file.size
+        _set_range(response, byte_range, file.size)
         return response
+
+    result = read_file(file, decryption_key,
+                       request.headers.get('sender_address'),
+                       request.headers.get('signature'),
+                       byte_range)
+    if isinstance(result, int):
+        return _error_response(result)
+
     downloaded_file_name = request.values.get('file_alias', data_hash)
     response = Response(
-        result,
+        None,
         200,
         {'X-Sendfile': downloaded_file_name,
          'Content-Type': 'application/octet-stream',
@@ -99,16 +277,117 @@ def download_file(data_hash):
              'inline; filename="{}"'.format(downloaded_file_name)
          }
     )
+    if hasattr(result, 'fileno'):
+        # the server's file wrapper may send the file with sendfile(2),
+        # Werkzeug's one reads it by chunks. The wrapper is passed to
+        # the server as it is, so the response is closed with the file.
+        body = count_output_file(result, response.close,
+                                 'wsgi.file_wrapper' in request.environ)
+        response.response = wrap_file(request.environ, body, CHUNK_SIZE)
+        response.direct_passthrough = True
+        response.content_length = body.size
+    else:
+        response.response = count_output(result)
+    _set_range(response, byte_range, file.size)
+    response.headers.extend(validators)
     return response
 
 
+def _set_range(response, byte_range, size):
+    """
+    Turn the file response into the partial one of the byte range.
+    :param response: response with the whole file
+    :param byte_range: (start, stop) of the sent part or None
+    :param size: size of the whole file
+    """
+    if byte_range:
+        response.status_code = 206
+        response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+            byte_range[0], byte_range[1] - 1, size
+        )
+        response.content_length = byte_range[1] - byte_range[0]
+
+
 @app.route('/api/files/', methods=['GET'])
 def files_info():
     """
     Get files hash list.
+    With the `owner` parameter the owner's files are listed by pages.
     """
-    hash_list = files_list()
-    return json.dumps(hash_list), 200, {'Content-Type': 'application/json'}
+    owner = request.args.get('owner')
+    if owner is not None:
+        return _owner_files_info(owner)
+
+    etag = files_list_tag()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        hash_list = files_list()
+        response = Response(json.dumps(hash_list), 200,
+                            {'Content-Type': 'application/json'})
+
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _owner_files_info(owner):
+    """
+    Get the page of the owner's files hashes.
+    :param owner: owner's BitCoin address
+    """
+    result = owner_files_list(
+        owner,
+        request.headers.get('sender_address'),
+        request.headers.get('signature'),
+        request.args.get('after'),
+        request.args.get('limit', type=int)
+    )
+    if isinstance(result, int):
+        return _error_response(result)
+
+    response = jsonify(**result)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/files/exists', methods=['POST'])
+def files_existence():
+    """
+    Check which of the given files are stored.
+    Hashes are sent as a JSON list, answered with the list of the stored
+    ones, or as packed binary digests, answered with a bitmap where
+    the most significant bit of the first byte is the first digest.
+    """
+    binary = request.mimetype == 'application/octet-stream'
+    if binary:
+        data = request.get_data()
+        if len(data) % DIGEST_SIZE:
+            return _error_response(ERR_TRANSFER['INVALID_HASH'])
+        data = binascii.hexlify(data).decode()
+        hashes = [data[_:_ + 2 * DIGEST_SIZE]
+                  for _ in range(0, len(data), 2 * DIGEST_SIZE)]
+    else:
+        hashes = request.get_json(force=True, silent=True)
+        if isinstance(hashes, dict):
+            hashes = hashes.get('hashes')
+        if not isinstance(hashes, list):
+            return _error_response(ERR_TRANSFER['INVALID_HASH'])
+
+    result = files_exist(hashes)
+    if isinstance(result, int):
+        return _error_response(result)
+
+    if not binary:
+        return jsonify(hashes=[data_hash for data_hash, flag
+                               in zip(hashes, result) if flag])
+
+    bitmap = bytearray((len(result) + 7) // 8)
+    for position, flag in enumerate(result):
+        if flag:
+            bitmap[position >> 3] |= 0x80 >> (position & 7)
+    return Response(bytes(bitmap), 200,
+                    {'Content-Type': 'application/octet-stream'})
 
 
 @app.route('/api/nodes/me/', methods=['GET'])
@@ -116,40 +395,273 @@ def status_info():
     """
     Get the Node status info.
     """
-    return jsonify(node_info())
+    etag = node_info_tag()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(node_info())
+
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/nodes/me/cache/', methods=['GET'])
+def cache_status_info():
+    """
+    Get the blob cache usage metrics.
+    """
+    return jsonify(cache_info())
 
 
 @app.route('/api/files/', methods=['POST'])
 def upload_file():
     """
     Upload file to the Node.
+    The space is reserved before the data is received,
+    the data is read at the limited rate and counted as incoming traffic.
+    The signed data hash comes with the data, so the sender can't be
+    checked before and the data is read at the anonymous sender rate.
+    """
+    reservation = reserve_space(request.content_length)
+    if reservation is None:
+        response = jsonify(error_code=ERR_TRANSFER['FULL_DISK'])
+        response.status_code = 400
+        return response
+
+    stream = count_input(shape_input(request.environ['wsgi.input'], None))
+    request.environ['wsgi.input'] = stream
+
+    try:
+        file_role = request.form['file_role']
+        data_hash = request.form['data_hash']
+
+        result = upload(
+            request.files['file_data'].stream,
+            data_hash,
+            file_role,
+            request.headers.get('sender_address'),
+            request.headers.get('signature')
+        )
+    finally:
+        stream.close()
+        release_space(reservation)
+
+    if not isinstance(result, dict):
+        if result == ERR_BLACKLIST:
+            abort(404)
+
+        response = jsonify(error_code=result)
+        response.status_code = 400
+        return response
+
+    response = jsonify(data_hash=data_hash, **result)
+    response.status_code = 201
+    return response
+
+
+@app.route('/api/uploads/', methods=['POST'])
+def open_upload_session():
+    """
+    Start the resumable upload of the file sent by parts.
     """
-    file_role = request.form['file_role']
     data_hash = request.form['data_hash']
+    try:
+        file_size = int(request.form['file_size'])
+    except ValueError:
+        abort(400)
 
-    error_code = upload(
-        request.files['file_data'].stream,
+    result = open_upload(
         data_hash,
-        file_role,
+        file_size,
+        request.form['file_role'],
         request.headers.get('sender_address'),
         request.headers.get('signature')
     )
-    if error_code:
-        if error_code == ERR_BLACKLIST:
-            abort(404)
-        
-        if isinstance(error_code, dict):
-            response = jsonify(data_hash=data_hash,
-                               file_role=error_code['file_role'])
-            response.status_code = 201
-        else:
-            response = jsonify(error_code=error_code)
-            response.status_code = 400
-        return response
-    else:
-        response = jsonify(data_hash=data_hash, file_role=file_role)
-        response.status_code = 201
-        return response
+
+    if isinstance(result, int):
+        return _error_response(result)
+
+    if 'session_id' not in result:
+        result['data_hash'] = data_hash
+    response = jsonify(**result)
+    response.status_code = 201
+    return response
+
+
+@app.route('/api/uploads/<session_id>', methods=['GET'])
+def get_upload_session(session_id):
+    """
+    Get the resumable upload state with the received parts.
+    """
+    result = upload_status(
+        session_id,
+        request.headers.get('sender_address'),
+        request.headers.get('signature')
+    )
+
+    if isinstance(result, int):
+        return _error_response(result)
+
+    return jsonify(**result)
+
+
+@app.route('/api/uploads/<session_id>/<int:part_number>', methods=['PUT'])
+def upload_session_part(session_id, part_number):
+    """
+    Upload the numbered part of the file as the request body.
+    """
+    stream = count_input(request.environ['wsgi.input'])
+    request.environ['wsgi.input'] = stream
+    try:
+        result = upload_part(
+            session_id,
+            part_number,
+            request.stream,
+            request.headers.get('sender_address'),
+            request.headers.get('signature')
+        )
+    finally:
+        stream.close()
+
+    if isinstance(result, int):
+        return _error_response(result)
+
+    return jsonify(**result)
+
+
+@app.route('/api/uploads/<session_id>/commit', methods=['POST'])
+def commit_upload_session(session_id):
+    """
+    Finish the resumable upload and save the file.
+    """
+    result = commit_upload(
+        session_id,
+        request.headers.get('sender_address'),
+        request.headers.get('signature')
+    )
+
+    if isinstance(result, int):
+        return _error_response(result)
+
+    response = jsonify(**result)
+    response.status_code = 201
+    return response
+
+
+@app.route('/api/admin/profile/', methods=['POST'])
+def plan_profile():
+    """
+    Profile the next requests to the route, or a fraction of them.
+    """
+    error_response = _admin_error_response()
+    if error_response:
+        return error_response
+
+    result = plan_profiling(request.form.get('route') or None,
+                            request.form.get('requests', type=int),
+                            request.form.get('fraction', type=float))
+    if isinstance(result, int):
+        return _error_response(result)
+
+    response = jsonify(**result)
+    response.status_code = 201
+    return response
+
+
+@app.route('/api/admin/profile/', methods=['GET'])
+def profile_status():
+    """
+    Get the profiling plan and the dumps names.
+    """
+    error_response = _admin_error_response()
+    if error_response:
+        return error_response
+
+    return jsonify(**profiling_status())
+
+
+@app.route('/api/admin/profile/', methods=['DELETE'])
+def cancel_profile():
+    """
+    Cancel the planned profiling.
+    """
+    error_response = _admin_error_response()
+    if error_response:
+        return error_response
+
+    return jsonify(**stop_profiling())
+
+
+@app.route('/api/admin/profile/<name>', methods=['GET'])
+def download_profile(name):
+    """
+    Download the cProfile dump or the tracemalloc snapshot.
+    """
+    error_response = _admin_error_response()
+    if error_response:
+        return error_response
+
+    result = profiling_dump_path(name)
+    if isinstance(result, int):
+        return _error_response(result)
+
+    return send_file(result, mimetype='application/octet-stream',
+                     as_attachment=True)
+
+
+@app.route('/api/admin/owners/', methods=['GET'])
+def owners_info():
+    """
+    Get the stored files and the audits of every owner for billing.
+    """
+    error_response = _admin_error_response()
+    if error_response:
+        return error_response
+
+    period = {'hour': 60 * 60, 'day': 24 * 60 * 60}.get(
+        request.args.get('period', 'day')
+    )
+    result = owners_report(period, request.args.get('since', type=int))
+    if isinstance(result, int):
+        return _error_response(result)
+
+    return jsonify(**result)
+
+
+@app.route('/api/admin/memory/', methods=['POST'])
+def take_memory_snapshot():
+    """
+    Take the tracemalloc snapshot and compare it with the previous one.
+    """
+    error_response = _admin_error_response()
+    if error_response:
+        return error_response
+
+    try:
+        limit = int(request.form.get('limit', 10))
+    except ValueError:
+        abort(400)
+
+    result = memory_snapshot(limit)
+    if isinstance(result, int):
+        return _error_response(result)
+
+    response = jsonify(**result)
+    response.status_code = 201
+    return response
+
+
+@app.route('/api/admin/memory/', methods=['DELETE'])
+def stop_memory_snapshots():
+    """
+    Stop tracing the allocations.
+    """
+    error_response = _admin_error_response()
+    if error_response:
+        return error_response
+
+    return jsonify(**stop_memory_tracing())
 
 
 def main():
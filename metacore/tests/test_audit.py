@@ -5,7 +5,7 @@ import os
 import unittest
 from hashlib import sha256
 
-from metacore import storj
+from metacore import processor, storj
 from metacore.database import audit, files
 from metacore.error_codes import *
 from metacore.tests import *
@@ -62,6 +62,7 @@ class AuditFileCase(unittest.TestCase):
             owner=self.owner
         ).execute().inserted_primary_key
 
+        processor.audit_log.flush()
         audit.delete().execute()
 
         self.challenge_seed = sha256(b'seed').hexdigest()
@@ -83,8 +84,12 @@ class AuditFileCase(unittest.TestCase):
         self.other_signature = test_btctx_api.sign_unicode(test_other_wfi,
                                                            self.data_hash)
 
-        self.patcher = patch('metacore.processor.BTCTX_API', test_btctx_api)
-        self.patcher.start()
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.processor.file_index.refresh_interval', 0)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
 
     def tearDown(self):
         """
@@ -93,7 +98,8 @@ class AuditFileCase(unittest.TestCase):
         Remove initial records form the 'files' table.
         Return initial blacklist content.
         """
-        self.patcher.stop()
+        for patcher in self.patchers:
+            patcher.stop()
 
         try:
             os.unlink(self.file_saving_path)
@@ -101,6 +107,7 @@ class AuditFileCase(unittest.TestCase):
             pass
 
         files.delete().where(files.c.hash.in_(self.files_id)).execute()
+        processor.audit_log.flush()
         audit.delete().execute()
 
         with open(self.app.config['BLACKLIST_FILE'], 'w') as fp:
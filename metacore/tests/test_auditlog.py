@@ -0,0 +1,130 @@
+import sys
+import unittest
+from datetime import datetime, timedelta
+from hashlib import sha256
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.expression import Select
+
+from metacore.auditlog import AuditLog
+from metacore.database import audit, files
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class AuditLogCase(unittest.TestCase):
+    """
+    Test the write-behind audits log.
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        self.data_hash = sha256(b'audit log').hexdigest()
+        self.since = datetime.now() - timedelta(hours=1)
+        files.insert().values(hash=self.data_hash, role='001', size=10,
+                              owner=test_owner_address).execute()
+        self.audit_log = AuditLog(batch_size=3, flush_interval=60,
+                                  clock=lambda: self.now)
+
+    def tearDown(self):
+        self.audit_log.flush()
+        audit.delete().execute()
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    def stored(self):
+        return audit.select().count().scalar()
+
+    def test_batches(self):
+        """
+        Insert the audits when the batch is full.
+        """
+        self.audit_log.add(self.data_hash, False, 'full')
+        self.audit_log.add(self.data_hash, True, 'full')
+        self.assertEqual(0, self.stored())
+        self.assertEqual(2, len(self.audit_log))
+
+        self.audit_log.add(self.data_hash, False, 'merkle')
+        self.assertEqual(3, self.stored())
+        self.assertEqual(0, len(self.audit_log))
+
+    def test_flush_interval(self):
+        """
+        Insert the audits buffered for the interval.
+        """
+        self.audit_log.add(self.data_hash, False, 'full')
+        self.now += 60
+        self.audit_log.add(self.data_hash, False, 'full')
+
+        self.assertEqual(2, self.stored())
+
+    def test_flush_due(self):
+        """
+        Flush the audits waiting too long without the timer.
+        """
+        self.audit_log.add(self.data_hash, False, 'full')
+        self.assertEqual(0, self.audit_log.flush_due())
+
+        self.now += 60
+        self.assertEqual(1, self.audit_log.flush_due())
+        self.assertEqual(1, self.stored())
+
+    def test_count_during_flush(self):
+        """
+        Count the audits flushed during the count once.
+        """
+        self.audit_log.add(self.data_hash, False, 'full')
+        scalar = Select.scalar
+
+        def flushing_scalar(query):
+            # the buffer is flushed by another thread during the query
+            if len(self.audit_log):
+                self.audit_log.flush()
+            return scalar(query)
+
+        with patch.object(Select, 'scalar', flushing_scalar):
+            self.assertEqual(1, self.audit_log.count(
+                self.data_hash, False, 'full', self.since
+            ))
+
+    def test_counts(self):
+        """
+        Count both the stored and the buffered audits.
+        """
+        for is_owner in (False, False, False, False, True):
+            self.audit_log.add(self.data_hash, is_owner, 'full')
+
+        self.assertEqual(3, self.stored())
+        self.assertEqual(
+            4, self.audit_log.count(self.data_hash, False, 'full', self.since)
+        )
+        self.assertEqual(
+            1, self.audit_log.count(self.data_hash, True, 'full', self.since)
+        )
+        self.assertEqual(
+            0, self.audit_log.count(self.data_hash, False, 'merkle',
+                                    self.since)
+        )
+
+    def test_busy_database(self):
+        """
+        Keep the audits buffered if they can't be inserted.
+        """
+        self.audit_log.add(self.data_hash, False, 'full')
+        with patch('metacore.auditlog.engine.begin',
+                   side_effect=OperationalError('INSERT', {}, None)):
+            self.assertEqual(0, self.audit_log.flush())
+        self.assertEqual(1, len(self.audit_log))
+
+        self.assertEqual(1, self.audit_log.flush())
+        self.assertEqual(1, self.stored())
+
+
+if __name__ == '__main__':
+    unittest.main()
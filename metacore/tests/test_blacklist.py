@@ -0,0 +1,105 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+
+from metacore.blacklist import Blacklist
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class BlacklistCase(unittest.TestCase):
+    """
+    Test the compiled Blacklist.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.folder, 'Blacklist.txt')
+        self.compiled_path = os.path.join(self.folder, 'Blacklist.bin')
+        self.hashes = [sha256(str(_).encode()).hexdigest()
+                       for _ in range(5000)]
+        self.write(self.hashes[:1000], 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, hashes, mode='a'):
+        with open(self.source_path, mode) as fp:
+            fp.writelines(_ + '\n' for _ in hashes)
+
+    def make_blacklist(self, tail_limit=100):
+        return Blacklist(self.source_path, self.compiled_path, tail_limit)
+
+    def test_lookups(self):
+        """
+        Find the listed hashes only.
+        """
+        blacklist = self.make_blacklist()
+
+        self.assertTrue(all(_ in blacklist for _ in self.hashes[:1000]))
+        self.assertFalse(any(_ in blacklist for _ in self.hashes[1000:]))
+        self.assertNotIn('not a hash', blacklist)
+        self.assertNotIn(self.hashes[0][:-2], blacklist)
+        self.assertEqual(1000, len(blacklist))
+
+    def test_shared_compiled_file(self):
+        """
+        Use the file compiled by another worker.
+        """
+        self.assertIn(self.hashes[0], self.make_blacklist())
+
+        blacklist = self.make_blacklist()
+        with patch.object(blacklist, 'compile') as mock_compile:
+            self.assertIn(self.hashes[999], blacklist)
+        self.assertFalse(mock_compile.called)
+
+    def test_appended_hashes(self):
+        """
+        Keep the appended hashes without compiling until the limit.
+        """
+        blacklist = self.make_blacklist()
+        self.assertNotIn(self.hashes[1000], blacklist)
+
+        self.write(self.hashes[1000:1050])
+        with patch.object(blacklist, 'compile') as mock_compile:
+            self.assertIn(self.hashes[1000], blacklist)
+            self.assertIn(self.hashes[0], blacklist)
+        self.assertFalse(mock_compile.called)
+
+        self.write(self.hashes[1050:1200])
+        self.assertIn(self.hashes[1199], blacklist)
+        self.assertEqual(1200, self.make_blacklist().compile())
+
+    def test_rewritten_file(self):
+        """
+        Compile the rewritten file again.
+        """
+        blacklist = self.make_blacklist()
+        self.assertIn(self.hashes[0], blacklist)
+
+        self.write(self.hashes[1:1000] + self.hashes[2000:2001], 'w')
+
+        self.assertNotIn(self.hashes[0], blacklist)
+        self.assertIn(self.hashes[2000], blacklist)
+        self.assertEqual(1000, len(blacklist))
+
+    def test_missing_file(self):
+        """
+        Block nothing without the text file.
+        """
+        os.unlink(self.source_path)
+
+        self.assertNotIn(self.hashes[0], self.make_blacklist())
+
+
+if __name__ == '__main__':
+    unittest.main()
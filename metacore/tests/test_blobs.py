@@ -0,0 +1,262 @@
+import sys
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from hashlib import sha256
+from io import BytesIO
+
+from metacore import blobs, processor, storj
+from metacore.database import audit, files
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class SaveBlobCase(unittest.TestCase):
+    """
+    Test saving and reading the stored blobs.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.text = b'{"key": "value"}\n' * 1000
+        self.text_hash = sha256(self.text).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _read(self, data_hash, codec):
+        return b''.join(blobs.iter_blob(
+            blobs.blob_path(self.folder, data_hash), codec, 1024
+        ))
+
+    def test_save_raw(self):
+        """
+        Save the data as it is without codecs.
+        """
+        codec, stored_size = blobs.save_blob(self.folder, self.text_hash,
+                                             [self.text[:10], self.text[10:]])
+
+        self.assertIsNone(codec)
+        self.assertEqual(len(self.text), stored_size)
+        self.assertEqual(self.text, self._read(self.text_hash, codec))
+        self.assertEqual([self.text_hash], os.listdir(self.folder))
+
+    def test_save_compressed(self):
+        """
+        Compress well compressible data.
+        """
+        for codec_name in blobs.COMPRESSORS:
+            codec, stored_size = blobs.save_blob(
+                self.folder, self.text_hash, [self.text], [codec_name]
+            )
+
+            self.assertEqual(codec_name, codec)
+            self.assertLess(stored_size, len(self.text) / 3)
+            self.assertEqual(self.text, self._read(self.text_hash, codec))
+            self.assertEqual([self.text_hash], os.listdir(self.folder))
+
+    def test_keep_incompressible_raw(self):
+        """
+        Keep random data raw.
+        """
+        data = os.urandom(100000)
+        data_hash = sha256(data).hexdigest()
+        codec, stored_size = blobs.save_blob(self.folder, data_hash, [data],
+                                             list(blobs.COMPRESSORS))
+
+        self.assertIsNone(codec)
+        self.assertEqual(len(data), stored_size)
+        self.assertEqual([data_hash], os.listdir(self.folder))
+
+    def test_bounded_decompression(self):
+        """
+        Don't decompress more than the chunk size at once.
+        """
+        chunks = list(blobs.decompress([zlib.compress(b'\0' * 100000)],
+                                       'zlib', 1024))
+
+        self.assertEqual(b'\0' * 100000, b''.join(chunks))
+        self.assertLessEqual(max(len(_) for _ in chunks), 1024)
+
+    def test_corrupted_data(self):
+        """
+        Raise DecodingError for broken compressed data.
+        """
+        with self.assertRaises(blobs.DecodingError):
+            list(blobs.decompress([zlib.compress(self.text)[:-20]], 'zlib'))
+
+        with self.assertRaises(blobs.DecodingError):
+            list(blobs.decompress([b'not compressed'], 'zlib'))
+
+
+class DurabilityCase(unittest.TestCase):
+    """
+    Test syncing the committed files.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def commit(self, name, durability):
+        path = os.path.join(self.folder, name)
+        blobs.commit(blobs.write_temp(self.folder, [name.encode()]), path,
+                     durability)
+        with open(path, 'rb') as fp:
+            self.assertEqual(name.encode(), fp.read())
+
+    def test_levels(self):
+        """
+        Sync the data and the folder as the level requires.
+        """
+        expected = {
+            'none': [],
+            'fdatasync': ['file'],
+            'fdatasync+dirsync': ['file', 'folder'],
+            'group': ['file', 'folder']
+        }
+        for durability in blobs.DURABILITY_LEVELS:
+            with patch('metacore.blobs.sync_file',
+                       wraps=blobs.sync_file) as mock_sync:
+                self.commit(durability, durability)
+            self.assertEqual(
+                expected[durability],
+                ['folder' if os.path.isdir(_[0][0]) else 'file'
+                 for _ in mock_sync.call_args_list]
+            )
+
+        with self.assertRaises(ValueError):
+            self.commit('unknown', 'fsync')
+
+    def test_group_commit(self):
+        """
+        Sync the folder once for the files committed meanwhile,
+        while every caller syncs its own file.
+        """
+        group_commit = blobs.GroupCommit()
+        paths = [blobs.write_temp(self.folder, [str(_).encode()])
+                 for _ in range(3)]
+        batch = [(_, os.path.join(self.folder, str(i)), [False, None])
+                 for i, _ in enumerate(paths)]
+        batch.append((os.path.join(self.folder, 'missing'),
+                      os.path.join(self.folder, 'lost'), [False, None]))
+
+        with patch('metacore.blobs.sync_file',
+                   wraps=blobs.sync_file) as mock_sync:
+            group_commit._commit_batch(batch)
+        self.assertEqual(
+            [self.folder],
+            [os.path.abspath(_[0][0]) for _ in mock_sync.call_args_list]
+        )
+        self.assertEqual([None] * 3, [_[2][1] for _ in batch[:3]])
+        self.assertIsInstance(batch[3][2][1], OSError)
+        self.assertEqual(['0', '1', '2'], sorted(os.listdir(self.folder)))
+
+        path = os.path.join(self.folder, 'single')
+        temp_path = blobs.write_temp(self.folder, [b''])
+        synced = []
+
+        def commit_batch(batch):
+            synced.extend(_[0][0] for _ in mock_sync.call_args_list)
+            blobs.GroupCommit._commit_batch(batch)
+
+        with patch('metacore.blobs.sync_file',
+                   wraps=blobs.sync_file) as mock_sync, \
+                patch.object(group_commit, '_commit_batch', commit_batch):
+            group_commit.commit(temp_path, path)
+        self.assertEqual([temp_path], synced)
+        self.assertTrue(os.path.exists(path))
+
+
+class CompressedTransferCase(unittest.TestCase):
+    """
+    Test uploading, downloading and auditing compressed files.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = b'plain text line\n' * 1000
+        self.data_hash = sha256(self.file_data).hexdigest()
+        self.headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     self.data_hash)
+        }
+
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch.dict(self.app.config, {'COMPRESSION_CODECS': ['zlib']})
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        try:
+            os.unlink(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                      self.data_hash))
+        except OSError:
+            pass
+
+        processor.audit_log.flush()
+        audit.delete().where(audit.c.file_hash == self.data_hash).execute()
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    def test_transparent_compression(self):
+        """
+        Store plaintext compressed and serve it unchanged.
+        """
+        with self.app.test_client() as c:
+            response = c.post('/api/files/', data={
+                'data_hash': self.data_hash,
+                'file_data': (BytesIO(self.file_data), 'test_file'),
+                'file_role': '000'
+            }, headers=self.headers)
+            self.assertEqual(201, response.status_code)
+
+            record = files.select(
+                files.c.hash == self.data_hash
+            ).execute().first()
+            self.assertEqual('zlib', record.codec)
+            self.assertEqual(len(self.file_data), record.size)
+            self.assertEqual(
+                os.path.getsize(blobs.blob_path(
+                    self.app.config['UPLOAD_FOLDER'], self.data_hash
+                )),
+                record.stored_size
+            )
+
+            response = c.get('/api/files/' + self.data_hash,
+                             headers=self.headers)
+            self.assertEqual(self.file_data, response.data)
+
+            seed = sha256(b'seed').hexdigest()
+            response = c.post('/api/audit/', data={
+                'data_hash': self.data_hash,
+                'challenge_seed': seed
+            }, headers=self.headers)
+
+        self.assertEqual(
+            sha256(self.file_data + seed.encode()).hexdigest(),
+            json.loads(response.data.decode())['challenge_response']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import sys
+import json
+import os.path
+import unittest
+from hashlib import sha256
+
+from metacore import storj
+from metacore.cache import BlobCache
+from metacore.database import files
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class BlobCacheCase(unittest.TestCase):
+    """
+    Test the in-memory blob cache.
+    """
+
+    def setUp(self):
+        self.cache = BlobCache(10, 6, min_hits=2)
+
+    def test_admission_by_frequency(self):
+        """
+        Cache the blob only after repeated requests.
+        """
+        self.cache.get('a')
+        self.cache.put('a', b'1234')
+        self.assertIsNone(self.cache.get('a'))
+
+        self.cache.put('a', b'1234')
+        self.assertEqual(b'1234', self.cache.get('a'))
+
+    def test_entry_size_limit(self):
+        """
+        Don't cache blobs bigger than the entry size limit.
+        """
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.put('a', b'1234567')
+
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_lru_eviction(self):
+        """
+        Evict least recently used blobs to fit the capacity.
+        """
+        for key in ('a', 'b', 'c'):
+            self.cache.get(key)
+            self.cache.get(key)
+        self.cache.put('a', b'1234')
+        self.cache.put('b', b'1234')
+        self.cache.get('a')
+        self.cache.put('c', b'1234')
+
+        self.assertEqual(8, self.cache.size)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(b'1234', self.cache.get('a'))
+        self.assertEqual(b'1234', self.cache.get('c'))
+
+    def test_stats(self):
+        """
+        Count hits and misses.
+        """
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.put('a', b'1234')
+        self.cache.get('a')
+
+        stats = self.cache.stats
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+        self.assertAlmostEqual(1 / 3.0, stats['hit_rate'])
+        self.assertEqual(1, stats['entries'])
+
+
+class DownloadCachedFileCase(unittest.TestCase):
+    """
+    Test serving downloads from the blob cache.
+    """
+
+    def setUp(self):
+        """
+        Create a public file and enable the cache.
+        """
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = b'popular file data'
+        self.data_hash = sha256(self.file_data).hexdigest()
+        self.file_path = os.path.join(self.app.config['UPLOAD_FOLDER'],
+                                      self.data_hash)
+        with open(self.file_path, 'wb') as fp:
+            fp.write(self.file_data)
+
+        files.insert().values(
+            hash=self.data_hash, role='001', size=len(self.file_data),
+            owner=test_owner_address
+        ).execute()
+
+        self.patchers = [
+            patch('metacore.processor.blob_cache', BlobCache(1024, 1024)),
+            patch('metacore.processor.file_index.refresh_interval', 0)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        """
+        Remove the file and its record.
+        """
+        for patcher in self.patchers:
+            patcher.stop()
+
+        try:
+            os.unlink(self.file_path)
+        except OSError:
+            pass
+
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    def test_serve_from_cache(self):
+        """
+        Serve the popular blob from memory.
+        """
+        with self.app.test_client() as c:
+            for i in range(2):
+                c.get('/api/files/' + self.data_hash)
+            os.unlink(self.file_path)
+            response = c.get('/api/files/' + self.data_hash)
+            stats = json.loads(c.get('/api/nodes/me/cache/').data.decode())
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.file_data, response.data)
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(len(self.file_data), stats['size'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import sys
+import tempfile
+import unittest
+from hashlib import sha256
+
+from metacore.capacity import CapacityLedger
+from metacore.database import USED_SPACE_COUNTER, chunks, files
+from metacore.database import get_counter, reservations
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch, Mock
+else:
+    from mock import patch, Mock
+
+
+__author__ = 'karatel'
+
+
+class CapacityLedgerCase(unittest.TestCase):
+    """
+    Test reservation of the storage space.
+    """
+
+    def setUp(self):
+        """
+        Remember used space and create the ledger with large free space.
+        """
+        self.folder = tempfile.gettempdir()
+        self.used = get_counter(USED_SPACE_COUNTER)
+        self.capacity = self.used + 1000
+
+        self.now = 0
+        self.ledger = CapacityLedger(statvfs_ttl=5, clock=lambda: self.now)
+        self.ledger._free_space[self.folder] = (self.now, 10 ** 12)
+
+        self.data_hash = sha256(b'used').hexdigest()
+
+    def tearDown(self):
+        """
+        Remove created reservations and records.
+        """
+        reservations.delete().execute()
+        files.delete().where(files.c.hash == self.data_hash).execute()
+        chunks.delete().where(chunks.c.hash == self.data_hash).execute()
+
+    def test_reserve_within_capacity(self):
+        """
+        Reserve the space while it fits the capacity.
+        """
+        self.assertIsNotNone(self.ledger.reserve(600, self.capacity,
+                                                 self.folder))
+        self.assertIsNone(self.ledger.reserve(600, self.capacity,
+                                              self.folder))
+        self.assertIsNotNone(self.ledger.reserve(400, self.capacity,
+                                                 self.folder))
+
+    def test_non_positive_size(self):
+        """
+        Refuse to reserve nothing or a negative size.
+        """
+        for size in (0, -10 ** 15):
+            self.assertRaises(ValueError, self.ledger.reserve, size,
+                              self.capacity, self.folder)
+        self.assertEqual(0, reservations.select().count().scalar())
+
+    def test_release(self):
+        """
+        Make the released space available again.
+        """
+        reservation = self.ledger.reserve(1000, self.capacity, self.folder)
+        self.ledger.release(reservation)
+
+        self.assertIsNotNone(self.ledger.reserve(1000, self.capacity,
+                                                 self.folder))
+
+    def test_count_used_space(self):
+        """
+        Count the stored files as the used space.
+        """
+        files.insert().values(hash=self.data_hash, role='000', size=500,
+                              owner=test_owner_address).execute()
+
+        self.assertIsNone(self.ledger.reserve(600, self.capacity,
+                                              self.folder))
+
+    def test_used_space_counter(self):
+        """
+        Follow the physical size of the files and the chunks.
+        """
+        files.insert().values(hash=self.data_hash, role='000', size=500,
+                              owner=test_owner_address).execute()
+        self.assertEqual(self.used + 500, get_counter(USED_SPACE_COUNTER))
+
+        files.update().where(files.c.hash == self.data_hash).values(
+            codec='zlib', stored_size=200
+        ).execute()
+        chunks.insert().values(hash=self.data_hash, size=50,
+                               refs=1).execute()
+        self.assertEqual(self.used + 250, get_counter(USED_SPACE_COUNTER))
+
+        files.delete().where(files.c.hash == self.data_hash).execute()
+        chunks.delete().where(chunks.c.hash == self.data_hash).execute()
+        self.assertEqual(self.used, get_counter(USED_SPACE_COUNTER))
+
+    def test_free_space_limit(self):
+        """
+        Don't reserve more than the volume free space.
+        """
+        self.ledger._free_space[self.folder] = (self.now, 500)
+
+        self.assertIsNone(self.ledger.reserve(600, self.capacity,
+                                              self.folder))
+
+    def test_free_space_cache(self):
+        """
+        Call statvfs only when the cached value is expired.
+        """
+        stat = Mock(f_bavail=10, f_frsize=4096)
+        with patch('os.statvfs', return_value=stat) as mock_statvfs:
+            self.assertEqual(10 ** 12, self.ledger.free_space(self.folder))
+            self.now = 10
+            self.assertEqual(40960, self.ledger.free_space(self.folder))
+            self.assertEqual(40960, self.ledger.free_space(self.folder))
+
+        mock_statvfs.assert_called_once_with(self.folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import sys
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+from io import BytesIO
+
+from metacore import processor, storj
+from metacore.chunkstore import Chunker, ChunkStore
+from metacore.database import audit, blob_chunks, chunks, files
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+def _random_data(size, seed):
+    generator = random.Random(seed)
+    return bytes(bytearray(generator.getrandbits(8) for _ in range(size)))
+
+
+class ChunkerCase(unittest.TestCase):
+    """
+    Test content-defined chunking.
+    """
+
+    def setUp(self):
+        self.chunker = Chunker(1024)
+        self.data = _random_data(64 * 1024, 1)
+
+    def test_split(self):
+        """
+        Split the data into chunks of bounded size.
+        """
+        data_chunks = list(self.chunker.split(
+            self.data[_:_ + 1000] for _ in range(0, len(self.data), 1000)
+        ))
+
+        self.assertEqual(self.data, b''.join(data_chunks))
+        self.assertTrue(all(len(_) <= 4096 for _ in data_chunks))
+        self.assertTrue(all(len(_) >= 256 for _ in data_chunks[:-1]))
+
+    def test_shift_resistance(self):
+        """
+        Keep most of the chunks after an insertion into the data.
+        """
+        original = set(self.chunker.split([self.data]))
+        changed = set(self.chunker.split([b'new header' + self.data]))
+
+        self.assertGreater(len(original & changed), len(original) * 0.8)
+
+
+class ChunkStoreCase(unittest.TestCase):
+    """
+    Test deduplicated chunks storage.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = ChunkStore(self.folder, 1024)
+        self.data = _random_data(32 * 1024, 2)
+        self.version = self.data[:10000] + b'changed' + self.data[10000:]
+        self.hashes = [sha256(self.data).hexdigest(),
+                       sha256(self.version).hexdigest()]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        blob_chunks.delete().execute()
+        chunks.delete().execute()
+
+    def test_deduplication(self):
+        """
+        Store shared chunks once and rebuild both blobs.
+        """
+        first_size = self.store.save(self.hashes[0], [self.data])
+        second_size = self.store.save(self.hashes[1], [self.version])
+
+        self.assertEqual(len(self.data), first_size)
+        self.assertLess(second_size, len(self.version) / 2)
+
+        self.assertEqual(self.data,
+                         b''.join(self.store.iter_blob(self.hashes[0])))
+        self.assertEqual(self.version,
+                         b''.join(self.store.iter_blob(self.hashes[1])))
+        self.assertGreater(
+            chunks.select(chunks.c.refs == 2).execute().first().size, 0
+        )
+
+    def test_empty_blob(self):
+        """
+        Store the empty blob as one empty chunk.
+        """
+        data_hash = sha256(b'').hexdigest()
+        self.assertEqual(0, self.store.save(data_hash, [b'']))
+
+        self.assertTrue(self.store.exists(data_hash))
+        self.assertEqual([b''], list(self.store.iter_blob(data_hash)))
+
+    def test_missing_blob(self):
+        """
+        Raise IOError for blobs without chunks.
+        """
+        self.assertFalse(self.store.exists(self.hashes[0]))
+        with self.assertRaises(IOError):
+            list(self.store.iter_blob(self.hashes[0]))
+
+
+class ChunkedTransferCase(unittest.TestCase):
+    """
+    Test uploading, downloading and auditing files stored as chunks.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+        self.folder = tempfile.mkdtemp()
+
+        data = _random_data(32 * 1024, 3)
+        self.versions = [data, data + b'appended tail']
+        self.hashes = [sha256(_).hexdigest() for _ in self.versions]
+
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.processor.chunk_store',
+                  ChunkStore(self.folder, 1024)),
+            patch.dict(self.app.config, {'STORAGE_ENGINE': 'chunks'})
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        shutil.rmtree(self.folder)
+        processor.audit_log.flush()
+        audit.delete().where(audit.c.file_hash.in_(self.hashes)).execute()
+        files.delete().where(files.c.hash.in_(self.hashes)).execute()
+        blob_chunks.delete().execute()
+        chunks.delete().execute()
+
+    def _headers(self, data_hash):
+        return {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     data_hash)
+        }
+
+    def test_chunked_storage(self):
+        """
+        Store near-identical files as shared chunks.
+        """
+        used_before = self.app.config['NODE'].info['storage']['used']
+
+        with self.app.test_client() as c:
+            for data, data_hash in zip(self.versions, self.hashes):
+                response = c.post('/api/files/', data={
+                    'data_hash': data_hash,
+                    'file_data': (BytesIO(data), 'test_file'),
+                    'file_role': '000'
+                }, headers=self._headers(data_hash))
+                self.assertEqual(201, response.status_code)
+
+            self.assertFalse(os.path.exists(os.path.join(
+                self.app.config['UPLOAD_FOLDER'], self.hashes[0]
+            )))
+
+            response = c.get('/api/files/' + self.hashes[1],
+                             headers=self._headers(self.hashes[1]))
+            self.assertEqual(self.versions[1], response.data)
+
+            seed = sha256(b'seed').hexdigest()
+            response = c.post('/api/audit/', data={
+                'data_hash': self.hashes[0],
+                'challenge_seed': seed
+            }, headers=self._headers(self.hashes[0]))
+            self.assertEqual(
+                sha256(self.versions[0] + seed.encode()).hexdigest(),
+                json.loads(response.data.decode())['challenge_response']
+            )
+
+        storage = self.app.config['NODE'].info['storage']
+        self.assertGreater(storage['dedup_ratio'], 1.5)
+        self.assertLess(storage['used'] - used_before,
+                        sum(len(_) for _ in self.versions) * 0.7)
+
+    def test_empty_file(self):
+        """
+        Download and audit the empty file stored as chunks.
+        """
+        data_hash = sha256(b'').hexdigest()
+        self.hashes.append(data_hash)
+
+        with self.app.test_client() as c:
+            response = c.post('/api/files/', data={
+                'data_hash': data_hash,
+                'file_data': (BytesIO(b''), 'test_file'),
+                'file_role': '000'
+            }, headers=self._headers(data_hash))
+            self.assertEqual(201, response.status_code)
+
+            response = c.get('/api/files/' + data_hash,
+                             headers=self._headers(data_hash))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(b'', response.data)
+
+            seed = sha256(b'seed').hexdigest()
+            response = c.post('/api/audit/', data={
+                'data_hash': data_hash,
+                'challenge_seed': seed
+            }, headers=self._headers(data_hash))
+            self.assertEqual(
+                sha256(seed.encode()).hexdigest(),
+                json.loads(response.data.decode())['challenge_response']
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
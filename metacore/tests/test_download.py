@@ -68,8 +68,12 @@ class DownloadFileCase(unittest.TestCase):
             'signature': valid_signature
         }
 
-        self.patcher = patch('metacore.processor.BTCTX_API', test_btctx_api)
-        self.patcher.start()
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.processor.file_index.refresh_interval', 0)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
 
     def tearDown(self):
         """
@@ -78,7 +82,8 @@ class DownloadFileCase(unittest.TestCase):
         Remove initial records form the 'files' table.
         Return initial blacklist content.
         """
-        self.patcher.stop()
+        for patcher in self.patchers:
+            patcher.stop()
 
         try:
             pass
@@ -157,6 +162,145 @@ class DownloadFileCase(unittest.TestCase):
         self.assertEqual(response.data, self.file_data,
                          "Stored file content is expected.")
 
+    def test_validators(self):
+        """
+        Mark downloaded file with its hash as an entity tag.
+        """
+        response = self.make_request()
+
+        self.assertEqual('"{}"'.format(self.data_hash),
+                         response.headers['ETag'])
+        self.assertIn('private', response.headers['Cache-Control'])
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_public_validators(self):
+        """
+        Allow shared caches to store public files.
+        """
+        files.update().where(
+            files.c.hash == self.data_hash).values(role='001').execute()
+        response = self.make_request()
+
+        self.assertEqual('public, max-age=31536000, immutable',
+                         response.headers['Cache-Control'])
+
+    def test_not_modified(self):
+        """
+        Answer matched entity tag without reading the file.
+        """
+        self.headers['If-None-Match'] = '"{}"'.format(self.data_hash)
+        os.unlink(self.file_saving_path)
+
+        response = self.make_request()
+
+        self.assertEqual(304, response.status_code,
+                         "'Not Modified' status code is expected.")
+        self.assertEqual(b'', response.data)
+        self.assertEqual('"{}"'.format(self.data_hash),
+                         response.headers['ETag'])
+
+    def test_not_modified_checks_access(self):
+        """
+        Check access before answering matched entity tag.
+        """
+        files.update().where(
+            files.c.hash == self.data_hash).values(role='020').execute()
+        response = self.make_request(False)
+
+        self.assertEqual(404, response.status_code,
+                         "'Not Found' status code is expected.")
+
+    def test_head(self):
+        """
+        Answer HEAD with the file metadata without reading the file.
+        """
+        os.unlink(self.file_saving_path)
+        before = self.app.config['NODE'].current['outgoing']
+
+        with self.app.test_client() as c:
+            response = c.head(self.base_url + self.data_hash,
+                              headers=self.headers)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'', response.data)
+        self.assertEqual(len(self.file_data), response.content_length)
+        self.assertEqual('"{}"'.format(self.data_hash),
+                         response.headers['ETag'])
+        self.assertEqual('000', response.headers['X-File-Role'])
+        self.assertEqual(before,
+                         self.app.config['NODE'].current['outgoing'])
+
+    def test_range(self):
+        """
+        Answer a single byte range with the part of the file.
+        """
+        headers = dict(self.headers, Range='bytes=4-7')
+        with self.app.test_client() as c:
+            response = c.get(self.base_url + self.data_hash, headers=headers)
+
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(self.file_data[4:8], response.data)
+        self.assertEqual(
+            'bytes 4-7/{}'.format(len(self.file_data)),
+            response.headers['Content-Range']
+        )
+        self.assertEqual('bytes', response.headers['Accept-Ranges'])
+
+    def test_unsatisfiable_range(self):
+        """
+        Answer a range out of the file with 416 status code.
+        """
+        headers = dict(self.headers, Range='bytes=1000-1999')
+        with self.app.test_client() as c:
+            response = c.get(self.base_url + self.data_hash, headers=headers)
+
+        self.assertEqual(416, response.status_code)
+        self.assertEqual(
+            'bytes */{}'.format(len(self.file_data)),
+            response.headers['Content-Range']
+        )
+
+    def test_head_range(self):
+        """
+        Answer HEAD with a byte range like the matching GET request.
+        """
+        headers = dict(self.headers, Range='bytes=4-7')
+        with self.app.test_client() as c:
+            response = c.head(self.base_url + self.data_hash, headers=headers)
+
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(4, response.content_length)
+        self.assertEqual(
+            'bytes 4-7/{}'.format(len(self.file_data)),
+            response.headers['Content-Range']
+        )
+
+        headers = dict(self.headers, Range='bytes=1000-1999')
+        with self.app.test_client() as c:
+            response = c.head(self.base_url + self.data_hash, headers=headers)
+
+        self.assertEqual(416, response.status_code)
+        self.assertEqual(
+            'bytes */{}'.format(len(self.file_data)),
+            response.headers['Content-Range']
+        )
+
+    def test_head_checks_access(self):
+        """
+        Check access before answering HEAD.
+        """
+        files.update().where(
+            files.c.hash == self.data_hash).values(role='020').execute()
+
+        with self.app.test_client() as c:
+            response = c.head(self.base_url + self.data_hash, headers={
+                'sender_address': test_other_address,
+                'signature': test_btctx_api.sign_unicode(test_other_wfi,
+                                                         self.data_hash)
+            })
+
+        self.assertEqual(404, response.status_code)
+
     def test_blocked_hash(self):
         """
         Try to download file with blacklisted SHA-256 hash.
@@ -0,0 +1,127 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+
+from metacore.database import files
+from metacore.fileindex import FileIndex, FileRecord
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class FileIndexCase(unittest.TestCase):
+    """
+    Test the in-memory files metadata index.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.folder, 'files.index')
+        self.now = 1000.0
+        self.hashes = [sha256(str(_).encode()).hexdigest() for _ in range(3)]
+        files.insert().values(hash=self.hashes[0], role='001', size=10,
+                              owner=test_owner_address).execute()
+        files.insert().values(hash=self.hashes[1], role='000', size=20,
+                              owner=test_owner_address, codec='zlib',
+                              stored_size=5).execute()
+
+    def tearDown(self):
+        files.delete().where(files.c.hash.in_(self.hashes)).execute()
+        shutil.rmtree(self.folder)
+
+    def make_index(self, **kwargs):
+        return FileIndex(self.snapshot_path, refresh_interval=10,
+                         clock=lambda: self.now, **kwargs)
+
+    def assertRecord(self, expected, record):
+        self.assertIsInstance(record, FileRecord)
+        self.assertEqual(expected, (record.hash, record.role, record.size,
+                                    record.owner, record.codec,
+                                    record.stored_size))
+
+    def test_lookups(self):
+        """
+        Serve the hits and the misses from memory until the interval.
+        """
+        index = self.make_index()
+        self.assertRecord(
+            (self.hashes[1], '000', 20, test_owner_address, 'zlib', 5),
+            index.get(self.hashes[1])
+        )
+
+        files.update().where(files.c.hash == self.hashes[0]).values(
+            role='101'
+        ).execute()
+        files.insert().values(hash=self.hashes[2], role='000', size=30,
+                              owner=test_other_address).execute()
+
+        with patch.object(index, '_log_bounds') as mock_log_bounds:
+            self.assertEqual('001', index.get(self.hashes[0]).role)
+            self.assertIsNone(index.get(self.hashes[2]))
+            self.assertEqual([None], index.get_many([self.hashes[2]]))
+        self.assertFalse(mock_log_bounds.called)
+
+        self.now += 10
+        self.assertEqual(30, index.get(self.hashes[2]).size)
+        self.assertEqual('101', index.get(self.hashes[0]).role)
+        self.assertIs(index.get(self.hashes[0]).owner,
+                      index.get(self.hashes[1]).owner)
+
+    def test_follow_changes(self):
+        """
+        Apply the changes made by other workers after the interval.
+        """
+        index = self.make_index()
+        index.get(self.hashes[0])
+
+        files.delete().where(files.c.hash == self.hashes[0]).execute()
+        self.assertIsNotNone(index.get(self.hashes[0]))
+
+        self.now += 10
+        self.assertIsNone(index.get(self.hashes[0]))
+
+    def test_snapshot(self):
+        """
+        Warm up from the snapshot and apply the later changes.
+        """
+        self.make_index().get(self.hashes[0])
+        self.assertTrue(os.path.exists(self.snapshot_path))
+
+        files.delete().where(files.c.hash == self.hashes[0]).execute()
+
+        index = self.make_index()
+        with patch.object(index, '_scan') as mock_scan:
+            self.assertIsNone(index.get(self.hashes[0]))
+            self.assertRecord(
+                (self.hashes[1], '000', 20, test_owner_address, 'zlib', 5),
+                index.get(self.hashes[1])
+            )
+        self.assertFalse(mock_scan.called)
+
+    def test_pruned_changes(self):
+        """
+        Scan the table if the changes after the snapshot are pruned.
+        """
+        self.make_index().get(self.hashes[0])
+        for role in ('010', '011', '100'):
+            files.update().where(files.c.hash == self.hashes[0]).values(
+                role=role
+            ).execute()
+        FileIndex(changes_kept=1).refresh()
+
+        index = self.make_index()
+        self.assertFalse(index.load_snapshot())
+        self.assertEqual('100', index.get(self.hashes[0]).role)
+
+
+if __name__ == '__main__':
+    unittest.main()
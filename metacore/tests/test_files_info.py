@@ -1,11 +1,18 @@
+import sys
 import json
 import unittest
 from hashlib import sha256
 
 from metacore.database import files
+from metacore.error_codes import *
 from metacore.tests import *
 from metacore import storj
 
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
 
 __author__ = 'karatel'
 
@@ -107,6 +114,39 @@ class GetFilesInfoCase(unittest.TestCase):
             "Has to contain all files hashes without blacklisted ones."
         )
 
+    def test_not_modified(self):
+        """
+        Answer matched entity tag until the files are changed.
+        """
+        with self.app.test_client() as c:
+            etag = c.get(path=self.url).headers['ETag']
+            response = c.get(path=self.url, headers={'If-None-Match': etag})
+
+            self.assertEqual(304, response.status_code,
+                             "'Not Modified' status code is expected.")
+
+            files.update().where(
+                files.c.hash == self.files_id[0]
+            ).values(size=3).execute()
+            response = c.get(path=self.url, headers={'If-None-Match': etag})
+
+        self.assertEqual(200, response.status_code,
+                         "'OK' status code is expected.")
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+    def test_missing_blacklist(self):
+        """
+        List the files when there is no Blacklist file.
+        """
+        with patch.dict(self.app.config,
+                        {'BLACKLIST_FILE': self.app.config['BLACKLIST_FILE'] +
+                         '.missing'}):
+            with self.app.test_client() as c:
+                response = c.get(path=self.url)
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.headers['ETag'])
+
     def test_success_get_info_with_no_files(self):
         """
         Successful getting files info with noo files.
@@ -124,5 +164,173 @@ class GetFilesInfoCase(unittest.TestCase):
         self.assertListEqual([], json.loads(response.data.decode()))
 
 
+
+class GetOwnerFilesInfoCase(unittest.TestCase):
+    """
+    Test listing the owner's files.
+    """
+    url = '/api/files/'
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.owner_hashes = sorted(sha256(str(_).encode()).hexdigest()
+                                   for _ in range(5))
+        self.other_hash = sha256(b'other').hexdigest()
+        for data_hash in self.owner_hashes:
+            files.insert().values(hash=data_hash, role='000', size=1,
+                                  owner=test_owner_address).execute()
+        files.insert().values(hash=self.other_hash, role='000', size=1,
+                              owner=test_other_address).execute()
+
+        with open(self.app.config['BLACKLIST_FILE'], 'r+') as fp:
+            self.initial_blacklist = fp.read()
+            fp.writelines((self.owner_hashes[1] + '\n',))
+
+        self.query = {'owner': test_owner_address}
+        self.headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     test_owner_address)
+        }
+        self.patcher = patch('metacore.processor.BTCTX_API', test_btctx_api)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        files.delete().where(files.c.hash.in_(
+            self.owner_hashes + [self.other_hash]
+        )).execute()
+
+        with open(self.app.config['BLACKLIST_FILE'], 'w') as fp:
+            fp.write(self.initial_blacklist)
+
+    def test_pages(self):
+        """
+        List the owner's files page by page without blocked ones.
+        """
+        pages = []
+        self.query['limit'] = 2
+        with self.app.test_client() as c:
+            while True:
+                response = c.get(self.url, query_string=self.query,
+                                 headers=self.headers)
+                self.assertEqual(200, response.status_code)
+                data = json.loads(response.data.decode())
+                self.assertEqual(test_owner_address, data['owner'])
+                pages.append(data['hashes'])
+                if data['next'] is None:
+                    break
+                self.query['after'] = data['next']
+
+        self.assertEqual(
+            [self.owner_hashes[0:1], self.owner_hashes[2:4],
+             self.owner_hashes[4:]],
+            pages
+        )
+
+    def test_other_owner(self):
+        """
+        Refuse listing the files of another owner.
+        """
+        self.query['owner'] = test_other_address
+        with self.app.test_client() as c:
+            response = c.get(self.url, query_string=self.query,
+                             headers=self.headers)
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(ERR_TRANSFER['INVALID_SIGNATURE'],
+                         json.loads(response.data.decode())['error_code'])
+
+    def test_invalid_signature(self):
+        """
+        Refuse listing the files without the owner's signature.
+        """
+        self.headers['signature'] = test_btctx_api.sign_unicode(
+            test_owner_wif, test_other_address
+        )
+        with self.app.test_client() as c:
+            response = c.get(self.url, query_string=self.query,
+                             headers=self.headers)
+
+        self.assertEqual(400, response.status_code)
+
+
+class FilesExistCase(unittest.TestCase):
+    """
+    Test checking which files are stored.
+    """
+    url = '/api/files/exists'
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.hashes = [sha256(str(_).encode()).hexdigest() for _ in range(4)]
+        for data_hash in self.hashes[:3]:
+            files.insert().values(hash=data_hash, role='000', size=1,
+                                  owner=test_owner_address).execute()
+
+        with open(self.app.config['BLACKLIST_FILE'], 'r+') as fp:
+            self.initial_blacklist = fp.read()
+            fp.writelines((self.hashes[2] + '\n',))
+
+        self.patcher = patch('metacore.processor.file_index.refresh_interval', 0)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        files.delete().where(files.c.hash.in_(self.hashes)).execute()
+
+        with open(self.app.config['BLACKLIST_FILE'], 'w') as fp:
+            fp.write(self.initial_blacklist)
+
+    def post(self, data, content_type):
+        with self.app.test_client() as c:
+            return c.post(self.url, data=data, content_type=content_type)
+
+    def test_json(self):
+        """
+        List the stored hashes, blacklisted ones are missing.
+        """
+        for body in (self.hashes, {'hashes': self.hashes}):
+            response = self.post(json.dumps(body), 'application/json')
+
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({'hashes': self.hashes[:2]},
+                             json.loads(response.data.decode()))
+
+    def test_binary(self):
+        """
+        Answer packed digests with a bitmap.
+        """
+        digests = b''.join(sha256(str(_).encode()).digest()
+                           for _ in [3, 0, 2, 1] * 3)
+        response = self.post(digests, 'application/octet-stream')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'\x55\x50', response.data)
+
+    def test_invalid_hashes(self):
+        """
+        Refuse broken hashes and too long lists.
+        """
+        for data, content_type in (
+                (json.dumps(['not a hash']), 'application/json'),
+                (json.dumps([1]), 'application/json'),
+                ('not JSON', 'application/json'),
+                (b'\0' * 33, 'application/octet-stream')
+        ):
+            response = self.post(data, content_type)
+            self.assertEqual(400, response.status_code)
+            self.assertEqual(ERR_TRANSFER['INVALID_HASH'],
+                             json.loads(response.data.decode())['error_code'])
+
+        with patch.dict(self.app.config, {'FILES_EXISTS_MAX_HASHES': 3}):
+            response = self.post(json.dumps(self.hashes), 'application/json')
+        self.assertEqual(400, response.status_code)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,241 @@
+import sys
+import binascii
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+from io import BytesIO
+
+from metacore import blobs, merkle, processor, storj
+from metacore.database import audit, files
+from metacore.error_codes import *
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class MerkleTreeCase(unittest.TestCase):
+    """
+    Test building saved Merkle trees and their proofs.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_proofs(self):
+        """
+        Prove every leaf of trees with odd and even levels.
+        """
+        for size in (0, 100, 1024, 5 * 1024 + 1, 9 * 1024):
+            data = os.urandom(size)
+            data_hash = sha256(data).hexdigest()
+            root = merkle.save_tree(self.folder, data_hash,
+                                    [data[:700], data[700:]], 1024)
+            tree = merkle.MerkleTree(blobs.blob_path(self.folder, data_hash))
+
+            self.assertEqual(root, tree.root)
+            self.assertEqual(root, merkle.root([data], 1024))
+            self.assertEqual(max(1, (size + 1023) // 1024), tree.leaf_count)
+            for index in range(tree.leaf_count):
+                chunk = data[index * 1024:(index + 1) * 1024]
+                proof = tree.proof(index)
+                self.assertTrue(merkle.verify(chunk, index, proof, root))
+                self.assertFalse(merkle.verify(chunk + b'x', index, proof,
+                                               root))
+
+    def test_checked_data(self):
+        """
+        Save no tree of the data mismatching its hash.
+        """
+        data_hash = sha256(b'data').hexdigest()
+
+        self.assertRaises(merkle.MismatchedData, merkle.save_tree,
+                          self.folder, data_hash, [b'other data'], 1024,
+                          check=True)
+        self.assertFalse(os.path.exists(blobs.blob_path(self.folder,
+                                                        data_hash)))
+
+    def test_challenge_indices(self):
+        """
+        Derive the same distinct indices from the same seed.
+        """
+        indices = merkle.challenge_indices('seed', 100, 8)
+
+        self.assertEqual(indices, merkle.challenge_indices('seed', 100, 8))
+        self.assertNotEqual(indices, merkle.challenge_indices('other', 100, 8))
+        self.assertTrue(all(0 <= _ < 100 for _ in indices))
+        self.assertEqual([0], merkle.challenge_indices('seed', 1, 8))
+
+
+class MerkleAuditCase(unittest.TestCase):
+    """
+    Test chunk audits of the stored files.
+    """
+
+    url = '/api/audit/merkle/'
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = os.urandom(20 * 1024 + 10)
+        self.data_hash = sha256(self.file_data).hexdigest()
+        self.headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     self.data_hash)
+        }
+        self.send_data = {
+            'data_hash': self.data_hash,
+            'challenge_seed': sha256(b'seed').hexdigest()
+        }
+
+        with open(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                  self.data_hash), 'wb') as fp:
+            fp.write(self.file_data)
+        files.insert().values(hash=self.data_hash, role='000',
+                              size=len(self.file_data),
+                              owner=test_owner_address).execute()
+
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.processor.file_index.refresh_interval', 0)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        for folder in (self.app.config['UPLOAD_FOLDER'],
+                       self.app.config['MERKLE_FOLDER']):
+            try:
+                os.unlink(blobs.blob_path(folder, self.data_hash))
+            except OSError:
+                pass
+        processor.audit_log.flush()
+        audit.delete().where(audit.c.file_hash == self.data_hash).execute()
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    @patch('metacore.processor.audit_log.batch_size', 1)
+    def test_chunk_audit(self):
+        """
+        Prove the challenged chunks of the file stored before chunk audits.
+        """
+        with self.app.test_client() as c:
+            response = c.post(self.url, data=self.send_data,
+                              headers=self.headers)
+
+        self.assertEqual(201, response.status_code)
+        result = json.loads(response.data.decode())
+
+        levels = merkle.build([self.file_data], result['chunk_size'])
+        root = binascii.hexlify(levels[-1][0]).decode()
+        self.assertEqual(root, result['root'])
+        self.assertEqual(
+            merkle.challenge_indices(self.send_data['challenge_seed'],
+                                     len(levels[0]),
+                                     self.app.config['MERKLE_CHALLENGE_CHUNKS']),
+            [_['index'] for _ in result['chunks']]
+        )
+        for chunk in result['chunks']:
+            self.assertTrue(merkle.verify(
+                binascii.a2b_base64(chunk['data']), chunk['index'],
+                chunk['proof'], root
+            ))
+        self.assertEqual('merkle', audit.select().execute().first().mode)
+
+    def test_corrupted_file(self):
+        """
+        Don't build the tree of a corrupted file stored before chunk audits.
+        """
+        with open(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                  self.data_hash), 'r+b') as fp:
+            fp.write(b'x')
+
+        with self.app.test_client() as c:
+            response = c.post(self.url, data=self.send_data,
+                              headers=self.headers)
+
+        self.assertEqual(404, response.status_code)
+        self.assertFalse(os.path.exists(
+            blobs.blob_path(self.app.config['MERKLE_FOLDER'], self.data_hash)
+        ))
+
+    def test_upload_root(self):
+        """
+        Check the proofs against the root returned by the upload.
+        """
+        files.delete().where(files.c.hash == self.data_hash).execute()
+        with self.app.test_client() as c:
+            uploaded = json.loads(c.post('/api/files/', data={
+                'file_data': (BytesIO(self.file_data), 'test_file'),
+                'data_hash': self.data_hash,
+                'file_role': '000'
+            }, headers=self.headers).data.decode())
+            result = json.loads(c.post(self.url, data=self.send_data,
+                                       headers=self.headers).data.decode())
+
+        self.assertEqual(
+            merkle.root([self.file_data], self.app.config['MERKLE_CHUNK_SIZE']),
+            uploaded['merkle_root']
+        )
+        for chunk in result['chunks']:
+            self.assertTrue(merkle.verify(
+                binascii.a2b_base64(chunk['data']), chunk['index'],
+                chunk['proof'], uploaded['merkle_root']
+            ))
+
+    def test_lost_file(self):
+        """
+        Answer with the peers list when the file is lost.
+        """
+        os.unlink(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                  self.data_hash))
+
+        with self.app.test_client() as c:
+            response = c.post(self.url, data=self.send_data,
+                              headers=self.headers)
+
+        self.assertEqual(404, response.status_code)
+        self.assertIn('peers', json.loads(response.data.decode()))
+
+    def test_separate_rate_limits(self):
+        """
+        Count chunk audits against their own limits.
+        """
+        mock_config = copy.deepcopy(self.app.config)
+        mock_config['MERKLE_AUDIT_RATE_LIMITS']['owner'] = 1
+        mock_config['AUDIT_RATE_LIMITS']['owner'] = 1
+
+        with patch('metacore.storj.app.config', mock_config):
+            with self.app.test_client() as c:
+                self.assertEqual(201, c.post(
+                    '/api/audit/', data=self.send_data, headers=self.headers
+                ).status_code)
+                self.assertEqual(201, c.post(
+                    self.url, data=self.send_data, headers=self.headers
+                ).status_code)
+                response = c.post(self.url, data=self.send_data,
+                                  headers=self.headers)
+
+        self.assertEqual(400, response.status_code)
+        self.assertDictEqual({'error_code': ERR_AUDIT['LIMIT_REACHED']},
+                             json.loads(response.data.decode()))
+
+
+if __name__ == '__main__':
+    unittest.main()
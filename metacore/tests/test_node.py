@@ -2,8 +2,9 @@ import sys
 import json
 import os.path
 import unittest
+from hashlib import sha256
 
-from metacore.database import files
+from metacore.database import files, traffic
 from metacore import node
 
 if sys.version_info.major == 3:
@@ -15,24 +16,10 @@ else:
 class NodeTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        """
-        Setup fake database values by patching "files" in imported "database"
-        module. Namely frame-up "files.selection().execute()" call results.
-        """
-        cls.saving_select = files.select
-        files.select = MagicMock()
-        files_size = []
-        select_all_files = [{'size': item} for item in files_size]
-        mock_execute = files.select.return_value
-        mock_execute.execute.return_value = select_all_files
         cls.test_json_name = 'test_node_setup.json'
 
-    @classmethod
-    def tearDownClass(cls):
-        files.select = cls.saving_select
-
-
     def setUp(self):
+        traffic.delete().execute()
         self.node = node.Node(os.path.join(os.path.dirname(node.__file__),
                                            'test_node.json'))
 
@@ -51,7 +38,8 @@ class NodeTest(unittest.TestCase):
         self.data_from_test_nodeJSON = {
             '_Node__public_key': init_node_data['public_key'],
             '_Node__limits': init_node_data['bandwidth']['limits'],
-            '_Node__current_bandwidth': init_node_data['bandwidth']['current'],
+            '_Node__rates': init_node_data['bandwidth']['rates'],
+            '_Node__window': init_node_data['bandwidth']['window'],
             '_Node__total_bandwidth': init_node_data['bandwidth']['total'],
             '_Node__capacity': init_node_data['storage']['capacity'],
             '_Node__file_path': self.node._Node__file_path
@@ -64,6 +52,7 @@ class NodeTest(unittest.TestCase):
         except Exception:
             pass
         del self.node
+        traffic.delete().execute()
 
     def test_node_get_instance(self):
         """
@@ -100,8 +89,13 @@ class NodeTest(unittest.TestCase):
         self.node._Node__increase_traffic.assert_called_once_with(500, False)
 
     def test_node_current(self):
-        self.assertIs(self.node._Node__current_bandwidth, self.node.current)
-        self.assertIsInstance(self.node._Node__current_bandwidth, dict)
+        """
+        Test of counting the current bandwidth over the window
+        """
+        self.node._ledger.add('outgoing', 100)
+        self.assertEqual(self.node._ledger.window(self.node.window),
+                         self.node.current)
+        self.assertEqual({'incoming': 0, 'outgoing': 100}, self.node.current)
 
     def test_node_capacity(self):
         """
@@ -117,12 +111,24 @@ class NodeTest(unittest.TestCase):
         self.assertIs(self.node._Node__limits, self.node.limits)
         self.assertIsInstance(self.node.limits, dict)
 
+    def test_node_rates(self):
+        """
+        Test of correctness of working the rates property
+        """
+        self.assertIs(self.node._Node__rates, self.node.rates)
+        self.assertEqual({'incoming', 'outgoing', 'per_sender'},
+                         set(self.node.rates))
+
     def test_node_total(self):
         """
         Test of correctness of working the node_total property
         """
-        self.assertIs(self.node._Node__total_bandwidth, self.node.total)
-        self.assertIsInstance(self.node.total, dict)
+        self.node._ledger.add('incoming', 100)
+        self.assertEqual(
+            {'incoming': self.node._Node__total_bandwidth['incoming'] + 100,
+             'outgoing': self.node._Node__total_bandwidth['outgoing']},
+            self.node.total
+        )
 
     def test_node_public_key(self):
         """
@@ -164,23 +170,27 @@ class NodeTest(unittest.TestCase):
                     "problems with rewriting a json file of the Node "
                 )
 
-    @patch.object(files, 'select')
-    def test_node_info(self, mock_select):
+    def test_node_info(self):
         """
         Test of compliance between info in instances json file and
         the data returned from node.info()
         """
         files_size = (50, 700, 200)
-        select_all_files = [{'size': item} for item in files_size]
-        mock_execute = mock_select.return_value
-        mock_execute.execute.return_value = select_all_files
-
-        with open(self.node._Node__file_path, 'r') as config_file:
-            init_node_data = json.load(config_file)
-            init_node_data['storage']['max_file_size'] = max(files_size)
-            init_node_data['storage']['used'] = sum(files_size)
+        hashes = [sha256(str(_).encode()).hexdigest() for _ in files_size]
+        used = self.node.info['storage']['used']
+        for data_hash, size in zip(hashes, files_size):
+            files.insert().values(hash=data_hash, role='000', size=size,
+                                  owner='owner').execute()
 
-        self.assertDictEqual(init_node_data, self.node.info)
+        try:
+            with open(self.node._Node__file_path, 'r') as config_file:
+                init_node_data = json.load(config_file)
+                init_node_data['storage']['max_file_size'] = max(files_size)
+                init_node_data['storage']['used'] = used + sum(files_size)
+
+            self.assertDictEqual(init_node_data, self.node.info)
+        finally:
+            files.delete().where(files.c.hash.in_(hashes)).execute()
 
     def test_node_increase_traffic(self):
         """
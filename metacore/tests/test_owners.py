@@ -0,0 +1,131 @@
+import sys
+import copy
+import json
+import time
+import unittest
+from hashlib import sha256
+
+from metacore import processor, storj
+from metacore.database import audit, files, owner_audits, owner_usage
+from metacore.error_codes import *
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class OwnersReportCase(unittest.TestCase):
+    """
+    Test the per-owner usage rolled up by triggers.
+    """
+    url = '/api/admin/owners/'
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        files.delete().execute()
+        processor.audit_log.flush()
+        audit.delete().execute()
+        owner_audits.delete().execute()
+
+        self.hashes = [sha256(str(_).encode()).hexdigest() for _ in range(3)]
+        for data_hash, size, owner in zip(
+                self.hashes, (10, 20, 40),
+                (test_owner_address, test_owner_address, test_other_address)
+        ):
+            files.insert().values(hash=data_hash, role='000', size=size,
+                                  owner=owner).execute()
+
+        self.mock_config = copy.deepcopy(self.app.config)
+        self.mock_config['ADMIN_ADDRESSES'] = [test_owner_address]
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.storj.app.config', self.mock_config)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        processor.audit_log.flush()
+        audit.delete().execute()
+        files.delete().execute()
+        owner_audits.delete().execute()
+
+    def get_report(self, **query):
+        timestamp = int(time.time())
+        headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(
+                test_owner_wif, 'GET {} {}'.format(self.url, timestamp)
+            ),
+            'timestamp': str(timestamp)
+        }
+        with self.app.test_client() as c:
+            return c.get(self.url, query_string=query, headers=headers)
+
+    def test_usage(self):
+        """
+        Follow the changes of the files.
+        """
+        files.update().where(files.c.hash == self.hashes[1]).values(
+            size=25
+        ).execute()
+        files.update().where(files.c.hash == self.hashes[2]).values(
+            owner=test_owner_address
+        ).execute()
+        files.delete().where(files.c.hash == self.hashes[0]).execute()
+
+        self.assertEqual(
+            [(test_owner_address, 2, 65)],
+            [tuple(_) for _ in owner_usage.select().execute()]
+        )
+
+    def test_report(self):
+        """
+        Report the files and the audits of every owner.
+        """
+        for data_hash in (self.hashes[0], self.hashes[0], self.hashes[2]):
+            audit.insert().values(file_hash=data_hash,
+                                  is_owners=False).execute()
+
+        response = self.get_report(period='hour')
+        self.assertEqual(200, response.status_code)
+        report = json.loads(response.data.decode())
+
+        hour = int(time.time()) // 3600 * 3600
+        self.assertEqual(3600, report['period'])
+        self.assertEqual(sorted([
+            {'owner': test_owner_address, 'files': 2, 'bytes': 30,
+             'audits': [[hour, 2]]},
+            {'owner': test_other_address, 'files': 1, 'bytes': 40,
+             'audits': [[hour, 1]]}
+        ], key=lambda _: _['owner']), report['owners'])
+
+        report = json.loads(self.get_report().data.decode())
+        owners = dict((_['owner'], _) for _ in report['owners'])
+        self.assertEqual(86400, report['period'])
+        self.assertEqual([[hour // 86400 * 86400, 2]],
+                         owners[test_owner_address]['audits'])
+
+    def test_invalid_period(self):
+        """
+        Refuse unknown periods.
+        """
+        response = self.get_report(period='week')
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(ERR_ADMIN['INVALID_PARAMS'],
+                         json.loads(response.data.decode())['error_code'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+import sys
+import copy
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+from metacore import profiling, storj
+from metacore.error_codes import *
+from metacore.profiling import MemoryTracker, RequestProfiler
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class RequestProfilerCase(unittest.TestCase):
+    """
+    Test profiling of the planned requests.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.samples = []
+        self.profiler = RequestProfiler(self.folder,
+                                        sample=lambda: self.samples.pop(0))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_disabled(self):
+        """
+        Profile nothing while nothing is planned.
+        """
+        self.assertIsNone(self.profiler.start('/api/audit/'))
+        self.assertEqual({'plan': None, 'profiled': 0, 'dumps': []},
+                         self.profiler.status)
+
+    def test_next_requests(self):
+        """
+        Profile the number of the next requests to the route.
+        """
+        self.profiler.plan('/api/audit/', requests=2)
+
+        self.assertIsNone(self.profiler.start('/api/files/'))
+        profiles = [self.profiler.start('/api/audit/') for _ in range(3)]
+        self.assertIsNone(profiles[2])
+        self.assertIsNone(self.profiler.status['plan'])
+
+        names = [self.profiler.finish(_, '/api/audit/') for _ in profiles[:2]]
+        self.assertEqual(sorted(names), self.profiler.status['dumps'])
+        self.assertTrue(names[0].endswith('api_audit.pstats'))
+        pstats.Stats(os.path.join(self.folder, names[0]))
+
+    def test_fraction(self):
+        """
+        Profile the sampled requests.
+        """
+        self.profiler.plan(fraction=0.25)
+        self.samples = [0.5, 0.1, 0.9]
+
+        profiles = [self.profiler.start('/api/files/') for _ in range(3)]
+        self.assertEqual([False, True, False],
+                         [_ is not None for _ in profiles])
+        profiles[1].disable()
+        self.assertEqual({'route': None, 'remaining': None, 'fraction': 0.25},
+                         self.profiler.status['plan'])
+
+    def test_shared_plan(self):
+        """
+        Follow the plan made by another worker.
+        """
+        worker = RequestProfiler(self.folder)
+        self.assertIsNone(worker.start('/api/audit/'))
+        self.profiler.plan('/api/audit/', requests=2)
+
+        profile = worker.start('/api/audit/')
+        self.assertIsNotNone(profile)
+        worker.finish(profile, '/api/audit/')
+        self.assertEqual(1, self.profiler.status['plan']['remaining'])
+        self.assertEqual(1, self.profiler.profiled)
+
+        worker.stop()
+        self.assertIsNone(self.profiler.start('/api/audit/'))
+        self.assertIsNone(self.profiler.status['plan'])
+        self.assertEqual(1, len(self.profiler.status['dumps']))
+
+
+@unittest.skipIf(profiling.tracemalloc is None, 'tracemalloc is missing')
+class MemoryTrackerCase(unittest.TestCase):
+    """
+    Test allocations snapshots.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.tracker = MemoryTracker(self.folder, frames=5)
+
+    def tearDown(self):
+        self.tracker.stop()
+        shutil.rmtree(self.folder)
+
+    def test_growth(self):
+        """
+        Find the allocations made between the snapshots.
+        """
+        self.assertFalse(self.tracker.tracing)
+        first = self.tracker.snapshot()
+        self.assertTrue(self.tracker.tracing)
+        self.assertEqual([], first['growth'])
+        self.assertEqual(os.getpid(), first['pid'])
+
+        kept = [bytearray(1024) for _ in range(1000)]
+        second = self.tracker.snapshot(limit=3)
+
+        self.assertEqual(3, len(second['growth']))
+        self.assertGreaterEqual(second['growth'][0]['size_diff'], 1024 * 1000)
+        self.assertTrue(second['growth'][0]['traceback'][-1].startswith(
+            __file__.rstrip('c') + ':'
+        ))
+        self.assertEqual(sorted([first['snapshot'], second['snapshot']]),
+                         profiling.dumps(self.folder))
+        del kept
+
+        self.tracker.stop()
+        self.assertFalse(self.tracker.tracing)
+
+
+class AdminProfilingCase(unittest.TestCase):
+    """
+    Test the admin profiling API.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.folder = tempfile.mkdtemp()
+        self.mock_config = copy.deepcopy(self.app.config)
+        self.mock_config['ADMIN_ADDRESSES'] = [test_owner_address]
+        self.mock_config['PROFILES_FOLDER'] = self.folder
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.storj.app.config', self.mock_config),
+            patch('metacore.processor.request_profiler',
+                  RequestProfiler(self.folder)),
+            patch('metacore.processor.memory_tracker',
+                  MemoryTracker(self.folder))
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.folder)
+
+    def sign(self, action, wif=test_owner_wif, timestamp=None):
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        return {
+            'sender_address': test_btctx_api.get_address(wif),
+            'signature': test_btctx_api.sign_unicode(
+                wif, '{} {}'.format(action, timestamp)
+            ),
+            'timestamp': str(timestamp)
+        }
+
+    def test_profile_requests(self):
+        """
+        Dump the profile of the planned request.
+        """
+        with self.app.test_client() as c:
+            response = c.post('/api/admin/profile/', data={
+                'route': '/api/nodes/me/',
+                'requests': 1
+            }, headers=self.sign('POST /api/admin/profile/'))
+            self.assertEqual(201, response.status_code)
+            plan = json.loads(response.data.decode())['plan']
+            self.assertEqual(1, plan['remaining'])
+
+            c.get('/api/files/', buffered=True)
+            c.get('/api/nodes/me/', buffered=True)
+            c.get('/api/nodes/me/', buffered=True)
+
+            response = c.get('/api/admin/profile/',
+                             headers=self.sign('GET /api/admin/profile/'))
+            status = json.loads(response.data.decode())
+            self.assertIsNone(status['plan'])
+            self.assertEqual(1, status['profiled'])
+            self.assertEqual(1, len(status['dumps']))
+
+            path = '/api/admin/profile/' + status['dumps'][0]
+            response = c.get(path, headers=self.sign('GET ' + path),
+                             buffered=True)
+            self.assertEqual(200, response.status_code)
+            with open(os.path.join(self.folder, status['dumps'][0]),
+                      'rb') as fp:
+                self.assertEqual(fp.read(), response.data)
+
+    def test_invalid_plan(self):
+        """
+        Reject the plan without the number of requests or the fraction.
+        """
+        with self.app.test_client() as c:
+            response = c.post('/api/admin/profile/', data={'fraction': 2},
+                              headers=self.sign('POST /api/admin/profile/'))
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(ERR_ADMIN['INVALID_PARAMS'],
+                         json.loads(response.data.decode())['error_code'])
+
+    def test_not_admin(self):
+        """
+        Reject the requests not signed by an admin.
+        """
+        action = 'GET /api/admin/profile/'
+        cases = [
+            ({}, ERR_ADMIN['INVALID_SIGNATURE']),
+            (self.sign(action, test_other_wfi),
+             ERR_ADMIN['INVALID_SIGNATURE']),
+            (self.sign('DELETE /api/admin/profile/'),
+             ERR_ADMIN['INVALID_SIGNATURE']),
+            (self.sign(action, timestamp=int(time.time()) - 3600),
+             ERR_ADMIN['EXPIRED_SIGNATURE'])
+        ]
+        with self.app.test_client() as c:
+            for headers, error_code in cases:
+                response = c.get('/api/admin/profile/', headers=headers)
+                self.assertEqual(400, response.status_code)
+                self.assertEqual(error_code, json.loads(response.data.decode())['error_code'])
+
+    @unittest.skipIf(profiling.tracemalloc is None, 'tracemalloc is missing')
+    def test_memory_snapshots(self):
+        """
+        Take the snapshots and stop tracing.
+        """
+        action = 'POST /api/admin/memory/'
+        with self.app.test_client() as c:
+            for _ in range(2):
+                response = c.post('/api/admin/memory/', data={'limit': 5},
+                                  headers=self.sign(action))
+                self.assertEqual(201, response.status_code)
+            self.assertLessEqual(len(json.loads(response.data.decode())['growth']), 5)
+
+            response = c.delete('/api/admin/memory/',
+                                headers=self.sign('DELETE /api/admin/memory/'))
+            self.assertEqual({'tracing': False}, json.loads(response.data.decode()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from hashlib import sha256
+
+from metacore import blobs
+from metacore.database import files, integrity
+from metacore.reconcile import Reconciler
+from metacore.scrubber import STATUS_MISSING
+from metacore.tests import *
+
+
+__author__ = 'karatel'
+
+
+class ReconcileCase(unittest.TestCase):
+    """
+    Test store and database reconciliation.
+    """
+
+    def setUp(self):
+        """
+        Create temporary storage folder with stored, orphan and
+        non-blob files.
+        Create records for stored and dangling blobs.
+        """
+        self.upload_folder = tempfile.mkdtemp()
+        self.initial_hashes = set(_.hash for _ in files.select().execute())
+
+        self.stored = sha256(b'stored').hexdigest()
+        self.dangling = sha256(b'dangling').hexdigest()
+        self.old_orphan = sha256(b'old orphan').hexdigest()
+        self.young_orphan = sha256(b'young orphan').hexdigest()
+
+        for name, data in ((self.stored, b'stored'),
+                           (self.old_orphan, b'old orphan'),
+                           (self.young_orphan, b'young orphan'),
+                           ('README', b'not a blob')):
+            with open(os.path.join(self.upload_folder, name), 'wb') as fp:
+                fp.write(data)
+
+        old_time = time.time() - 7200
+        os.utime(os.path.join(self.upload_folder, self.old_orphan),
+                 (old_time, old_time))
+
+        self.hashes = [self.stored, self.dangling]
+        for data_hash in self.hashes:
+            files.insert().values(
+                hash=data_hash, role='000', size=6, owner=test_owner_address
+            ).execute()
+
+        self.reconciler = Reconciler(self.upload_folder, 3600)
+
+    def tearDown(self):
+        """
+        Remove temporary folder and created records.
+        """
+        shutil.rmtree(self.upload_folder)
+        integrity.delete().execute()
+        files.delete().where(files.c.hash.in_(self.hashes)).execute()
+
+    def test_reclaim_old_orphans(self):
+        """
+        Remove only orphans older than the grace period.
+        """
+        report = self.reconciler.run()
+
+        self.assertEqual(1, report['orphans'])
+        self.assertEqual(len(b'old orphan'), report['reclaimed'])
+        self.assertEqual(1, report['young_orphans'])
+
+        stored_names = set(os.listdir(self.upload_folder))
+        self.assertNotIn(self.old_orphan, stored_names)
+        self.assertIn(self.young_orphan, stored_names)
+        self.assertIn(self.stored, stored_names)
+        self.assertIn('README', stored_names)
+
+    def test_reclaim_temporary_files(self):
+        """
+        Remove temporary files left by crashed writes after the grace period.
+        """
+        old_temp = blobs.write_temp(self.upload_folder, [b'old'])
+        young_temp = blobs.write_temp(self.upload_folder, [b'young'])
+        old_time = time.time() - 7200
+        os.utime(old_temp, (old_time, old_time))
+
+        report = self.reconciler.run()
+
+        self.assertEqual(1, report['temporary'])
+        self.assertEqual(1, report['young_temporary'])
+        self.assertEqual(len(b'old orphan') + len(b'old'),
+                         report['reclaimed'])
+        self.assertFalse(os.path.exists(old_temp))
+        self.assertTrue(os.path.exists(young_temp))
+
+    def test_flag_dangling_records(self):
+        """
+        Mark records without blobs as missing.
+        """
+        report = self.reconciler.run()
+
+        self.assertEqual(len(self.initial_hashes) + 1, report['dangling'])
+        self.assertEqual(6, report['used'])
+        self.assertEqual(
+            STATUS_MISSING,
+            integrity.select(
+                integrity.c.file_hash == self.dangling
+            ).execute().first().status
+        )
+        self.assertIsNone(integrity.select(
+            integrity.c.file_hash == self.stored
+        ).execute().first())
+
+
+if __name__ == '__main__':
+    unittest.main()
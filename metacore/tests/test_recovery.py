@@ -0,0 +1,262 @@
+import sys
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from hashlib import sha256
+
+from metacore import blobs, storj
+from metacore.database import files
+from metacore.recovery import PeerRecovery, read_peers
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from unittest.mock import patch
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class _PeerServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _PeerHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in peer serving one blob, with or without ranges support.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        if server.delay:
+            server.delay.wait()
+
+        data = server.data
+        match = re.match(r'^bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if match and server.ranges:
+            start, end = int(match.group(1)), int(match.group(2)) + 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end - 1, len(data)
+            ))
+            data = data[start:end]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class PeerRecoveryCase(unittest.TestCase):
+    """
+    Test fetching lost blobs from the peers.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = os.urandom(10000)
+        self.data_hash = sha256(self.data).hexdigest()
+        self.recovery = PeerRecovery(timeout=5, part_size=1000)
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.folder)
+
+    def _peer(self, data=None, ranges=True, delay=None):
+        server = _PeerServer(('127.0.0.1', 0), _PeerHandler)
+        server.data, server.ranges, server.delay = data, ranges, delay
+        server.requests = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+        return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    def _fetch(self, peers):
+        path = self.recovery.fetch(self.data_hash, len(self.data), peers,
+                                   self.folder)
+        if path is None:
+            return None
+        with open(path, 'rb') as fp:
+            return fp.read()
+
+    def test_parallel_ranges(self):
+        """
+        Fetch the parts from several peers.
+        """
+        peers = [self._peer(self.data), self._peer(self.data)]
+
+        self.assertEqual(self.data, self._fetch(peers))
+        self.assertTrue(all(len(_.requests) > 1 for _ in self.servers))
+        self.assertEqual(10, sum(len(_.requests) for _ in self.servers))
+
+    def test_failover(self):
+        """
+        Get the parts from other peers when a peer hasn't the blob
+        or ignores ranges.
+        """
+        peers = [self._peer(), self._peer(self.data, ranges=False)]
+
+        self.assertEqual(self.data, self._fetch(peers))
+
+    def test_whole_blob(self):
+        """
+        Take the whole blob from a peer ignoring ranges at once.
+        """
+        self.recovery.max_workers = 1
+        peers = [self._peer(self.data, ranges=False)]
+
+        self.assertEqual(self.data, self._fetch(peers))
+        self.assertEqual(1, len(self.servers[0].requests))
+
+    def test_corrupted_data(self):
+        """
+        Reject the data mismatched with the hash.
+        """
+        corrupted = b'x' + self.data[1:]
+
+        self.assertIsNone(self._fetch([self._peer(corrupted)]))
+        self.assertIsNone(self._fetch([self._peer()]))
+        self.assertEqual([], os.listdir(self.folder))
+
+    def test_single_fetch(self):
+        """
+        Share one fetch between concurrent recoveries of the same blob.
+        """
+        delay = threading.Event()
+        peers = [self._peer(self.data, delay=delay)]
+        restored, results = [], []
+
+        def recover():
+            results.append(self.recovery.recover(
+                self.data_hash, len(self.data), peers, self.folder,
+                restored.append
+            ))
+
+        threads = [threading.Thread(target=recover) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        delay.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([True] * 5, results)
+        self.assertEqual(1, len(restored))
+        self.assertEqual(10, len(self.servers[0].requests))
+        self.assertEqual([], os.listdir(self.folder))
+
+    def test_read_peers(self):
+        """
+        Take only URLs from the peers file.
+        """
+        peers_file = os.path.join(self.folder, 'peers.txt')
+        with open(peers_file, 'w') as fp:
+            fp.write('kNsjdSzyFlWaeecJ6DfN7Zp4UUEKtBwl3\n'
+                     'http://peer.example:5000\n')
+
+        self.assertEqual(['http://a', 'http://peer.example:5000'],
+                         read_peers(peers_file, ['http://a']))
+
+
+class RecoveredDownloadCase(unittest.TestCase):
+    """
+    Test serving lost files recovered from the peers.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = os.urandom(3000)
+        self.data_hash = sha256(self.file_data).hexdigest()
+        self.headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     self.data_hash)
+        }
+        files.insert().values(hash=self.data_hash, role='001',
+                              size=len(self.file_data),
+                              owner=test_owner_address).execute()
+
+        self.server = _PeerServer(('127.0.0.1', 0), _PeerHandler)
+        self.server.data, self.server.ranges = self.file_data, True
+        self.server.delay, self.server.requests = None, []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch.dict(self.app.config, {
+                'PEER_RECOVERY': True,
+                'RECOVERY_PEERS': ['http://127.0.0.1:{}'.format(
+                    self.server.server_address[1]
+                )]
+            }),
+            patch('metacore.processor.file_index.refresh_interval', 0)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+        try:
+            os.unlink(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                      self.data_hash))
+        except OSError:
+            pass
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    def test_recovered_download(self):
+        """
+        Fetch the lost file with the sender's credentials and serve it.
+        """
+        with self.app.test_client() as c:
+            response = c.get('/api/files/' + self.data_hash,
+                             headers=self.headers)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.file_data, response.data)
+        self.assertTrue(os.path.exists(blobs.blob_path(
+            self.app.config['UPLOAD_FOLDER'], self.data_hash
+        )))
+
+    def test_disabled_recovery(self):
+        """
+        Answer with the peers list when the recovery is off.
+        """
+        with patch.dict(self.app.config, {'PEER_RECOVERY': False}):
+            with self.app.test_client() as c:
+                response = c.get('/api/files/' + self.data_hash,
+                                 headers=self.headers)
+
+        self.assertEqual(404, response.status_code)
+        self.assertEqual([], self.server.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+
+from metacore.database import files, integrity
+from metacore.scrubber import (FAILED, Scrubber, Throttle, STATUS_CORRUPTED,
+                               STATUS_MISSING, STATUS_OK)
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class ScrubberCase(unittest.TestCase):
+    """
+    Test background integrity scrubbing.
+    """
+
+    def setUp(self):
+        """
+        Create temporary storage and quarantine folders.
+        Create initial files and records in the 'files' table.
+        """
+        self.upload_folder = tempfile.mkdtemp()
+        self.quarantine_folder = os.path.join(self.upload_folder, 'broken')
+
+        self.hashes = []
+        for data in (b'healthy data', b'corrupted data', b'missing data'):
+            data_hash = sha256(data).hexdigest()
+            files.insert().values(
+                hash=data_hash, role='000', size=len(data),
+                owner=test_owner_address
+            ).execute()
+            self.hashes.append(data_hash)
+
+        self.healthy, self.corrupted, self.missing = self.hashes
+
+        with open(os.path.join(self.upload_folder, self.healthy), 'wb') as fp:
+            fp.write(b'healthy data')
+        with open(os.path.join(self.upload_folder, self.corrupted),
+                  'wb') as fp:
+            fp.write(b'c0rrupted data')
+
+        self.scrubber = Scrubber(self.upload_folder, self.quarantine_folder)
+
+    def tearDown(self):
+        """
+        Remove temporary folders and created records.
+        """
+        shutil.rmtree(self.upload_folder)
+        integrity.delete().execute()
+        files.delete().where(files.c.hash.in_(self.hashes)).execute()
+
+    def _status(self, data_hash):
+        return integrity.select(
+            integrity.c.file_hash == data_hash
+        ).execute().first().status
+
+    def test_run(self):
+        """
+        Scrub all the files and record the results.
+        """
+        report = self.scrubber.run()
+
+        self.assertGreaterEqual(report[STATUS_OK], 1)
+        self.assertGreaterEqual(report[STATUS_CORRUPTED], 1)
+        self.assertGreaterEqual(report[STATUS_MISSING], 1)
+
+        self.assertEqual(STATUS_OK, self._status(self.healthy))
+        self.assertEqual(STATUS_CORRUPTED, self._status(self.corrupted))
+        self.assertEqual(STATUS_MISSING, self._status(self.missing))
+
+    def test_failed_check(self):
+        """
+        Count the blob whose check fails and go on with the others.
+        """
+        with patch.object(self.scrubber, '_quarantine',
+                          side_effect=OSError('read-only')):
+            report = self.scrubber.run()
+
+        self.assertEqual(1, report[FAILED])
+        self.assertEqual(STATUS_OK, self._status(self.healthy))
+
+    def test_dead_worker(self):
+        """
+        Replace the dead worker instead of waiting for it forever.
+        """
+        for number in range(100):
+            data = 'blob {}'.format(number).encode()
+            data_hash = sha256(data).hexdigest()
+            files.insert().values(hash=data_hash, role='000', size=len(data),
+                                  owner=test_owner_address).execute()
+            self.hashes.append(data_hash)
+            with open(os.path.join(self.upload_folder, data_hash),
+                      'wb') as fp:
+                fp.write(data)
+
+        checked = []
+
+        def check(data_hash, codec, throttle):
+            checked.append(data_hash)
+            if len(checked) == 1:
+                raise SystemExit()
+
+        with patch.object(self.scrubber, 'check', side_effect=check):
+            self.scrubber.run()
+
+        self.assertEqual(102, len(checked))
+
+    def test_quarantine_corrupted(self):
+        """
+        Move corrupted blob to the quarantine folder.
+        """
+        self.assertEqual(STATUS_CORRUPTED,
+                         self.scrubber.check(self.corrupted))
+
+        self.assertFalse(os.path.exists(
+            os.path.join(self.upload_folder, self.corrupted)))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.quarantine_folder, self.corrupted)))
+
+    def test_keep_healthy(self):
+        """
+        Leave healthy blob in place.
+        """
+        self.assertEqual(STATUS_OK, self.scrubber.check(self.healthy))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.upload_folder, self.healthy)))
+
+
+class ThrottleCase(unittest.TestCase):
+    """
+    Test read rate throttling.
+    """
+
+    def setUp(self):
+        self.now = 100.0
+        self.sleeps = []
+        self.throttle = Throttle(1000, clock=lambda: self.now,
+                                 sleep=self.sleeps.append)
+
+    def test_sleep_on_exceeded_rate(self):
+        """
+        Sleep as long as needed to keep the rate.
+        """
+        self.throttle.consume(500)
+        self.throttle.consume(500)
+
+        self.assertEqual([0.5, 1.0], self.sleeps)
+
+    def test_no_sleep_within_rate(self):
+        """
+        Don't sleep when reading slower than the limit.
+        """
+        self.throttle.consume(0)
+        self.now += 2
+        self.throttle.consume(1000)
+
+        self.assertEqual([], self.sleeps)
+
+    def test_unlimited(self):
+        """
+        Never sleep without the limit.
+        """
+        throttle = Throttle(None, sleep=self.sleeps.append)
+        throttle.consume(10 ** 9)
+
+        self.assertEqual([], self.sleeps)
+
+
+if __name__ == '__main__':
+    unittest.main()
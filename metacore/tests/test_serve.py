@@ -81,8 +81,12 @@ class ServeFileCase(unittest.TestCase):
             'file_alias': 'file.txt'
         }
 
-        self.patcher = patch('metacore.processor.BTCTX_API', test_btctx_api)
-        self.patcher.start()
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.processor.file_index.refresh_interval', 0)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
 
     def tearDown(self):
         """
@@ -90,7 +94,8 @@ class ServeFileCase(unittest.TestCase):
         Remove initial files from Upload Dir.
         Remove initial records form the 'files' table.
         """
-        self.patcher.stop()
+        for patcher in self.patchers:
+            patcher.stop()
 
         os.unlink(self.file_saving_path)
         files.delete().where(files.c.hash.in_(self.files_id)).execute()
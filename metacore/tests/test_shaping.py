@@ -0,0 +1,213 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+from io import BytesIO
+
+from metacore import blobs, storj
+from metacore.database import files
+from metacore.shaping import BandwidthShaper, BucketTable, ShapedStream
+from metacore.tests import *
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class BandwidthShaperCase(unittest.TestCase):
+    """
+    Test token buckets shared by the workers.
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self.folder = tempfile.mkdtemp()
+        self.shapers = [BandwidthShaper(os.path.join(self.folder, 'buckets'),
+                                        burst=1.0, quantum=100,
+                                        clock=lambda: self.now,
+                                        sleep=self.sleeps.append)
+                        for _ in range(2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_burst(self):
+        """
+        Pass the burst without waiting and pace the rest.
+        """
+        rates = [('node:outgoing', 1000)]
+
+        self.assertEqual(0, self.shapers[0].consume(1000, rates))
+        self.assertAlmostEqual(0.5, self.shapers[1].consume(500, rates))
+        self.assertAlmostEqual(1.0, self.shapers[0].consume(500, rates))
+
+        self.now += 10
+        self.assertEqual(0, self.shapers[1].consume(1000, rates))
+
+    def test_slowest_bucket(self):
+        """
+        Wait for the most limiting bucket.
+        """
+        self.shapers[0].consume(3000, [('node:outgoing', 1000)])
+        delay = self.shapers[0].consume(1000, [('node:outgoing', 1000),
+                                               ('sender:a:outgoing', 100)])
+
+        self.assertAlmostEqual(9.0, delay)
+        self.assertEqual(0, self.shapers[0].consume(
+            1000, [('sender:b:outgoing', 1000)]
+        ))
+
+    def test_full_table(self):
+        """
+        Put new buckets in place of the paid off ones.
+        """
+        table = BucketTable(slots=4, probes=4)
+        for number in range(4):
+            table.add('sender:{}'.format(number), 1000, 1000, self.now)
+        self.assertAlmostEqual(self.now + 1,
+                               table.add('sender:new', 1000, 1000, self.now))
+
+        self.now += 10
+        for number in range(10):
+            self.assertAlmostEqual(
+                self.now + 1,
+                table.add('sender:{}'.format(number), 1000, 1000, self.now)
+            )
+
+    def test_shaped_streams(self):
+        """
+        Account the streamed data by quanta.
+        """
+        rates = [('node:incoming', 100)]
+        stream = ShapedStream(BytesIO(b'x' * 450), self.shapers[0], rates)
+        while stream.read(50):
+            pass
+
+        self.assertEqual(4, len(self.sleeps))
+        self.assertAlmostEqual(3.5, self.sleeps[-1])
+
+        chunks = list(self.shapers[1].iter_shaped([b'y' * 60] * 5,
+                                                  [('node:outgoing', 100)]))
+        self.assertEqual([b'y' * 60] * 5, chunks)
+        self.assertEqual(7, len(self.sleeps))
+
+
+class ShapedDownloadCase(unittest.TestCase):
+    """
+    Test rate limits of downloads.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = os.urandom(300 * 1024)
+        self.data_hash = sha256(self.file_data).hexdigest()
+        with open(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                  self.data_hash), 'wb') as fp:
+            fp.write(self.file_data)
+        files.insert().values(hash=self.data_hash, role='001',
+                              size=len(self.file_data),
+                              owner=test_owner_address).execute()
+
+        self.sleeps = []
+        node_rates = self.app.config['NODE'].rates
+        self.patchers = [
+            patch('metacore.processor.bandwidth_shaper',
+                  BandwidthShaper(burst=1.0, sleep=self.sleeps.append)),
+            patch.dict(node_rates, {
+                'outgoing': 100 * 1024,
+                'per_sender': {'incoming': None, 'outgoing': None}
+            }),
+            patch('metacore.processor.file_index.refresh_interval', 0)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        os.unlink(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                  self.data_hash))
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    def test_limited_download(self):
+        """
+        Send the file at the Node outgoing rate.
+        """
+        with self.app.test_client() as c:
+            response = c.get('/api/files/' + self.data_hash)
+
+        self.assertEqual(self.file_data, response.data)
+        self.assertGreater(sum(self.sleeps), 1.5)
+
+
+class ShapedUploadCase(unittest.TestCase):
+    """
+    Test rate limits of uploads.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = os.urandom(1024)
+        self.data_hash = sha256(self.file_data).hexdigest()
+
+        self.shaper = BandwidthShaper(burst=1.0, sleep=lambda delay: None)
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.processor.bandwidth_shaper', self.shaper),
+            patch.object(self.shaper, 'consume', wraps=self.shaper.consume),
+            patch.dict(self.app.config['NODE'].rates, {
+                'per_sender': {'incoming': 1024, 'outgoing': None}
+            })
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        try:
+            os.unlink(blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                      self.data_hash))
+        except OSError:
+            pass
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    def test_spoofed_sender(self):
+        """
+        Read uploads at the anonymous rate, not at the rate of the sender
+        named in the unchecked header.
+        """
+        with self.app.test_client() as c:
+            response = c.post('/api/files/', data={
+                'file_data': (BytesIO(self.file_data), 'test_file'),
+                'data_hash': self.data_hash,
+                'file_role': '000'
+            }, headers={
+                'sender_address': test_owner_address,
+                'signature': test_btctx_api.sign_unicode(test_other_wfi,
+                                                         self.data_hash)
+            })
+
+        self.assertEqual(400, response.status_code)
+        names = set(name for args, kwargs in self.shaper.consume.call_args_list
+                    for name, rate in args[1])
+        self.assertIn('sender:anonymous:incoming', names)
+        self.assertNotIn('sender:{}:incoming'.format(test_owner_address),
+                         names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -37,6 +37,25 @@ class GetStatusInfoCase(unittest.TestCase):
             "Unexpected response data."
         )
 
+    def test_not_modified(self):
+        """
+        Answer matched entity tag until the Node data is changed.
+        """
+        with self.app.test_client() as c:
+            etag = c.get(path=self.url).headers['ETag']
+            response = c.get(path=self.url, headers={'If-None-Match': etag})
+
+            self.assertEqual(304, response.status_code,
+                             "'Not Modified' status code is expected.")
+
+            self.app.config['NODE'].set_limits(
+                **self.app.config['NODE'].limits
+            )
+            response = c.get(path=self.url, headers={'If-None-Match': etag})
+
+        self.assertEqual(200, response.status_code,
+                         "'OK' status code is expected.")
+
 
 if __name__ == '__main__':
     unittest.main()
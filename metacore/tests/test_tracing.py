@@ -0,0 +1,182 @@
+import sys
+import copy
+import json
+import os
+import unittest
+from hashlib import sha256
+
+from metacore import blobs, processor, storj
+from metacore.database import audit, files
+from metacore.tests import *
+from metacore.tracing import Trace, log_slow
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class TraceCase(unittest.TestCase):
+    """
+    Test timing of the request stages.
+    """
+
+    def setUp(self):
+        self.now = 100.0
+        self.trace = Trace('POST /api/audit/', clock=lambda: self.now)
+
+    def tick(self, seconds):
+        self.now += seconds
+
+    def test_nested_spans(self):
+        """
+        Count the nested time only in the nested stage.
+        """
+        with self.trace.span('hash'):
+            self.tick(1)
+            with self.trace.span('read'):
+                self.tick(2)
+            self.tick(1)
+        with self.trace.span('read'):
+            self.tick(0.5)
+        self.tick(0.25)
+
+        self.assertEqual({
+            'request': 'POST /api/audit/',
+            'duration': 4.75,
+            'stages': {
+                'hash': {'seconds': 2.0, 'count': 1},
+                'read': {'seconds': 2.5, 'count': 2}
+            },
+            'untraced': 0.25
+        }, self.trace.breakdown())
+
+    def test_iter_span(self):
+        """
+        Time getting the items, but not their processing.
+        """
+        def chunks():
+            for _ in range(3):
+                self.tick(1)
+                yield b'x'
+
+        for chunk in self.trace.iter_span('read', chunks()):
+            self.tick(10)
+
+        self.assertEqual([3.0, 4], self.trace.stages['read'])
+
+    def test_failed_span(self):
+        """
+        Time the span ended with an exception.
+        """
+        with self.assertRaises(IOError):
+            with self.trace.span('read'):
+                self.tick(1)
+                raise IOError
+
+        self.assertEqual([1.0, 1], self.trace.stages['read'])
+
+    def test_log_slow(self):
+        """
+        Log only the requests over the threshold.
+        """
+        self.tick(0.5)
+        with patch('metacore.tracing.logger') as mock_logger:
+            self.assertFalse(log_slow(self.trace, None))
+            self.assertFalse(log_slow(self.trace, 1.0))
+            self.assertTrue(log_slow(self.trace, 0.5, status=201))
+
+        self.assertEqual(1, mock_logger.warning.call_count)
+        breakdown = json.loads(mock_logger.warning.call_args[0][1])
+        self.assertEqual(201, breakdown['status'])
+        self.assertEqual(0.5, breakdown['duration'])
+
+
+class SlowRequestCase(unittest.TestCase):
+    """
+    Test the slow requests log.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = b'traced file data'
+        self.data_hash = sha256(self.file_data).hexdigest()
+        self.file_path = blobs.blob_path(self.app.config['UPLOAD_FOLDER'],
+                                         self.data_hash)
+        with open(self.file_path, 'wb') as fp:
+            fp.write(self.file_data)
+        files.insert().values(hash=self.data_hash, role='000',
+                              size=len(self.file_data),
+                              owner=test_owner_address).execute()
+        processor.audit_log.flush()
+        audit.delete().execute()
+
+        self.headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     self.data_hash)
+        }
+        self.send_data = {
+            'data_hash': self.data_hash,
+            'challenge_seed': sha256(b'seed').hexdigest()
+        }
+
+        self.mock_config = copy.deepcopy(self.app.config)
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch('metacore.storj.app.config', self.mock_config),
+            patch('metacore.processor.file_index.refresh_interval', 0),
+            patch('metacore.tracing.logger')
+        ]
+        self.mock_logger = [patcher.start() for patcher in self.patchers][-1]
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        os.unlink(self.file_path)
+        files.delete().where(files.c.hash == self.data_hash).execute()
+        processor.audit_log.flush()
+        audit.delete().execute()
+
+    def test_audit_breakdown(self):
+        """
+        Log the stages of the audit over the threshold.
+        """
+        self.mock_config['SLOW_REQUEST_THRESHOLD'] = 0
+
+        with self.app.test_client() as c:
+            response = c.post('/api/audit/', data=self.send_data,
+                              headers=self.headers, buffered=True)
+        self.assertEqual(201, response.status_code)
+
+        self.assertEqual(1, self.mock_logger.warning.call_count)
+        breakdown = json.loads(self.mock_logger.warning.call_args[0][1])
+        self.assertEqual('POST /api/audit/', breakdown['request'])
+        self.assertEqual(201, breakdown['status'])
+        self.assertTrue(set(breakdown['stages']).issuperset([
+            'check.signature', 'check.hash', 'check.blacklist', 'check.file',
+            'db.audit_count', 'db.audit_insert', 'read', 'hash'
+        ]))
+        self.assertEqual(2, breakdown['stages']['read']['count'])
+
+    def test_fast_request(self):
+        """
+        Don't log the requests under the threshold.
+        """
+        self.mock_config['SLOW_REQUEST_THRESHOLD'] = 60
+
+        with self.app.test_client() as c:
+            c.get('/api/files/' + self.data_hash, headers=self.headers,
+                  buffered=True)
+
+        self.assertFalse(self.mock_logger.warning.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
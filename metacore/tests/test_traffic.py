@@ -0,0 +1,290 @@
+import sys
+import os
+import threading
+import unittest
+from hashlib import sha256
+from io import BytesIO
+
+from metacore import blobs, storj
+from metacore.database import files, traffic
+from metacore.tests import *
+from metacore.traffic import (CountingFile, CountingIterator, CountingStream,
+                              DAY, HOUR, MINUTE, TrafficLedger)
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class TrafficLedgerCase(unittest.TestCase):
+    """
+    Test the time-bucketed traffic ledger.
+    """
+
+    def setUp(self):
+        traffic.delete().execute()
+        self.now = 100 * DAY
+        self.ledger = TrafficLedger(minutes_age=DAY, hours_age=7 * DAY,
+                                    clock=lambda: self.now)
+
+    def tearDown(self):
+        traffic.delete().execute()
+
+    def test_minute_buckets(self):
+        """
+        Sum the traffic of the same minute in one bucket.
+        """
+        self.ledger.add('incoming', 100)
+        self.now += 10
+        self.ledger.add('incoming', 50)
+        self.ledger.add('outgoing', 30)
+
+        self.assertEqual([('incoming', 100 * DAY, MINUTE, 150),
+                          ('outgoing', 100 * DAY, MINUTE, 30)],
+                         self.ledger.history())
+
+    def test_window(self):
+        """
+        Count only the traffic inside the window.
+        """
+        self.ledger.add('outgoing', 100)
+        self.now += 2 * HOUR
+        self.ledger.add('outgoing', 10)
+
+        self.assertEqual({'incoming': 0, 'outgoing': 10},
+                         self.ledger.window(HOUR))
+        self.assertEqual({'incoming': 0, 'outgoing': 110},
+                         self.ledger.window(3 * HOUR))
+
+        self.now += 3 * HOUR
+        self.assertEqual({'incoming': 0, 'outgoing': 0},
+                         self.ledger.window(HOUR))
+
+    def test_roll_up(self):
+        """
+        Merge old buckets keeping the totals.
+        """
+        for minute in range(3):
+            self.ledger.add('incoming', 10)
+            self.now += MINUTE
+        self.now += 2 * DAY
+        self.ledger.roll_up()
+
+        self.assertEqual([('incoming', 100 * DAY, HOUR, 30)],
+                         self.ledger.history())
+
+        self.now += 10 * DAY
+        self.ledger.add('incoming', 5)
+
+        self.assertEqual([('incoming', 100 * DAY, DAY, 30),
+                          ('incoming', int(self.now), MINUTE, 5)],
+                         self.ledger.history())
+        self.assertEqual({'incoming': 35, 'outgoing': 0},
+                         self.ledger.window(30 * DAY))
+
+
+    def test_concurrent_roll_up(self):
+        """
+        Merge every old bucket once when workers roll up together.
+        """
+        for minute in range(0, 3 * DAY, 10 * MINUTE):
+            self.ledger.add('outgoing', 10)
+            self.now += 10 * MINUTE
+        self.now += 10 * DAY
+        total = self.ledger.window()
+
+        workers = [threading.Thread(target=TrafficLedger(
+            minutes_age=DAY, hours_age=7 * DAY, clock=lambda: self.now
+        ).roll_up) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(total, self.ledger.window())
+        self.assertEqual([DAY] * 3,
+                         [_[2] for _ in self.ledger.history()])
+
+
+class CountingCase(unittest.TestCase):
+    """
+    Test counting of the transferred bytes.
+    """
+
+    def setUp(self):
+        self.reports = []
+
+    def test_aborted_iterator(self):
+        """
+        Count only the chunks taken before the abort and report once.
+        """
+        body = CountingIterator([b'a' * 10, b'b' * 20, b'c' * 30],
+                                self.reports.append)
+        chunks = iter(body)
+        next(chunks)
+        next(chunks)
+        body.close()
+        body.close()
+
+        self.assertEqual([10], self.reports)
+
+    def test_stream(self):
+        """
+        Count the read bytes.
+        """
+        stream = CountingStream(BytesIO(b'line\n' + b'x' * 100),
+                                self.reports.append)
+        stream.readline()
+        stream.read(30)
+        stream.close()
+
+        self.assertEqual([35], self.reports)
+
+    def test_file(self):
+        """
+        Report the read part of the file once it's closed.
+        """
+        closed = []
+        with open(__file__, 'rb') as fp:
+            body = CountingFile(fp, 100, self.reports.append,
+                                lambda: closed.append(True))
+            body.read(10)
+            body.close()
+            body.close()
+            self.assertTrue(fp.closed)
+
+        self.assertEqual([10], self.reports)
+        self.assertEqual([True], closed)
+
+    def test_unread_file(self):
+        """
+        Report the whole file sent by the server without reading it.
+        """
+        for unread_sent, reported in ((True, 100), (False, 0)):
+            with open(__file__, 'rb') as fp:
+                CountingFile(fp, 100, self.reports.append,
+                             unread_sent=unread_sent).close()
+            self.assertEqual(reported, self.reports.pop())
+
+
+class TransferAccountingCase(unittest.TestCase):
+    """
+    Test accounting of uploads and downloads in the Node traffic.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+        self.node = self.app.config['NODE']
+
+        self.file_data = os.urandom(200 * 1024)
+        self.data_hash = sha256(self.file_data).hexdigest()
+        self.headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     self.data_hash)
+        }
+        self.patcher = patch('metacore.processor.BTCTX_API', test_btctx_api)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+        for folder in (self.app.config['UPLOAD_FOLDER'],
+                       self.app.config['MERKLE_FOLDER']):
+            try:
+                os.unlink(blobs.blob_path(folder, self.data_hash))
+            except OSError:
+                pass
+        files.delete().where(files.c.hash == self.data_hash).execute()
+
+    def test_transfers(self):
+        """
+        Add the uploaded and downloaded bytes to the Node traffic.
+        """
+        before = self.node.current
+
+        with self.app.test_client() as c:
+            response = c.post('/api/files/', data={
+                'data_hash': self.data_hash,
+                'file_data': (BytesIO(self.file_data), 'test_file'),
+                'file_role': '000'
+            }, headers=self.headers)
+            self.assertEqual(201, response.status_code)
+
+            response = c.get('/api/files/' + self.data_hash,
+                             headers=self.headers, buffered=True)
+            self.assertEqual(self.file_data, response.data)
+
+        after = self.node.current
+        self.assertGreaterEqual(after['incoming'] - before['incoming'],
+                                len(self.file_data))
+        self.assertEqual(len(self.file_data),
+                         after['outgoing'] - before['outgoing'])
+
+    def test_aborted_download(self):
+        """
+        Count only the part of the file sent before the abort.
+        """
+        with self.app.test_client() as c:
+            c.post('/api/files/', data={
+                'data_hash': self.data_hash,
+                'file_data': (BytesIO(self.file_data), 'test_file'),
+                'file_role': '000'
+            }, headers=self.headers)
+
+            before = self.node.current
+            response = c.get('/api/files/' + self.data_hash,
+                             headers=self.headers)
+            sent = len(next(iter(response.response)))
+            response.close()
+
+        self.assertLess(sent, len(self.file_data))
+        self.assertEqual(sent,
+                         self.node.current['outgoing'] - before['outgoing'])
+
+    def test_file_wrapper(self):
+        """
+        Pass the stored file to the server's file wrapper and count it.
+        """
+        wrapped = []
+
+        class FileWrapper(object):
+            def __init__(self, fp, block_size):
+                wrapped.append(fp)
+                self.fp = fp
+
+            def __iter__(self):
+                return iter(lambda: self.fp.read(1024), b'')
+
+            def close(self):
+                self.fp.close()
+
+        with self.app.test_client() as c:
+            response = c.post('/api/files/', data={
+                'data_hash': self.data_hash,
+                'file_data': (BytesIO(self.file_data), 'test_file'),
+                'file_role': '000'
+            }, headers=self.headers)
+            self.assertEqual(201, response.status_code)
+
+            before = self.node.current
+            response = c.get('/api/files/' + self.data_hash,
+                             headers=self.headers, buffered=True,
+                             environ_overrides={
+                                 'wsgi.file_wrapper': FileWrapper
+                             })
+            self.assertEqual(self.file_data, response.data)
+
+        self.assertEqual(len(self.file_data), response.content_length)
+        self.assertEqual(1, len(wrapped))
+        self.assertEqual(len(self.file_data),
+                         self.node.current['outgoing'] - before['outgoing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,7 @@ import unittest
 from hashlib import sha256
 from io import BytesIO
 
-from metacore import storj
+from metacore import merkle, storj
 from metacore.database import files
 from metacore.error_codes import *
 from metacore.tests import *
@@ -128,7 +128,10 @@ class UploadFileCase(unittest.TestCase):
 
         self.assertDictEqual(
             {'data_hash': self.send_data['data_hash'],
-             'file_role': self.send_data['file_role']},
+             'file_role': self.send_data['file_role'],
+             'merkle_root': merkle.root(
+                 [self.file_data], self.app.config['MERKLE_CHUNK_SIZE']
+             )},
             json.loads(response.data.decode()),
             "Unexpected response data."
         )
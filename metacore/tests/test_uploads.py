@@ -0,0 +1,251 @@
+import sys
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from hashlib import sha256
+from io import BytesIO
+
+from metacore import blobs, merkle, storj
+from metacore.database import files, reservations, upload_sessions
+from metacore.error_codes import *
+from metacore.tests import *
+from metacore.uploads import UploadSessions
+
+if sys.version_info.major == 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+
+
+__author__ = 'karatel'
+
+
+class UploadSessionsCase(unittest.TestCase):
+    """
+    Test storing parts of resumable uploads.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.now = datetime(2016, 1, 1)
+        self.sessions = UploadSessions(self.folder, ttl=60,
+                                       clock=lambda: self.now)
+        self.session = self.sessions.open(sha256(b'data').hexdigest(), '000',
+                                          test_owner_address, 10, 4, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        upload_sessions.delete().execute()
+
+    def test_parts(self):
+        """
+        Accept parts of the expected size in any order.
+        """
+        self.assertEqual(3, self.sessions.parts_count(self.session))
+        self.assertTrue(self.sessions.save_part(self.session, 2,
+                                                BytesIO(b'89')))
+        self.assertFalse(self.sessions.save_part(self.session, 0,
+                                                 BytesIO(b'01234')))
+        self.assertFalse(self.sessions.save_part(self.session, 1,
+                                                 BytesIO(b'45')))
+        self.assertEqual([2], self.sessions.received(self.session))
+
+        self.sessions.save_part(self.session, 0, BytesIO(b'0123'))
+        self.sessions.save_part(self.session, 1, BytesIO(b'4567'))
+        self.assertEqual(b'0123456789',
+                         b''.join(self.sessions.iter_data(self.session)))
+
+    def test_expire(self):
+        """
+        Remove expired sessions with their parts.
+        """
+        self.assertEqual([], self.sessions.expire())
+
+        self.now += timedelta(seconds=61)
+        self.assertIsNone(self.sessions.get(self.session.id))
+        self.assertEqual([1], self.sessions.expire())
+        self.assertEqual([], os.listdir(self.folder))
+
+
+class ResumableUploadCase(unittest.TestCase):
+    """
+    Test uploading files by parts.
+    """
+
+    def setUp(self):
+        self.app = storj.app
+        self.app.config['TESTING'] = True
+
+        self.file_data = os.urandom(2500)
+        self.data_hash = sha256(self.file_data).hexdigest()
+        self.headers = {
+            'sender_address': test_owner_address,
+            'signature': test_btctx_api.sign_unicode(test_owner_wif,
+                                                     self.data_hash)
+        }
+
+        self.patchers = [
+            patch('metacore.processor.BTCTX_API', test_btctx_api),
+            patch.dict(self.app.config, {'UPLOAD_PART_SIZE': 1000})
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+        for folder in (self.app.config['UPLOAD_FOLDER'],
+                       self.app.config['MERKLE_FOLDER']):
+            try:
+                os.unlink(blobs.blob_path(folder, self.data_hash))
+            except OSError:
+                pass
+        files.delete().where(files.c.hash == self.data_hash).execute()
+        upload_sessions.delete().execute()
+        reservations.delete().execute()
+        shutil.rmtree(self.app.config['UPLOAD_SESSIONS_FOLDER'],
+                      ignore_errors=True)
+
+    def _open(self, client):
+        response = client.post('/api/uploads/', data={
+            'data_hash': self.data_hash,
+            'file_size': str(len(self.file_data)),
+            'file_role': '000'
+        }, headers=self.headers)
+        self.assertEqual(201, response.status_code)
+        return json.loads(response.data.decode())
+
+    def _put(self, client, session_id, number, data):
+        return client.put(
+            '/api/uploads/{}/{}'.format(session_id, number),
+            data=data, headers=self.headers
+        )
+
+    def test_resumable_upload(self):
+        """
+        Upload parts in any order, resume and commit the file.
+        """
+        with self.app.test_client() as c:
+            session = self._open(c)
+            self.assertEqual(3, session['parts_count'])
+            self.assertEqual(1, reservations.count().scalar())
+
+            for number in (2, 0):
+                response = self._put(c, session['session_id'], number,
+                                     self.file_data[number * 1000:
+                                                    (number + 1) * 1000])
+                self.assertEqual(200, response.status_code)
+
+            response = c.post(
+                '/api/uploads/{}/commit'.format(session['session_id']),
+                headers=self.headers
+            )
+            self.assertEqual(400, response.status_code)
+            self.assertEqual(ERR_TRANSFER['INCOMPLETE_UPLOAD'],
+                             json.loads(response.data.decode())['error_code'])
+
+            response = c.get('/api/uploads/' + session['session_id'],
+                             headers=self.headers)
+            self.assertEqual([0, 2], json.loads(
+                response.data.decode()
+            )['received_parts'])
+
+            self._put(c, session['session_id'], 1, self.file_data[1000:2000])
+            response = c.post(
+                '/api/uploads/{}/commit'.format(session['session_id']),
+                headers=self.headers
+            )
+            self.assertEqual(201, response.status_code)
+            self.assertEqual(
+                merkle.root([self.file_data],
+                            self.app.config['MERKLE_CHUNK_SIZE']),
+                json.loads(response.data.decode())['merkle_root']
+            )
+
+            response = c.get('/api/files/' + self.data_hash,
+                             headers=self.headers)
+            self.assertEqual(self.file_data, response.data)
+
+        self.assertEqual(0, reservations.count().scalar())
+        self.assertIsNone(upload_sessions.select().execute().first())
+
+    def test_invalid_part(self):
+        """
+        Reject parts out of range or of unexpected size.
+        """
+        with self.app.test_client() as c:
+            session = self._open(c)
+            for number, data in ((3, b'x'), (0, b'short')):
+                response = self._put(c, session['session_id'], number, data)
+                self.assertEqual(400, response.status_code)
+                self.assertEqual(
+                    ERR_TRANSFER['INVALID_PART'],
+                    json.loads(response.data.decode())['error_code']
+                )
+
+    def test_negative_size(self):
+        """
+        Reject sessions of a negative size without reserving the space.
+        """
+        with self.app.test_client() as c:
+            response = c.post('/api/uploads/', data={
+                'data_hash': self.data_hash,
+                'file_size': str(-10 ** 15),
+                'file_role': '000'
+            }, headers=self.headers)
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(ERR_TRANSFER['INVALID_SIZE'],
+                         json.loads(response.data.decode())['error_code'])
+        self.assertEqual(0, reservations.select().count().scalar())
+
+    def test_mismatched_hash(self):
+        """
+        Close the session with data mismatched with the hash.
+        """
+        corrupted = b'x' * 1000 + self.file_data[1000:]
+        with self.app.test_client() as c:
+            session = self._open(c)
+            for number in range(3):
+                self._put(c, session['session_id'], number,
+                          corrupted[number * 1000:(number + 1) * 1000])
+            response = c.post(
+                '/api/uploads/{}/commit'.format(session['session_id']),
+                headers=self.headers
+            )
+
+            self.assertEqual(400, response.status_code)
+            self.assertEqual(ERR_TRANSFER['MISMATCHED_HASH'],
+                             json.loads(response.data.decode())['error_code'])
+            self.assertEqual(404, c.get(
+                '/api/uploads/' + session['session_id'], headers=self.headers
+            ).status_code)
+
+        self.assertIsNone(files.select(
+            files.c.hash == self.data_hash
+        ).execute().first())
+        self.assertEqual(0, reservations.count().scalar())
+
+    def test_other_sender(self):
+        """
+        Hide the session from other senders.
+        """
+        with self.app.test_client() as c:
+            session = self._open(c)
+            response = c.get('/api/uploads/' + session['session_id'],
+                             headers={
+                                 'sender_address': test_other_address,
+                                 'signature': test_btctx_api.sign_unicode(
+                                     test_other_wfi, self.data_hash
+                                 )
+                             })
+
+        self.assertEqual(404, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+
+__author__ = 'karatel'
+
+
+logger = logging.getLogger(__name__)
+
+
+class Trace(object):
+    """
+    Timings of the request stages.
+    Spans of the same stage are summed up. Time of a nested span is counted
+    only in the nested stage, so the stages add up to the traced time.
+    """
+
+    def __init__(self, name=None, clock=time.time):
+        """
+        :param name: traced request description
+        :param clock: time source
+        """
+        self.name = name
+        self._clock = clock
+        self.started = clock()
+        # stage -> [seconds, number of spans]
+        self.stages = {}
+        # time of the nested spans of every open span
+        self._nested = []
+
+    @contextmanager
+    def span(self, stage):
+        """
+        Time the block as the stage.
+        :param stage: stage name
+        """
+        started = self._clock()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - started
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            timing = self.stages.setdefault(stage, [0.0, 0])
+            timing[0] += elapsed - nested
+            timing[1] += 1
+
+    def iter_span(self, stage, chunks):
+        """
+        Time getting every item of the iterable as the stage.
+        :param stage: stage name
+        :param chunks: iterable
+        :return: generator of the same items
+        """
+        iterator = iter(chunks)
+        while True:
+            with self.span(stage):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+
+    @property
+    def duration(self):
+        """
+        Get the time since the trace start.
+        :return: seconds
+        :rtype: float
+        """
+        return self._clock() - self.started
+
+    def breakdown(self):
+        """
+        Describe the timings.
+        :return: dict with the request, its duration, the time of every stage
+            and the untraced time in seconds
+        :rtype: dict
+        """
+        duration = self.duration
+        traced = sum(_[0] for _ in self.stages.values())
+        return {
+            'request': self.name,
+            'duration': round(duration, 6),
+            'stages': dict(
+                (stage, {'seconds': round(seconds, 6), 'count': count})
+                for stage, (seconds, count) in self.stages.items()
+            ),
+            'untraced': round(duration - traced, 6)
+        }
+
+
+def log_slow(trace, threshold, **details):
+    """
+    Log the stages breakdown of the request slower than the threshold.
+    The breakdown is logged as one JSON object.
+    :param trace: request Trace
+    :param threshold: duration in seconds, None disables the log
+    :param details: other values added to the breakdown
+    :return: True if the request is logged
+    :rtype: bool
+    """
+    if threshold is None:
+        return False
+
+    breakdown = trace.breakdown()
+    if breakdown['duration'] < threshold:
+        return False
+
+    breakdown.update(details)
+    logger.warning('Slow request: %s', json.dumps(breakdown, sort_keys=True))
+    return True
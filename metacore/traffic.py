@@ -0,0 +1,244 @@
+import time
+
+from sqlalchemy import and_, func, literal, select
+
+from metacore.database import engine, traffic
+
+
+__author__ = 'karatel'
+
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+DIRECTIONS = ('incoming', 'outgoing')
+
+
+class TrafficLedger(object):
+    """
+    Transferred bytes by time buckets.
+    Traffic is added to minute buckets, which are rolled up to hours and
+    then to days as they get old, so the ledger stays compact and keeps
+    the whole history. Buckets are kept in the database, so the ledger
+    is shared by all the workers.
+    """
+
+    def __init__(self, minutes_age=DAY, hours_age=30 * DAY,
+                 clock=time.time):
+        """
+        :param minutes_age: age in seconds of minute buckets rolled up
+            to hours
+        :param hours_age: age in seconds of hour buckets rolled up to days
+        :param clock: time source
+        """
+        self.minutes_age = minutes_age
+        self.hours_age = hours_age
+        self._clock = clock
+        self._rolled_up_at = None
+
+    def add(self, direction, volume):
+        """
+        Add the transferred bytes to the current minute.
+        :param direction: 'incoming' or 'outgoing'
+        :param volume: amount of bytes
+        :return: None
+        :rtype: NoneType
+        """
+        now = self._clock()
+        start = int(now) - int(now) % MINUTE
+        with engine.begin() as connection:
+            connection.execute(traffic.insert().prefix_with(
+                'OR IGNORE'
+            ).values(direction=direction, start=start, period=MINUTE,
+                     volume=0))
+            connection.execute(traffic.update().where(and_(
+                traffic.c.direction == direction,
+                traffic.c.start == start,
+                traffic.c.period == MINUTE
+            )).values(volume=traffic.c.volume + volume))
+
+        if self._rolled_up_at is None or now - self._rolled_up_at >= HOUR:
+            self.roll_up()
+
+    def window(self, seconds=None):
+        """
+        Sum the traffic over the last period.
+        Buckets overlapping the beginning of the window are counted whole.
+        :param seconds: window length in seconds, None for the whole history
+        :return: incoming and outgoing bytes
+        :rtype: dict
+        """
+        query = select([traffic.c.direction, func.sum(traffic.c.volume)])
+        if seconds is not None:
+            query = query.where(
+                traffic.c.start > self._clock() - seconds - traffic.c.period
+            )
+
+        result = dict.fromkeys(DIRECTIONS, 0)
+        result.update(query.group_by(traffic.c.direction).execute().fetchall())
+        return result
+
+    def history(self, since=0):
+        """
+        Get the traffic buckets.
+        :param since: UNIX time of the first bucket
+        :return: list of (direction, start, period, volume) ordered by time
+        :rtype: list
+        """
+        return [tuple(_) for _ in select([
+            traffic.c.direction, traffic.c.start, traffic.c.period,
+            traffic.c.volume
+        ]).where(traffic.c.start >= since).order_by(
+            traffic.c.start, traffic.c.direction
+        ).execute()]
+
+    def roll_up(self):
+        """
+        Merge old minute buckets to hours and old hour buckets to days.
+        Only whole target buckets are merged. The buckets are merged by
+        statements reading and writing at once, so the write lock is taken
+        before anything is read and concurrent workers merge every old
+        bucket once.
+        :return: None
+        :rtype: NoneType
+        """
+        now = self._clock()
+        source = traffic.alias('source')
+        with engine.begin() as connection:
+            for period, target, age in ((MINUTE, HOUR, self.minutes_age),
+                                        (HOUR, DAY, self.hours_age)):
+                cutoff = int(now - age)
+                cutoff -= cutoff % target
+                old = and_(source.c.period == period,
+                           source.c.start < cutoff)
+                target_start = source.c.start - source.c.start % target
+
+                connection.execute(traffic.insert().prefix_with(
+                    'OR IGNORE'
+                ).from_select(
+                    ['direction', 'start', 'period', 'volume'],
+                    select([source.c.direction, target_start,
+                            literal(target), literal(0)]).where(
+                        old
+                    ).group_by(source.c.direction, target_start)
+                ))
+                connection.execute(traffic.update().where(and_(
+                    traffic.c.period == target,
+                    traffic.c.start < cutoff
+                )).values(volume=traffic.c.volume + select([
+                    func.coalesce(func.sum(source.c.volume), 0)
+                ]).where(and_(
+                    old,
+                    source.c.direction == traffic.c.direction,
+                    target_start == traffic.c.start
+                )).as_scalar()))
+                connection.execute(traffic.delete().where(and_(
+                    traffic.c.period == period,
+                    traffic.c.start < cutoff
+                )))
+
+        self._rolled_up_at = now
+
+
+class CountingIterator(object):
+    """
+    Response body counting the bytes actually sent.
+    A chunk is counted when the next one is requested, so it's already
+    written. The count is reported once when the server closes the body,
+    which it does both after the end and after an abort.
+    """
+
+    def __init__(self, chunks, report):
+        """
+        :param chunks: iterable of binary chunks
+        :param report: callable taking the number of sent bytes
+        """
+        self._chunks = chunks
+        self._report = report
+        self.count = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield chunk
+            self.count += len(chunk)
+
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        if self._report is not None:
+            report, self._report = self._report, None
+            report(self.count)
+
+
+class CountingFile(object):
+    """
+    Downloaded file the server may send on its own, e.g. with sendfile(2).
+    The read bytes are reported once when the server closes the file.
+    A server sending the file without reading it doesn't tell how much
+    of it is sent, then the whole file is reported.
+    """
+
+    def __init__(self, fp, size, report, on_close=None, unread_sent=False):
+        """
+        :param fp: open binary file
+        :param size: file size
+        :param report: callable taking the number of sent bytes
+        :param on_close: callable called after the file is closed
+        :param unread_sent: the server may send the file without reading it
+        """
+        self._fp = fp
+        self._report = report
+        self._on_close = on_close
+        self._unread_sent = unread_sent
+        self.size = size
+        self.count = 0
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self.count += len(data)
+        return data
+
+    def fileno(self):
+        return self._fp.fileno()
+
+    def close(self):
+        if self._report is None:
+            return
+        report, self._report = self._report, None
+        self._fp.close()
+        report(self.size if self._unread_sent and not self.count
+               else self.count)
+        if self._on_close is not None:
+            self._on_close()
+
+
+class CountingStream(object):
+    """
+    Input stream counting the read bytes.
+    The count is reported once when the stream is closed.
+    """
+
+    def __init__(self, stream, report):
+        """
+        :param stream: wrapped file-like object
+        :param report: callable taking the number of read bytes
+        """
+        self._stream = stream
+        self._report = report
+        self.count = 0
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self.count += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._stream.readline(*args)
+        self.count += len(data)
+        return data
+
+    def close(self):
+        if self._report is not None:
+            report, self._report = self._report, None
+            report(self.count)
@@ -0,0 +1,190 @@
+import binascii
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from metacore import blobs
+from metacore.database import upload_sessions
+
+
+__author__ = 'karatel'
+
+
+class UploadSessions(object):
+    """
+    Resumable uploads of the data sent by numbered parts.
+    Sessions are kept in the database and their parts in the session
+    folders, so parts can be sent in parallel to different workers.
+    A part is renamed to its number only when it's complete, so the
+    received parts are the ones present in the folder.
+    """
+
+    def __init__(self, folder, ttl=24 * 60 * 60, clock=datetime.now,
+                 durability=blobs.DURABILITY_NONE):
+        """
+        :param folder: folder of the sessions parts
+        :param ttl: lifetime of an unfinished session in seconds
+        :param clock: time source
+        :param durability: durability level of the saved parts
+        """
+        self.folder = folder
+        self.ttl = ttl
+        self.durability = durability
+        self._clock = clock
+
+    def open(self, data_hash, role, owner, size, part_size, reservation_id):
+        """
+        Start a new session.
+        :param data_hash: SHA-256 hash of the uploaded data
+        :param role: file role
+        :param owner: sender's BitCoin address
+        :param size: data size in bytes
+        :param part_size: size of every part but the last one in bytes
+        :param reservation_id: id of the space reservation for the data
+        :return: session record
+        """
+        session_id = binascii.hexlify(os.urandom(16)).decode()
+        os.makedirs(self._session_folder(session_id))
+        upload_sessions.insert().values(
+            id=session_id,
+            data_hash=data_hash,
+            role=role,
+            owner=owner,
+            size=size,
+            part_size=part_size,
+            reservation_id=reservation_id,
+            expires_at=self._clock() + timedelta(seconds=self.ttl)
+        ).execute()
+        return self.get(session_id)
+
+    def get(self, session_id):
+        """
+        Get the unexpired session.
+        :param session_id: session id
+        :return: session record or None
+        """
+        return upload_sessions.select(
+            (upload_sessions.c.id == session_id) &
+            (upload_sessions.c.expires_at > self._clock())
+        ).execute().first()
+
+    @staticmethod
+    def parts_count(session):
+        """
+        Get the number of parts of the session data.
+        :param session: session record
+        :rtype: int
+        """
+        return max(1, (session.size + session.part_size - 1) //
+                   session.part_size)
+
+    @staticmethod
+    def part_size(session, number):
+        """
+        Get the expected size of the part.
+        :param session: session record
+        :param number: part number
+        :rtype: int
+        """
+        return min(session.part_size,
+                   session.size - number * session.part_size)
+
+    def received(self, session):
+        """
+        Get the numbers of the received parts.
+        :param session: session record
+        :return: sorted part numbers
+        :rtype: list
+        """
+        try:
+            names = os.listdir(self._session_folder(session.id))
+        except OSError:
+            return []
+        return sorted(int(_) for _ in names if _.isdigit())
+
+    def save_part(self, session, number, stream):
+        """
+        Save the part data, replacing the previous one.
+        :param session: session record
+        :param number: part number
+        :param stream: file-like object with the part data
+        :return: True if the part has the expected size
+        :rtype: bool
+        """
+        expected_size = self.part_size(session, number)
+        temp_path = blobs.write_temp(
+            self._session_folder(session.id),
+            _read_limited(stream, expected_size + 1)
+        )
+        if os.path.getsize(temp_path) != expected_size:
+            os.unlink(temp_path)
+            return False
+
+        blobs.commit(temp_path, self._part_path(session.id, number),
+                     self.durability)
+        return True
+
+    def iter_data(self, session):
+        """
+        Read the received data part by part.
+        :param session: session record
+        :return: generator of binary chunks
+        """
+        for number in range(self.parts_count(session)):
+            for chunk in blobs.iter_file(self._part_path(session.id, number)):
+                yield chunk
+
+    def claim(self, session_id):
+        """
+        Take the session for finishing, so no other worker finishes it.
+        :param session_id: session id
+        :return: True if the session is taken by this call
+        :rtype: bool
+        """
+        return upload_sessions.delete().where(
+            (upload_sessions.c.id == session_id) &
+            (upload_sessions.c.expires_at > self._clock())
+        ).execute().rowcount == 1
+
+    def remove(self, session_id):
+        """
+        Remove the session parts.
+        :param session_id: session id
+        """
+        shutil.rmtree(self._session_folder(session_id), ignore_errors=True)
+
+    def expire(self):
+        """
+        Remove the expired sessions with their parts.
+        :return: reservation ids of the removed sessions
+        :rtype: list
+        """
+        expired = upload_sessions.select(
+            upload_sessions.c.expires_at <= self._clock()
+        ).execute().fetchall()
+
+        for session in expired:
+            upload_sessions.delete().where(
+                upload_sessions.c.id == session.id
+            ).execute()
+            self.remove(session.id)
+
+        return [_.reservation_id for _ in expired]
+
+    def _session_folder(self, session_id):
+        return os.path.join(self.folder, session_id)
+
+    def _part_path(self, session_id, number):
+        return os.path.join(self._session_folder(session_id), str(number))
+
+
+def _read_limited(stream, limit):
+    """
+    Read the stream chunk by chunk, but no more than limit bytes.
+    """
+    while limit > 0:
+        chunk = stream.read(min(blobs.CHUNK_SIZE, limit))
+        if not chunk:
+            return
+        limit -= len(chunk)
+        yield chunk
@@ -17,6 +17,9 @@ setup(
     test_suite='metacore.tests',
     entry_points={
         'console_scripts':
-            ['metacore = metacore.storj:main']
+            ['metacore = metacore.storj:main',
+             'metacore-reconcile = metacore.reconcile:main',
+             'metacore-scrub = metacore.scrubber:main',
+             'metacore-blacklist = metacore.blacklist:main']
     }
 )